@@ -12,6 +12,7 @@ from django.utils.encoding import force_str
 from django.utils.html import escape, format_html
 from django.utils.translation import gettext_lazy as gettext, ngettext
 
+from .ajax_util import clear_auth_cache
 from .forms import (
     ClerkGenerationForm,
     UITextForm,
@@ -493,6 +494,7 @@ class CounterAdmin(admin.ModelAdmin):
     @with_description(gettext("Reset Counter usage status"))
     def reset_use(self, request, queryset):
         queryset.update(private_key=None)
+        clear_auth_cache()
 
 
 admin.site.register(ReceiptExtraRow)
@@ -520,8 +522,9 @@ class ItemTypeAdmin(admin.ModelAdmin):
 class ItemAdmin(admin.ModelAdmin):
     @with_description(gettext(u"Re-generate bar codes for items"))
     def _regen_barcode(self, request, queryset):
-        for item in queryset:
-            item.code = Item.gen_barcode()
+        items = list(queryset)
+        for item, code in zip(items, Item.gen_barcodes(len(items))):
+            item.code = code
             item.save(update_fields=["code"])
 
     def get_actions(self, request):
@@ -1,8 +1,11 @@
+import copy
 import functools
 import inspect
 import json
+import time
 import typing
 
+from django.conf import settings
 from django.db import transaction
 from django.http.response import (
     Http404,
@@ -11,9 +14,15 @@ from django.http.response import (
     StreamingHttpResponse,
 )
 from django.shortcuts import get_object_or_404
+from django.utils.module_loading import import_string
 from django.utils.translation import gettext as _
 from django.views.decorators.http import require_http_methods
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from .models import (
     Clerk,
     Counter,
@@ -49,6 +58,110 @@ class AjaxError(Exception):
         )
 
 
+class JsonSerializer(object):
+    """
+    Serializer for AJAX function results, using standard library json.
+    Subclasses can override `dumps` to use another encoder.
+    """
+    content_type = "application/json"
+
+    # Amount of list elements encoded into one chunk when streaming.
+    chunk_size = 500
+
+    def dumps(self, value) -> bytes:
+        return json.dumps(value).encode("utf-8")
+
+    def iter_list(self, values: typing.Iterable) -> typing.Iterator[bytes]:
+        """
+        Encode a list incrementally into chunks containing `chunk_size` elements each.
+        The joined chunks form a JSON array.
+        """
+        separator = b"["
+        chunk = []
+        for value in values:
+            chunk.append(value)
+            if len(chunk) >= self.chunk_size:
+                yield separator + self._encode_elements(chunk)
+                separator = b","
+                chunk = []
+        if chunk:
+            yield separator + self._encode_elements(chunk)
+        elif separator == b"[":
+            yield separator
+        yield b"]"
+
+    def _encode_elements(self, values: list) -> bytes:
+        # Encode as an array and strip the brackets, so the encoder is called once per chunk.
+        return self.dumps(values)[1:-1]
+
+
+class OrjsonSerializer(JsonSerializer):
+    """
+    Serializer using orjson. Values that orjson cannot encode (e.g. too large integers)
+    are encoded with standard library json instead.
+    """
+    def dumps(self, value) -> bytes:
+        try:
+            return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            return super().dumps(value)
+
+
+def _make_serializer() -> JsonSerializer:
+    name = getattr(settings, "KIRPPU_AJAX_SERIALIZER", None)
+    if name:
+        return import_string(name)()
+    if orjson is not None:
+        return OrjsonSerializer()
+    return JsonSerializer()
+
+
+_serializer: typing.Optional[JsonSerializer] = None
+
+
+def reset_serializer(setting=None, **kwargs):
+    """
+    Forget the cached serializer, so it is created again on next use. Usable as `setting_changed` receiver.
+    """
+    global _serializer
+    if setting is None or setting == "KIRPPU_AJAX_SERIALIZER":
+        _serializer = None
+
+
+def get_serializer() -> JsonSerializer:
+    """
+    Get serializer for AJAX results. The class is read from KIRPPU_AJAX_SERIALIZER setting,
+    or if it is not set, orjson is used if it is installed.
+    """
+    global _serializer
+    if _serializer is None:
+        _serializer = _make_serializer()
+    return _serializer
+
+
+def make_json_response(result):
+    """
+    Make HTTP response from AJAX function result.
+
+    Generators, and lists longer than KIRPPU_AJAX_STREAM_THRESHOLD, are streamed as JSON array
+    in chunks instead of encoding the whole response at once.
+    """
+    serializer = get_serializer()
+    threshold = getattr(settings, "KIRPPU_AJAX_STREAM_THRESHOLD", None)
+    if inspect.isgenerator(result) or (
+            threshold is not None and isinstance(result, list) and len(result) > threshold):
+        return StreamingHttpResponse(
+            serializer.iter_list(result),
+            status=200,
+            content_type=serializer.content_type,
+        )
+    return HttpResponse(
+        serializer.dumps(result),
+        status=200,
+        content_type=serializer.content_type,
+    )
+
+
 class AjaxFunc(object):
     def __init__(self, func, url, method):
         self.name = func.__name__               # name of the view function
@@ -103,7 +216,7 @@ def ajax_func(original, method='POST', params=None, defaults=None, staff_overrid
         @functools.wraps(func)
         def wrapper(request, event_slug, **kwargs):
             # Prevent access if checkout is not active.
-            event = get_object_or_404(Event, slug=event_slug)
+            event = get_event_or_404(event_slug)
             if not staff_override and not event.checkout_active:
                 raise Http404()
 
@@ -138,19 +251,95 @@ def ajax_func(original, method='POST', params=None, defaults=None, staff_overrid
             if isinstance(result, (HttpResponse, StreamingHttpResponse)):
                 return result
             else:
-                return HttpResponse(
-                    json.dumps(result),
-                    status=200,
-                    content_type='application/json',
-                )
+                return make_json_response(result)
         return wrapper
 
     return decorator
 
 
+# Process-local Event cache: slug -> (version, expiry time, Event).
+# The version is incremented whenever any Event is saved or deleted. Lookups that started before
+# an invalidation will not store their (possibly stale) result.
+_event_cache: typing.Dict[str, typing.Tuple[int, float, Event]] = {}
+_event_cache_version = 0
+
+
+def invalidate_event_cache(*args, **kwargs):
+    """
+    Invalidate the process-local Event cache. Usable as signal receiver.
+    """
+    global _event_cache_version
+    _event_cache_version += 1
+    _event_cache.clear()
+
+
+def get_event_or_404(event_slug) -> Event:
+    """
+    Get Event by slug, using process-local cache for at most KIRPPU_EVENT_CACHE_SECONDS.
+
+    The returned object is a copy of the cached instance, so it may be modified freely.
+    Remote Event of the cached instance is resolved beforehand, so the copies share it.
+
+    :raises Http404: If the Event does not exist.
+    """
+    ttl = getattr(settings, "KIRPPU_EVENT_CACHE_SECONDS", 0)
+    if ttl <= 0:
+        return get_object_or_404(Event, slug=event_slug)
+
+    version = _event_cache_version
+    entry = _event_cache.get(event_slug)
+    if entry is not None and entry[0] == version and entry[1] > time.monotonic():
+        return copy.copy(entry[2])
+
+    event = get_object_or_404(Event, slug=event_slug)
+    if event.source_db:
+        event.get_real_event()
+
+    if version == _event_cache_version:
+        _event_cache[event_slug] = (version, time.monotonic() + ttl, copy.copy(event))
+    return event
+
+
+# Process-local cache of validated session objects: (model name, pk, key) -> (expiry time, instance).
+# Validity is kept short with KIRPPU_AUTH_CACHE_SECONDS, and the cache is cleared when Clerks or Counters change.
+_auth_cache: typing.Dict[typing.Tuple[str, int, str], typing.Tuple[float, typing.Any]] = {}
+
+
+def clear_auth_cache(*args, **kwargs):
+    """
+    Clear the process-local Clerk and Counter cache.
+    Usable as signal receiver, and must be called if Clerks or Counters are modified with `QuerySet.update`.
+    """
+    _auth_cache.clear()
+
+
+def _get_auth_object(model, pk, key, key_field, query):
+    """
+    Get a model instance with given pk whose `key_field` matches the key, using the process-local cache.
+
+    :return: Copy of the cached instance, or None if the key does not match.
+    :raises model.DoesNotExist: If the object is not found.
+    """
+    ttl = getattr(settings, "KIRPPU_AUTH_CACHE_SECONDS", 0)
+    cache_key = (model.__name__, pk, key)
+    if ttl > 0:
+        entry = _auth_cache.get(cache_key)
+        if entry is not None and entry[0] > time.monotonic():
+            return copy.copy(entry[1])
+
+    instance = query.get(pk=pk)
+    if getattr(instance, key_field) != key:
+        return None
+
+    if ttl > 0:
+        _auth_cache[cache_key] = (time.monotonic() + ttl, copy.copy(instance))
+    return instance
+
+
 def get_counter(request) -> Counter:
     """
     Get the Counter object associated with a request.
+    The result is memoized in the request for the current session values.
 
     Raise AjaxError if session is invalid or counter is not found.
     """
@@ -159,25 +348,32 @@ def get_counter(request) -> Counter:
 
     counter_id = request.session["counter"]
     counter_key = request.session["counter_key"]
+
+    memo = getattr(request, "_kirppu_counter", None)
+    if memo is not None and memo[0] == (counter_id, counter_key):
+        return memo[1]
+
     try:
-        counter_object = Counter.objects.get(pk=counter_id)
+        counter_object = _get_auth_object(Counter, counter_id, counter_key, "private_key", Counter.objects)
     except Counter.DoesNotExist:
         raise AjaxError(
             RET_UNAUTHORIZED,
             _(u"Counter has gone missing."),
         )
-    if counter_object.private_key != counter_key:
+    if counter_object is None:
         raise AjaxError(
             RET_UNAUTHORIZED,
             _("Unauthorized")
         )
 
+    request._kirppu_counter = ((counter_id, counter_key), counter_object)
     return counter_object
 
 
 def get_clerk(request) -> Clerk:
     """
     Get the Clerk object associated with a request.
+    The result is memoized in the request for the current session values.
 
     Raise AjaxError if session is invalid or clerk is not found.
     """
@@ -188,17 +384,35 @@ def get_clerk(request) -> Clerk:
     clerk_id = request.session["clerk"]
     clerk_token = request.session["clerk_token"]
 
+    memo = getattr(request, "_kirppu_clerk", None)
+    if memo is not None and memo[0] == (clerk_id, clerk_token):
+        return memo[1]
+
     try:
-        clerk_object = Clerk.objects.get(pk=clerk_id)
+        clerk_object = _get_auth_object(Clerk, clerk_id, clerk_token, "access_key", Clerk.prefetch_manager)
     except Clerk.DoesNotExist:
         raise AjaxError(RET_UNAUTHORIZED, _(u"Clerk not found."))
 
-    if clerk_object.access_key != clerk_token:
+    if clerk_object is None:
         raise AjaxError(RET_UNAUTHORIZED, _(u"Bye."))
 
+    request._kirppu_clerk = ((clerk_id, clerk_token), clerk_object)
     return clerk_object
 
 
+def get_clerk_permission(request, clerk: Clerk) -> EventPermission:
+    """
+    Get EventPermission of the given Clerk, memoized in the request.
+    """
+    memo = getattr(request, "_kirppu_clerk_permission", None)
+    if memo is not None and memo[0] == clerk.pk:
+        return memo[1]
+
+    permission = EventPermission.get(clerk.event, clerk.user)
+    request._kirppu_clerk_permission = (clerk.pk, permission)
+    return permission
+
+
 def require_user_features(counter=True, clerk=True, overseer=False, staff_override=False):
     def out_w(func):
         @functools.wraps(func)
@@ -214,7 +428,7 @@ def require_user_features(counter=True, clerk=True, overseer=False, staff_overri
                 # Thus call raises if clerk is not found.
                 clerk_obj = get_clerk(request)
 
-                if overseer and not EventPermission.get(clerk_obj.event, clerk_obj.user).can_perform_overseer_actions:
+                if overseer and not get_clerk_permission(request, clerk_obj).can_perform_overseer_actions:
                     raise AjaxError(RET_FORBIDDEN, _(u"Access denied."))
 
             return func(request, *args, **kwargs)
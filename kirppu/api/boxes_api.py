@@ -130,15 +130,15 @@ def box_item_reserve(request, event, box_number, box_item_count="1"):
         items.update(state=Item.STAGED)
 
         ReceiptItem.objects.bulk_create(rows)
-        receipt.calculate_total()
+        receipt.add_to_total(sum(row.item.price for row in rows))
         receipt.save(update_fields=("total",))
 
         result_items = [
             {
-                "code": entry["code"],
-                "price": decimal_to_transport(entry["price"]),
+                "code": row.item.code,
+                "price": decimal_to_transport(row.item.price),
             }
-            for entry in items.values("code", "price")
+            for row in rows
         ]
         ret = box.as_dict()
         del ret["item_price"]  # item_price assumes representative item has same price as ones being reserved.
@@ -198,7 +198,7 @@ def box_item_release(request, event, box_number, box_item_count="1"):
             "price": decimal_to_transport(removal_entry.item.price),
         })
 
-    receipt.calculate_total()
+    # remove_item_from_receipt has already adjusted the total in memory.
     receipt.save(update_fields=("total",))
 
     ret = box.as_dict()
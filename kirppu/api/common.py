@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+import json
+
+from django.db.models import F
 from django.http import Http404
 from django.utils.translation import gettext as _
 
@@ -39,6 +42,42 @@ def get_item_or_404(code, for_update=False, event=None, **kwargs):
     return item
 
 
+def get_items_by_code(codes, for_update=False, **kwargs):
+    """
+    Find multiple Items by barcode with a single query.
+
+    :param codes: Item barcodes to find.
+    :type codes: list[str]
+    :param for_update: If True, Items are retrieved for update.
+    :param kwargs: Extra query filters.
+    :return: Dictionary of found Items by their code. Codes that were not found are not present.
+    :rtype: dict[str, Item]
+    """
+    query = Item.objects.annotate(vendor_event=F("vendor__event__id")).select_related("itemtype")
+    if for_update:
+        # Lock only the Items, not the joined rows.
+        query = query.select_for_update(of=("self",))
+    return {item.code: item for item in query.filter(code__in=codes, **kwargs)}
+
+
+def parse_code_list(codes):
+    """
+    Parse JSON encoded list of Item barcodes.
+
+    :param codes: JSON string containing a list of strings.
+    :type codes: str
+    :rtype: list[str]
+    :raises AjaxError: If the value is not a valid list of codes.
+    """
+    try:
+        result = json.loads(codes)
+    except ValueError:
+        raise AjaxError(RET_BAD_REQUEST, "codes must be a JSON list")
+    if not isinstance(result, list) or not all(isinstance(code, str) for code in result):
+        raise AjaxError(RET_BAD_REQUEST, "codes must be a JSON list of strings")
+    return result
+
+
 def get_box_or_404(box_number, event, for_update=False, **kwargs):
     """
     :param box_number: Number of the box to find.
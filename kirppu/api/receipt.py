@@ -112,9 +112,9 @@ def list_accounts(request, event):
 def _with_note(receipt, receipt_note=None):
     r = receipt.as_transfer_dict()
     if receipt_note is None:
-        note_instance = receipt.receiptnote_set.first()
-        if note_instance is not None:
-            note = note_instance.as_dict()
+        notes = receipt.notes_in_order()
+        if notes:
+            note = notes[0].as_dict()
         else:
             note = "<missing>"
     else:
@@ -131,6 +131,7 @@ def list_transfers(request, event):
         Receipt.objects
         .filter(type=Receipt.TYPE_TRANSFER, status=Receipt.FINISHED, counter__event=event)
         .order_by("start_time")
+        .for_listing()
     )
     return [_with_note(t) for t in transfers]
 
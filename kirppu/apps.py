@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 
 from django.apps import AppConfig
-from django.db.models.signals import pre_delete, pre_save
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 
 __all__ = [
     "KirppuApp",
@@ -15,4 +16,12 @@ class KirppuApp(AppConfig):
         from .signals import delete_handler, save_handler
         pre_delete.connect(delete_handler)
         pre_save.connect(save_handler)
+
+        from .ajax_util import clear_auth_cache, invalidate_event_cache, reset_serializer
+        for model in ("kirppu.Clerk", "kirppu.Counter"):
+            post_save.connect(clear_auth_cache, sender=model)
+            post_delete.connect(clear_auth_cache, sender=model)
+        post_save.connect(invalidate_event_cache, sender="kirppu.Event")
+        post_delete.connect(invalidate_event_cache, sender="kirppu.Event")
+        setting_changed.connect(reset_serializer)
         super().ready()
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks for performance sensitive parts of Kirppu.
+
+Run a benchmark with, e.g., `DEBUG=1 python -m kirppu.benchmarks.serialization`.
+"""
+import os
+import timeit
+import typing
+
+
+def setup_django():
+    """Configure Django for a standalone benchmark run."""
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "kirppu_project.settings")
+    import django
+    django.setup()
+
+
+def measure(fn: typing.Callable[[], typing.Any], repeat: int = 5, number: int = 1) -> float:
+    """
+    Measure best run time of `fn`.
+
+    :return: Best time of `repeat` runs, in seconds per single call.
+    """
+    return min(timeit.repeat(fn, repeat=repeat, number=number)) / number
+
+
+def report(title: str, results: typing.Dict[str, float], baseline: str = None):
+    """Print timing results, optionally relative to given baseline result."""
+    print(title)
+    base = results[baseline] if baseline is not None else None
+    for name, value in results.items():
+        line = "  {0:<24} {1:10.2f} ms".format(name, value * 1000)
+        if base:
+            line += "  {0:6.2f}x".format(base / value)
+        print(line)
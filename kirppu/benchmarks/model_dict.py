@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Compare accessor based `model_dict_fn` against the previous interpreting implementation with `Item.as_dict`.
+
+    DEBUG=1 python -m kirppu.benchmarks.model_dict [item count]
+"""
+import sys
+from decimal import Decimal
+
+from . import measure, report, setup_django
+
+
+def interpreting_model_dict_fn(*args, **kwargs):
+    """The previous `model_dict_fn` implementation, for reference."""
+    access = kwargs.pop("__access_fn", lambda self, value: getattr(self, value))
+    extend = kwargs.pop("__extend", None)
+    fields = {}
+    if extend:
+        fields.update(extend.fields)
+    for plain_key in args:
+        fields[plain_key] = plain_key
+    fields.update(kwargs)
+
+    def model_dict(self, exclude=None):
+        exclude = exclude or ()
+        ret = {}
+        for key, value in fields.items():
+            if key in exclude:
+                continue
+            if callable(value):
+                ret[key] = value(self)
+            elif value is None:
+                if value in ret:
+                    del ret[value]
+            else:
+                ret[key] = access(self, value)
+                if callable(ret[key]):
+                    ret[key] = ret[key]()
+        return ret
+    model_dict.fields = fields
+    return model_dict
+
+
+def main(count: int):
+    from ..models import Item, ItemType
+
+    item_type = ItemType(id=1, order=1, title="Manga")
+    items = [
+        Item(code="%08X" % i, name="Item %d" % i, price=Decimal("1.50") + i % 40, vendor_id=i % 100,
+             itemtype=item_type)
+        for i in range(count)
+    ]
+    interpreted = interpreting_model_dict_fn(*(), **Item.as_dict.fields)
+    resolved = Item.as_dict
+    assert interpreted(items[0]) == resolved(items[0])
+
+    results = {
+        "interpreting": measure(lambda: [interpreted(i) for i in items], repeat=3),
+        "resolved": measure(lambda: [resolved(i) for i in items], repeat=3),
+    }
+    report("Item.as_dict for %d items" % count, results, baseline="interpreting")
+
+
+if __name__ == "__main__":
+    setup_django()
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Compare AJAX result serializers with an `item/search` shaped result.
+
+    DEBUG=1 python -m kirppu.benchmarks.serialization [item count]
+"""
+import sys
+from decimal import Decimal
+
+from . import measure, report, setup_django
+
+
+def make_search_result(count: int) -> list:
+    """Construct `item_search` like result using unsaved model instances."""
+    from ..models import Item, ItemType, Vendor
+    from kirppuauth.models import User
+
+    item_type = ItemType(id=1, order=1, title="Manga")
+    vendors = [
+        Vendor(id=i, user=User(username="vendor%d" % i, first_name="First", last_name="Last%d" % i,
+                                email="vendor%d@example.com" % i, phone="+358 40 %07d" % i))
+        for i in range(1, 100)
+    ]
+
+    result = []
+    for i in range(count):
+        vendor = vendors[i % len(vendors)]
+        item = Item(
+            code="%08X" % i,
+            name="Item name number %d" % i,
+            price=Decimal("1.50") + i % 40,
+            vendor=vendor,
+            itemtype=item_type,
+        )
+        item_dict = item.as_dict()
+        item_dict["vendor"] = vendor.as_dict()
+        result.append(item_dict)
+    return result
+
+
+def main(count: int):
+    from ..ajax_util import JsonSerializer, OrjsonSerializer, orjson
+
+    data = make_search_result(count)
+    serializers = {"json": JsonSerializer()}
+    if orjson is not None:
+        serializers["orjson"] = OrjsonSerializer()
+    else:
+        print("orjson is not installed, only standard library json is measured.")
+
+    results = {}
+    for name, serializer in serializers.items():
+        results[name + " dumps"] = measure(lambda: serializer.dumps(data))
+        results[name + " stream"] = measure(lambda: b"".join(serializer.iter_list(data)))
+
+    report("Serialization of %d item_search rows" % count, results, baseline="json dumps")
+    print("Result size: %d bytes" % len(serializers["json"].dumps(data)))
+
+
+if __name__ == "__main__":
+    setup_django()
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
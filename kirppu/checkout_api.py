@@ -2,6 +2,7 @@ import logging
 import math
 import random
 import typing
+from datetime import timedelta
 
 from django.conf import settings
 
@@ -17,13 +18,17 @@ from django.shortcuts import (
     get_object_or_404,
     render,
 )
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
 from django.utils.translation import gettext as _
 from django.utils.timezone import now
 from ipware.ip import get_client_ip
 
 from .api.common import (
     get_item_or_404 as _get_item_or_404,
+    get_items_by_code as _get_items_by_code,
     item_state_conflict as _item_state_conflict,
+    parse_code_list as _parse_code_list,
     get_receipt,
 )
 from .provision import Provision
@@ -39,8 +44,10 @@ from .models import (
     ReceiptItem,
     ReceiptExtraRow,
     Vendor,
+    VendorLedgerEntry,
     VendorNote,
     ItemStateLog,
+    ItemStateLogRollup,
     Box,
     TemporaryAccessPermit,
     TemporaryAccessPermitLog,
@@ -49,6 +56,7 @@ from .models import (
 )
 from .fields import ItemPriceField
 from .forms import remove_item_from_receipt
+from .util import accepts_gzip
 
 from . import ajax_util, stats
 from .ajax_util import (
@@ -88,6 +96,46 @@ def raise_if_item_not_available(item):
     return None
 
 
+def _many_result(code, status=200, result=None, message=None):
+    """Construct result entry for single code of a multi-code request."""
+    entry = {
+        "code": code,
+        "status": status,
+    }
+    if result is not None:
+        entry["result"] = result
+    if message is not None:
+        entry["message"] = message
+    return entry
+
+
+def _many_find_item(items, code, event, seen):
+    """
+    Find item for a code of a multi-code request.
+
+    :raises AjaxError: If the code is not found, is from another event, or is repeated in the request.
+    """
+    item = items.get(code)
+    if item is None:
+        raise AjaxError(404, _("No item found matching {0}").format("'%s'" % code))
+    if item.vendor_event != event.id:
+        raise AjaxError(RET_CONFLICT, "Item is not registered in this event!")
+    if code in seen:
+        raise AjaxError(RET_CONFLICT, "Item is given multiple times.")
+    seen.add(code)
+    return item
+
+
+def _many_resolve_items(results):
+    """
+    Replace Items in results with their dictionaries. Used when the Items are changed after
+    the result entries have been constructed.
+    """
+    for entry in results:
+        if isinstance(entry.get("result"), Item):
+            entry["result"] = entry["result"].as_dict()
+
+
 def checkout_js(request, event_slug):
     """
     Render the JavaScript file that defines the AJAX API functions.
@@ -157,7 +205,8 @@ def clerk_login(request, event, code, counter):
     clerk_data['overseer_enabled'] = oversee
     clerk_data['stats_enabled'] = oversee or permissions.can_see_statistics
 
-    active_receipts = Receipt.objects.filter(clerk=clerk, status=Receipt.PENDING, type=Receipt.TYPE_PURCHASE)
+    active_receipts = Receipt.objects.filter(
+        clerk=clerk, status=Receipt.PENDING, type=Receipt.TYPE_PURCHASE).for_listing()
     if active_receipts:
         if len(active_receipts) > 1:
             clerk_data["receipts"] = [receipt.as_dict() for receipt in active_receipts]
@@ -409,6 +458,9 @@ def item_edit(request, event, code, price, state):
     if state not in {st for (st, _) in Item.STATE}:
         raise AjaxError(RET_BAD_REQUEST, 'Unknown state: {0}'.format(state))
 
+    # The item may be removed from a finished receipt, which updates the ledger of its vendor.
+    # Lock the vendor before the item, as in item check-in.
+    VendorLedgerEntry.objects.lock_vendors(Q(pk__in=Item.objects.filter(code=code).values("vendor")))
     item = _get_item_or_404(code, for_update=True, event=event)
     if item.box_id is not None:
         return _box_edit(request, item.box, price, state)
@@ -449,7 +501,7 @@ def _item_edit(request, item, price, state):
             ).values_list('receipt_id', flat=True)
 
             for receipt_id in receipt_ids:
-                receipt = Receipt.objects.get(pk=receipt_id)
+                receipt = Receipt.objects.select_for_update().get(pk=receipt_id)
                 remove_item_from_receipt(request, item, receipt)
                 account_id = receipt.dst_account_id
                 Account.objects.filter(pk=account_id).update(balance=F("balance") - price)
@@ -465,6 +517,8 @@ def _item_edit(request, item, price, state):
             )
 
     item.state = state
+    if "price" in updates:
+        ItemStateLogRollup.objects.add_price_changes([item], price)
     item.price = price
     item.save(update_fields=updates)
 
@@ -484,6 +538,7 @@ def _box_edit(request, box, price, state):
         raise AjaxError(RET_CONFLICT, "Available box item prices are in conflicting state")
 
     if price != any_item.price:
+        ItemStateLogRollup.objects.add_price_changes(available_items, price)
         available_items.update(price=price)
 
     representative = box.representative_item
@@ -696,6 +751,78 @@ def item_checkin(request, event, code, vendor: int, note: typing.Optional[str] =
     return result
 
 
+@ajax_func('^item/checkin_many$', atomic=True)
+def item_checkin_many(request, event, codes, vendor: int):
+    """
+    Check in multiple single items of one vendor at once.
+
+    Result contains an entry for each code in same order as the codes were given.
+    Boxes are not checked in, but their box number is assigned like in `item_checkin`.
+    """
+    codes = _parse_code_list(codes)
+    try:
+        # Locking the vendor serializes concurrent check-ins of the vendor for the brought item limit.
+        vendor = Vendor.objects.select_for_update().get(pk=int(vendor), event=event)
+    except (ValueError, Vendor.DoesNotExist):
+        raise AjaxError(RET_BAD_REQUEST, _(u"Invalid vendor id"))
+    if not vendor.terms_accepted:
+        raise AjaxError(500, _(u"Vendor has not accepted terms!"))
+
+    items = _get_items_by_code(codes, for_update=True)
+
+    brought_count = None
+    if event.max_brought_items is not None:
+        brought_count = Item.get_brought_count(event, vendor)
+
+    seen = set()
+    results = []
+    accepted = []
+    for code in codes:
+        try:
+            item = _many_find_item(items, code, event, seen)
+        except AjaxError as e:
+            results.append(_many_result(code, e.status, message=e.message))
+            continue
+
+        if item.state != Item.ADVERTISED:
+            results.append(_many_result(
+                code, RET_CONFLICT, message=_(u"Unexpected item state: {state_name} ({state})").format(
+                    state=item.state,
+                    state_name=item.get_state_display()
+                )))
+        elif item.vendor_id != vendor.pk:
+            results.append(_many_result(code, RET_ACCEPTED, item.as_dict(), message="NOT CHANGED"))
+        elif item.box_id is not None:
+            # Boxes must be checked in via box_checkin, as in item_checkin.
+            box = item.box
+            box.assign_box_number()
+            response = item.as_dict()
+            response["box"] = box.as_dict()
+            results.append(_many_result(code, RET_ACCEPTED, response, message="OTHER API"))
+        elif brought_count is not None and brought_count + 1 > event.max_brought_items:
+            results.append(_many_result(
+                code, RET_CONFLICT, message=_("Too many items brought, limit is %i!") % event.max_brought_items))
+        else:
+            if brought_count is not None:
+                brought_count += 1
+            accepted.append(item)
+            results.append(_many_result(code, result=item))
+
+    if accepted:
+        ItemStateLog.objects.log_states(item_set=accepted, new_state=Item.BROUGHT, request=request)
+        Item.objects.filter(pk__in=[item.pk for item in accepted]).update(state=Item.BROUGHT, hidden=False)
+        for item in accepted:
+            item.state = Item.BROUGHT
+            item.hidden = False
+
+    _many_resolve_items(results)
+
+    ret = {"items": results}
+    if brought_count is not None:
+        ret["_item_limit_left"] = event.max_brought_items - brought_count
+    return ret
+
+
 @ajax_func('^item/checkout$', atomic=True)
 def item_checkout(request, event, code, vendor=None):
     item = _get_item_or_404(code, for_update=True, event=event)
@@ -754,7 +881,7 @@ def item_compensate_start(request, event, vendor):
         raise AjaxError(RET_BAD_REQUEST)
 
     clerk = get_clerk(request)
-    counter = Counter.objects.get(pk=request.session["counter"])
+    counter = get_counter(request)
 
     receipt = Receipt(
         clerk=clerk,
@@ -780,7 +907,7 @@ def item_compensate(request, event, code):
     item_dict = item_mode_change(request, item, Item.SOLD, Item.COMPENSATED)
 
     ReceiptItem.objects.create(item=item, receipt=receipt)
-    receipt.calculate_total()
+    receipt.add_to_total(item.price)
     receipt.save(update_fields=("total",))
 
     return item_dict
@@ -802,7 +929,7 @@ def box_item_compensate(request, event, pk, box_code):
     item_dict["pk"] = item.pk
 
     ReceiptItem.objects.create(item=item, receipt=receipt)
-    receipt.calculate_total()
+    receipt.add_to_total(item.price)
     receipt.save(update_fields=("total",))
 
     return item_dict
@@ -823,6 +950,7 @@ def item_compensate_end(request, event):
         with transaction.atomic():
             receipt = Receipt.objects.select_for_update().get(
                 pk=receipt_pk, type=Receipt.TYPE_COMPENSATION, status=Receipt.PENDING)
+            VendorLedgerEntry.objects.lock_receipt_vendors(receipt)
 
             provision = Provision(vendor_id=vendor_id, provision_function=event.provision_function, receipt=receipt)
             if provision.has_provision:
@@ -855,6 +983,9 @@ def item_compensate_end(request, event):
             state = "account"
             Account.objects.filter(pk=account_id).update(balance=F("balance") - total)
 
+            state = "ledger"
+            VendorLedgerEntry.objects.record(receipt)
+
     except IntegrityError:
         if state == "account":
             account_balance = Account.objects.get(pk=account_id).balance
@@ -1018,7 +1149,7 @@ def item_reserve(request, event, code):
 
         ReceiptItem.objects.create(item=item, receipt=receipt)
         # receipt.items.create(item=item)
-        receipt.calculate_total()
+        receipt.add_to_total(item.price)
         receipt.save(update_fields=("total",))
 
         ret = item.as_dict()
@@ -1031,6 +1162,59 @@ def item_reserve(request, event, code):
         raise AjaxError(RET_CONFLICT)
 
 
+@ajax_func('^item/reserve_many$', atomic=True)
+def item_reserve_many(request, event, codes):
+    """
+    Reserve multiple single items to active receipt at once.
+
+    Result contains an entry for each code in same order as the codes were given,
+    and the new total of the receipt. Codes that fail do not prevent reserving the others.
+    """
+    codes = _parse_code_list(codes)
+    receipt_id = request.session.get("receipt")
+    if receipt_id is None:
+        raise AjaxError(RET_BAD_REQUEST, "No active receipt found")
+    receipt = get_receipt(receipt_id, for_update=True)
+
+    if receipt.status != Receipt.PENDING:
+        raise AjaxError(RET_CONFLICT, "Internal error: Receipt is not open anymore.")
+
+    items = _get_items_by_code(codes, for_update=True)
+    seen = set()
+    results = []
+    reserved = []
+    for code in codes:
+        try:
+            item = _many_find_item(items, code, event, seen)
+            if item.box_id is not None:
+                raise AjaxError(RET_CONFLICT, "A box cannot be reserved")
+            message = raise_if_item_not_available(item)
+            if item.state not in (Item.ADVERTISED, Item.BROUGHT, Item.MISSING):
+                raise AjaxError(RET_CONFLICT)
+        except AjaxError as e:
+            results.append(_many_result(code, e.status, message=e.message))
+            continue
+
+        reserved.append(item)
+        results.append(_many_result(code, result=item, message=message))
+
+    if reserved:
+        ItemStateLog.objects.log_states(item_set=reserved, new_state=Item.STAGED, request=request)
+        Item.objects.filter(pk__in=[item.pk for item in reserved]).update(state=Item.STAGED)
+        ReceiptItem.objects.bulk_create([ReceiptItem(item=item, receipt=receipt) for item in reserved])
+        for item in reserved:
+            item.state = Item.STAGED
+        receipt.add_to_total(sum(item.price for item in reserved))
+        receipt.save(update_fields=("total",))
+
+    _many_resolve_items(results)
+
+    return {
+        "items": results,
+        "total": receipt.total_cents,
+    }
+
+
 @ajax_func('^item/release$', atomic=True)
 def item_release(request, code):
     item = _get_item_or_404(code, for_update=True)
@@ -1070,6 +1254,7 @@ def _get_active_receipt(request, id, allowed_states=(Receipt.PENDING,)):
 @ajax_func('^receipt/finish$', atomic=True)
 def receipt_finish(request, id):
     receipt, receipt_id = _get_active_receipt(request, id)
+    VendorLedgerEntry.objects.lock_receipt_vendors(receipt)
 
     account_id = receipt.counter.default_store_location_id
     receipt.end_time = now()
@@ -1082,6 +1267,7 @@ def receipt_finish(request, id):
     receipt_items = Item.objects.select_for_update().filter(receipt=receipt, receiptitem__action=ReceiptItem.ADD)
     ItemStateLog.objects.log_states(item_set=receipt_items, new_state=Item.SOLD, request=request)
     receipt_items.update(state=Item.SOLD)
+    VendorLedgerEntry.objects.record(receipt)
 
     del request.session["receipt"]
     return receipt.as_dict()
@@ -1169,7 +1355,7 @@ def receipt_pending(request, event: Event):
         clerk__event=event,
         status__in=(Receipt.PENDING, Receipt.SUSPENDED),
         type=Receipt.TYPE_PURCHASE,
-    )
+    ).for_listing()
     return [receipt.as_dict() for receipt in receipts]
 
 
@@ -1178,7 +1364,7 @@ def receipt_compensated(request, vendor):
     receipts = Receipt.objects.filter(
         type=Receipt.TYPE_COMPENSATION,
         vendor_id=int(vendor)
-    ).distinct().order_by("start_time")
+    ).distinct().order_by("start_time").for_listing()
 
     return [receipt.as_dict() for receipt in receipts]
 
@@ -1236,28 +1422,105 @@ def item_mark_lost(request, event, code):
     return item.as_dict()
 
 
+def _parse_stats_points(points) -> typing.Optional[int]:
+    if points is None:
+        return None
+    try:
+        points = int(points)
+    except ValueError:
+        points = 0
+    if points < 3:
+        raise AjaxError(RET_BAD_REQUEST, "points must be a number of at least 3")
+    return points
+
+
+def _stats_graph_formatter(formatter_class: type[stats.GraphLog], event: Event, prices, resolution, points,
+                           **kwargs) -> stats.GraphLog:
+    if resolution is None or resolution == "auto":
+        resolution_td = None
+    else:
+        try:
+            resolution_td = timedelta(minutes=int(resolution))
+        except (ValueError, OverflowError):
+            resolution_td = timedelta()
+        if not stats.BUCKET_TD <= resolution_td <= stats.MAX_RESOLUTION:
+            raise AjaxError(RET_BAD_REQUEST, "resolution must be auto or a number of minutes, at most {}".format(
+                int(stats.MAX_RESOLUTION / timedelta(minutes=1))))
+
+    formatter = formatter_class(event=event, as_prices=prices == "true", resolution=resolution_td, **kwargs)
+    if resolution == "auto":
+        formatter.use_auto_resolution(points or getattr(settings, "KIRPPU_STATS_GRAPH_POINTS", 1000))
+    return formatter
+
+
+def _stats_graph_response(request, formatter: stats.GraphLog, output: str, since=None, balance=None, points=None):
+    """
+    Graph rows as response. Rows earlier than the js_time in X-Kirppu-Closed-Before header are finished.
+    To get newer rows later, the client gives the last finished row it has as `since` and `balance`.
+    """
+    if output not in ("csv", "packed"):
+        raise AjaxError(RET_BAD_REQUEST, "Unknown output format")
+
+    closed_js_time = stats.closed_js_time(formatter)
+    if since is not None:
+        if balance is None:
+            raise AjaxError(RET_BAD_REQUEST, "balance is required with since")
+        try:
+            since = int(since)
+            balance = formatter.parse_values(balance)
+        except ValueError:
+            raise AjaxError(RET_BAD_REQUEST, "Invalid since or balance")
+        if since >= closed_js_time:
+            raise AjaxError(RET_BAD_REQUEST, "since must be a finished row, earlier than X-Kirppu-Closed-Before")
+        try:
+            rows = stats.iterate_log_values_since(formatter, since, balance)
+        except OverflowError:
+            raise AjaxError(RET_BAD_REQUEST, "since is out of range")
+    else:
+        rows = stats.cached_iterate_log_values(formatter)
+    if points is not None:
+        rows = stats.downsample_log_values(rows, points)
+
+    if output == "csv":
+        response = StreamingHttpResponse(map(formatter.format_csv, rows), content_type='text/csv')
+        response["X-Kirppu-Closed-Before"] = str(closed_js_time)
+        return response
+
+    content = stats.pack_log_values(rows, as_prices=formatter.as_prices)
+    gzip = accepts_gzip(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+    if gzip:
+        content = compress_sequence(content)
+    response = StreamingHttpResponse(content, content_type=stats.PACKED_CONTENT_TYPE)
+    if gzip:
+        response["Content-Encoding"] = "gzip"
+    patch_vary_headers(response, ("Accept-Encoding",))
+    response["X-Kirppu-Closed-Before"] = str(closed_js_time)
+    return response
+
+
 @ajax_func('^stats/sales_data$', method='GET', staff_override=True)
-def stats_sales_data(request, event: Event, prices="false"):
-    source_event = event.get_real_event()
-    formatter = stats.SalesData(event=source_event, as_prices=prices == "true")
-    log_generator = stats.iterate_logs(formatter)
-    return StreamingHttpResponse(log_generator, content_type='text/csv')
+def stats_sales_data(request, event: Event, prices="false", output="csv", since=None, balance=None,
+                     resolution=None, points=None):
+    points = _parse_stats_points(points)
+    formatter = _stats_graph_formatter(stats.SalesData, event.get_real_event(), prices, resolution, points)
+    return _stats_graph_response(request, formatter, output, since, balance, points)
 
 
 @ajax_func('^stats/registration_data$', method='GET', staff_override=True)
-def stats_registration_data(request, event: Event, prices="false"):
-    source_event = event.get_real_event()
-    formatter = stats.RegistrationData(event=source_event, as_prices=prices == "true")
-    log_generator = stats.iterate_logs(formatter)
-    return StreamingHttpResponse(log_generator, content_type='text/csv')
+def stats_registration_data(request, event: Event, prices="false", output="csv", since=None, balance=None,
+                            resolution=None, points=None):
+    points = _parse_stats_points(points)
+    formatter = _stats_graph_formatter(stats.RegistrationData, event.get_real_event(), prices, resolution, points)
+    return _stats_graph_response(request, formatter, output, since, balance, points)
 
 
 @ajax_func('^stats/group_sales$', method='GET', staff_override=True)
-def stats_group_sales_data(request, event: Event, type_id, prices="false"):
+def stats_group_sales_data(request, event: Event, type_id, prices="false", output="csv", since=None,
+                           balance=None, resolution=None, points=None):
     source_event = event.get_real_event()
     database = event.get_real_database_alias()
     item_type = ItemType.objects.using(database).get(event=source_event, id=int(type_id))
-    formatter = stats.SalesData(event=source_event, as_prices=prices == "true",
-                                extra_filter=dict(item__itemtype=item_type))
-    log_generator = stats.iterate_logs(formatter)
-    return StreamingHttpResponse(log_generator, content_type='text/csv')
+    points = _parse_stats_points(points)
+    formatter = _stats_graph_formatter(stats.SalesData, source_event, prices, resolution, points,
+                                       extra_filter=dict(itemtype=item_type))
+    return _stats_graph_response(request, formatter, output, since, balance, points)
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""
+Entry points of export worker processes, see `kirppu.exports`.
+
+This module must not import Django models, as it is imported by the worker before Django is set up.
+"""
+
+
+def init():
+    import django
+    django.setup()
+
+
+def run(*args):
+    from .exports import run_export
+    run_export(*args)
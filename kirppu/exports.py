@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+import csv
+import functools
+import io
+import json
+import logging
+import multiprocessing
+import os
+import re
+import secrets
+import stat
+import tempfile
+import time
+import typing
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from . import export_worker
+from .models import Event, Item, RemoteEvent
+from .views import accounting, item_dump
+
+__all__ = (
+    "FORMATS",
+    "TABLES",
+    "find_export",
+    "start_export",
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Column(typing.NamedTuple):
+    name: str
+    type: type
+
+
+class Table(typing.NamedTuple):
+    columns: typing.List[Column]
+    rows: typing.Iterable[typing.Sequence]
+
+
+# region Tables.
+
+class _RowCollector(object):
+    """
+    Stand-in for csv writer that keeps the written rows.
+    """
+    def __init__(self):
+        self.rows = []
+
+    def writerow(self, row):
+        self.rows.append(row)
+
+
+def accounting_table(event: typing.Union[Event, RemoteEvent]) -> Table:
+    """
+    Rows of the accounting export, without the sanity checks written after them.
+    """
+    def rows():
+        collector = _RowCollector()
+        impl = accounting.AccountingWriter(collector)
+        for receipt in accounting.finished_receipts(event):
+            impl.write_receipt(receipt)
+            yield from collector.rows
+            collector.rows.clear()
+        impl.finish()
+        yield from collector.rows
+
+    def typed(row):
+        # Event type is a lazy translation.
+        return row[:3] + (str(row[3]),) + row[4:]
+
+    types = (int, str, int, str, int, int, int)
+    columns = [Column(str(name), t) for name, t in zip(accounting.COLUMNS, types)]
+    return Table(columns, map(typed, rows()))
+
+
+def _item_column_type(column) -> type:
+    ref = column[-1]
+    if isinstance(ref, frozenset):
+        return bool
+    if isinstance(ref, str):
+        field = Item._meta.get_field(ref)
+        if isinstance(field, models.DecimalField):
+            return Decimal
+        if isinstance(field, (models.ForeignKey, models.IntegerField, models.AutoField)):
+            return int
+    return str
+
+
+def items_table(event: typing.Union[Event, RemoteEvent]) -> Table:
+    columns = [Column(str(c[0]), _item_column_type(c)) for c in item_dump.COLUMNS]
+    return Table(columns, item_dump.item_rows(event, typed=True))
+
+
+# Functions of event returning the exported table, by table name.
+TABLES = {
+    "accounting": accounting_table,
+    "items": items_table,
+}
+
+# endregion
+# region Formats.
+
+def write_csv(table: Table, output: typing.BinaryIO):
+    text = io.TextIOWrapper(output, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    writer.writerow(c.name for c in table.columns)
+    writer.writerows(table.rows)
+    text.flush()
+    text.detach()
+
+
+# Characters that are not allowed in XML 1.0.
+_XML_INVALID = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_XLSX_FILES = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml"'
+        ' ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml"'
+        ' ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml"'
+        ' Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+        ' xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml"'
+        ' Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _xlsx_cell(value) -> str:
+    if value is None:
+        return "<c/>"
+    if isinstance(value, bool):
+        return '<c t="b"><v>%d</v></c>' % value
+    if isinstance(value, (int, float, Decimal)):
+        return "<c><v>%s</v></c>" % value
+    return '<c t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>' % escape(_XML_INVALID.sub("", str(value)))
+
+
+def write_xlsx(table: Table, output: typing.BinaryIO):
+    """
+    Write a single sheet workbook. Rows are written as they are read, so the whole table is never in memory.
+    """
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_FILES.items():
+            archive.writestr(name, content)
+        with archive.open("xl/worksheets/sheet1.xml", "w") as sheet_file:
+            sheet = io.TextIOWrapper(sheet_file, encoding="utf-8")
+            sheet.write(
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write("<row>%s</row>" % "".join(_xlsx_cell(c.name) for c in table.columns))
+            for row in table.rows:
+                sheet.write("<row>%s</row>" % "".join(map(_xlsx_cell, row)))
+            sheet.write("</sheetData></worksheet>")
+            sheet.flush()
+            sheet.detach()
+
+
+_TYPE_NAMES = {
+    int: "int",
+    Decimal: "decimal",
+    bool: "bool",
+    str: "str",
+}
+
+
+def _json_value(value) -> str:
+    if isinstance(value, Decimal):
+        # Keep the exact value instead of converting through float.
+        return str(value)
+    return json.dumps(value, ensure_ascii=False)
+
+
+def write_json_columns(table: Table, output: typing.BinaryIO):
+    """
+    Write columnar JSON: `{"columns": [{"name": ..., "type": ...}, ...], "data": [[values of column], ...]}`.
+    Values of each column are collected into a temporary file, so the whole table is never in memory.
+    """
+    column_files = [tempfile.TemporaryFile("w+", encoding="utf-8") for _ in table.columns]
+    try:
+        separator = ""
+        for row in table.rows:
+            for column_file, value in zip(column_files, row):
+                column_file.write(separator)
+                column_file.write(_json_value(value))
+            separator = ","
+
+        text = io.TextIOWrapper(output, encoding="utf-8")
+        text.write('{"columns":')
+        text.write(json.dumps([{"name": c.name, "type": _TYPE_NAMES[c.type]} for c in table.columns],
+                              ensure_ascii=False))
+        text.write(',"data":[')
+        for index, column_file in enumerate(column_files):
+            if index > 0:
+                text.write(",")
+            text.write("[")
+            column_file.seek(0)
+            while chunk := column_file.read(64 * 1024):
+                text.write(chunk)
+            text.write("]")
+        text.write("]}\n")
+        text.flush()
+        text.detach()
+    finally:
+        for column_file in column_files:
+            column_file.close()
+
+
+def write_parquet(table: Table, output: typing.BinaryIO, batch_size=10000):
+    types = {
+        int: pyarrow.int64(),
+        Decimal: pyarrow.decimal128(12, 2),
+        bool: pyarrow.bool_(),
+        str: pyarrow.string(),
+    }
+    schema = pyarrow.schema([(c.name, types[c.type]) for c in table.columns])
+
+    def write_batch(writer, batch):
+        writer.write_batch(pyarrow.RecordBatch.from_arrays(
+            [pyarrow.array(values, type=field.type) for values, field in zip(zip(*batch), schema)],
+            schema=schema,
+        ))
+
+    with pyarrow.parquet.ParquetWriter(output, schema) as writer:
+        batch = []
+        for row in table.rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                write_batch(writer, batch)
+                batch = []
+        if batch:
+            write_batch(writer, batch)
+
+
+class Format(typing.NamedTuple):
+    extension: str
+    content_type: str
+    writer: typing.Callable[[Table, typing.BinaryIO], None]
+
+
+FORMATS = {
+    "csv": Format("csv", "text/csv; charset=utf-8", write_csv),
+    "xlsx": Format("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", write_xlsx),
+    "json": Format("json", "application/json", write_json_columns),
+}
+if pyarrow is not None:
+    FORMATS["parquet"] = Format("parquet", "application/vnd.apache.parquet", write_parquet)
+
+# endregion
+# region Running.
+
+_executor: typing.Optional[ProcessPoolExecutor] = None
+
+
+def _export_dir() -> str:
+    path = getattr(settings, "KIRPPU_EXPORT_DIR", None)
+    if path:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        return path
+
+    # The system temporary directory is shared with other users, who must not be able to read or replace exports.
+    path = os.path.join(tempfile.gettempdir(), "kirppu-exports-{}".format(os.getuid()))
+    try:
+        os.mkdir(path, mode=0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise ImproperlyConfigured(
+            "{} is not a private directory of this user. Remove it or set KIRPPU_EXPORT_DIR.".format(path))
+    return path
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # Spawned workers do not share database connections of the web process.
+        _executor = ProcessPoolExecutor(
+            max_workers=getattr(settings, "KIRPPU_EXPORT_WORKERS", 1),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=export_worker.init,
+        )
+    return _executor
+
+
+def run_export(path: str, event_slug: str, table: str, fmt: str):
+    """
+    Write the export into `path`. Until done, the export is written to a `.part` file.
+    If the export fails, the error is written to an `.error` file instead.
+    """
+    try:
+        event = Event.objects.get(slug=event_slug).get_real_event()
+        with open(path + ".part", "wb") as output:
+            FORMATS[fmt].writer(TABLES[table](event), output)
+        os.replace(path + ".part", path)
+    except Exception as e:
+        logger.exception("Export %s failed", path)
+        _mark_failed(path, e)
+
+
+def _mark_failed(path: str, exception: BaseException):
+    with open(path + ".error", "w") as error:
+        error.write(repr(exception))
+    if os.path.exists(path + ".part"):
+        os.remove(path + ".part")
+
+
+def _check_worker_result(path: str, future):
+    # Exceptions of the export itself are handled in the worker. This catches failures of the worker process.
+    exception = future.exception()
+    if exception is not None:
+        global _executor
+        logger.error("Export worker of %s failed: %r", path, exception)
+        _mark_failed(path, exception)
+        if isinstance(exception, BrokenProcessPool):
+            _executor = None
+
+
+def _remove_old_exports(directory: str):
+    now = time.time()
+    limit = now - getattr(settings, "KIRPPU_EXPORT_MAX_AGE", 24 * 3600)
+    # A running or queued export keeps its `.part` file, so it is removed only when it is left over from
+    # a web process that stopped before finishing the export.
+    part_limit = now - getattr(settings, "KIRPPU_EXPORT_PART_MAX_AGE", 7 * 24 * 3600)
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            if entry.stat().st_mtime < (part_limit if entry.name.endswith(".part") else limit):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+def start_export(event: Event, table: str, fmt: str) -> str:
+    """
+    Start exporting the table of the event in a worker process.
+    If `KIRPPU_EXPORT_WORKERS` is zero, the export is done before returning.
+
+    :return: Token of the export, for `find_export`.
+    """
+    directory = _export_dir()
+    _remove_old_exports(directory)
+
+    token = secrets.token_urlsafe(16)
+    path = os.path.join(directory, "{}-{}-{}.{}".format(event.pk, table, token, FORMATS[fmt].extension))
+    open(path + ".part", "wb").close()
+
+    if getattr(settings, "KIRPPU_EXPORT_WORKERS", 1):
+        future = _get_executor().submit(export_worker.run, path, event.slug, table, fmt)
+        future.add_done_callback(functools.partial(_check_worker_result, path))
+    else:
+        run_export(path, event.slug, table, fmt)
+    return token
+
+
+class ExportState(typing.NamedTuple):
+    table: str
+    format: str
+    path: str
+    done: bool
+    error: bool
+
+
+def find_export(event: Event, token: str) -> typing.Optional[ExportState]:
+    """
+    Find export of the event started by `start_export`.
+
+    :return: State of the export, or None if there is no such export.
+    """
+    if not re.fullmatch(r"[\w-]+", token):
+        return None
+    directory = _export_dir()
+    for table in TABLES:
+        for fmt, spec in FORMATS.items():
+            path = os.path.join(directory, "{}-{}-{}.{}".format(event.pk, table, token, spec.extension))
+            if os.path.exists(path):
+                return ExportState(table, fmt, path, done=True, error=False)
+            if os.path.exists(path + ".error"):
+                return ExportState(table, fmt, path, done=True, error=True)
+            if os.path.exists(path + ".part"):
+                return ExportState(table, fmt, path, done=False, error=False)
+    return None
+
+# endregion
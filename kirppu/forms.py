@@ -21,6 +21,7 @@ from .models import (
     Vendor,
     Person,
     ItemStateLog,
+    VendorLedgerEntry,
 )
 from .util import shorten_text
 from .utils import StaticText, ButtonWidget, model_dict_fn
@@ -337,6 +338,8 @@ def remove_item_from_receipt(
     else:
         receipt = Receipt.objects.select_for_update().get(pk=receipt_id, type=Receipt.TYPE_PURCHASE)
         assert update_receipt, "Receipt must be updated if accessed by id."
+    if receipt.status == Receipt.FINISHED:
+        VendorLedgerEntry.objects.lock_receipt_vendors(receipt)
 
     if isinstance(item_or_code, Item):
         item = item_or_code
@@ -373,9 +376,11 @@ def remove_item_from_receipt(
 
     removal_entry = ReceiptItem(item=item, receipt=receipt, action=ReceiptItem.REMOVE)
     removal_entry.save()
+    if receipt.status == Receipt.FINISHED:
+        VendorLedgerEntry.objects.record(receipt)
 
+    receipt.add_to_total(-item.price)
     if update_receipt:
-        receipt.calculate_total()
         receipt.save(update_fields=("total",))
 
     if item.state != Item.BROUGHT:
@@ -587,7 +592,7 @@ class BoxAdjustForm(forms.Form):
             raise forms.ValidationError("Box {code} is not one of vendor {pk} boxes".format(
                 code=item.code, pk=vendor_id))
 
-        if item[0].state in (Item.RETURNED, Item.MISSING):
+        if item.state in (Item.RETURNED, Item.MISSING):
             raise forms.ValidationError("Box {code} is returned or missing.".format(code=data))
 
         return data
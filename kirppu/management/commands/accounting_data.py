@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.utils.translation import activate
 
 from kirppu.views.accounting import accounting_receipt
@@ -10,6 +12,7 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('--lang', type=str, help="Change language, for example: en")
+        parser.add_argument('--since', type=str, help="Dump only receipts finished after this ISO date and time")
         parser.add_argument('event', type=str, help="Event slug to dump data for")
 
     def handle(self, *args, **options):
@@ -18,4 +21,11 @@ class Command(BaseCommand):
 
         from kirppu.models import Event
         event = Event.objects.get(slug=options["event"])
-        accounting_receipt(self.stdout, event)
+        since = options.get("since")
+        if since is not None:
+            since = parse_datetime(since)
+            if since is None:
+                raise CommandError("Invalid --since")
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        accounting_receipt(self.stdout, event.get_real_event(), since=since)
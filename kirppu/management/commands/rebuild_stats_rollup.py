@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Recalculate statistics graph rollup of an event from its item state logs, and vendor item summaries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('event', type=str, help="Event slug to rebuild the rollup for")
+
+    def handle(self, *args, **options):
+        from kirppu.models import Event, ItemStateLogRollup, VendorItemSummary
+        from kirppu.stats import invalidate_stats_cache
+        event = Event.objects.get(slug=options["event"])
+        real_event = event.get_real_event()
+        ItemStateLogRollup.objects.db_manager(event.get_real_database_alias()).rebuild(real_event)
+        # Recalculated by the next update_stats.
+        VendorItemSummary.objects.db_manager(event.get_real_database_alias()).invalidate(real_event)
+        invalidate_stats_cache(real_event)
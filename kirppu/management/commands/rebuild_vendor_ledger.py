@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Recalculate running vendor balances of an event from its finished receipts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('event', type=str, help="Event slug to rebuild the ledger for")
+
+    def handle(self, *args, **options):
+        from kirppu.models import Event, VendorLedgerEntry
+        event = Event.objects.get(slug=options["event"])
+        VendorLedgerEntry.objects.db_manager(event.get_real_database_alias()).rebuild(event.get_real_event())
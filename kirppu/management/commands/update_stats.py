@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+
+class Command(BaseCommand):
+    help = 'Update statistics summaries of local events. Run this periodically, e.g. every minute'
+
+    def add_arguments(self, parser):
+        parser.add_argument('event', type=str, nargs='*', help="Event slugs to update. Default is all local events")
+        parser.add_argument('--interval', type=int, help="Keep running and update every this many seconds")
+
+    def handle(self, *args, **options):
+        from kirppu.models import Event
+        from kirppu.stats import update_summaries
+        # Events with source_db are read-only copies.
+        events = Event.objects.filter(Q(source_db__isnull=True) | Q(source_db=""))
+        if options["event"]:
+            events = events.filter(slug__in=options["event"])
+
+        while True:
+            for event in events:
+                update_summaries(event)
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,67 @@
+# Generated by Django 5.0.8 on 2026-10-18 04:50
+
+import datetime
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models.functions import TruncMinute
+
+
+# noinspection PyPep8Naming
+def fill_rollup(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+
+    ItemStateLog = apps.get_model("kirppu", "ItemStateLog")
+    ItemStateLogRollup = apps.get_model("kirppu", "ItemStateLogRollup")
+
+    rows = (
+        ItemStateLog.objects
+        .using(db_alias)
+        .annotate(bucket=TruncMinute("time", tzinfo=datetime.timezone.utc))
+        .values("bucket", "item__itemtype", "old_state", "new_state")
+        .annotate(count=models.Count("id"), price_sum=models.Sum("item__price"))
+        .order_by()
+    )
+    ItemStateLogRollup.objects.using(db_alias).bulk_create(
+        (
+            ItemStateLogRollup(
+                bucket=row["bucket"],
+                itemtype_id=row["item__itemtype"],
+                old_state=row["old_state"],
+                new_state=row["new_state"],
+                count=row["count"],
+                price_sum=row["price_sum"],
+            )
+            for row in rows.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kirppu', '0048_event_min_box_size'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemStateLogRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(help_text='Start of the minute of the transitions.')),
+                ('old_state', models.CharField(choices=[('AD', 'Advertised'), ('BR', 'Brought to event'), ('ST', 'Staged for selling'), ('SO', 'Sold'), ('MI', 'Missing'), ('RE', 'Returned to vendor'), ('CO', 'Compensated to vendor')], max_length=2)),
+                ('new_state', models.CharField(choices=[('AD', 'Advertised'), ('BR', 'Brought to event'), ('ST', 'Staged for selling'), ('SO', 'Sold'), ('MI', 'Missing'), ('RE', 'Returned to vendor'), ('CO', 'Compensated to vendor')], max_length=2)),
+                ('count', models.IntegerField(default=0)),
+                ('price_sum', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=12)),
+                ('itemtype', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='kirppu.itemtype')),
+            ],
+            options={
+                'unique_together': {('bucket', 'itemtype', 'old_state', 'new_state')},
+            },
+        ),
+        migrations.RunPython(
+            fill_rollup,
+            reverse_code=migrations.RunPython.noop,
+        ),
+    ]
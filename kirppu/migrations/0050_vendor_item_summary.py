@@ -0,0 +1,38 @@
+# Generated by Django 5.0.8 on 2026-10-18 05:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kirppu', '0049_item_state_log_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorItemSummary',
+            fields=[
+                ('vendor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='item_summary', serialize=False, to='kirppu.vendor')),
+                ('version', models.PositiveIntegerField(default=1)),
+                ('summary_version', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VendorItemSummaryRow',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('AD', 'Advertised'), ('BR', 'Brought to event'), ('ST', 'Staged for selling'), ('SO', 'Sold'), ('MI', 'Missing'), ('RE', 'Returned to vendor'), ('CO', 'Compensated to vendor')], max_length=8)),
+                ('hidden', models.BooleanField()),
+                ('abandoned', models.BooleanField()),
+                ('count', models.IntegerField()),
+                ('price_sum', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('itemtype', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='kirppu.itemtype')),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='kirppu.vendor')),
+            ],
+            options={
+                'unique_together': {('vendor', 'itemtype', 'state', 'hidden', 'abandoned')},
+            },
+        ),
+    ]
@@ -0,0 +1,100 @@
+# Generated by Django 5.0.8 on 2026-10-18 05:55
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+# noinspection PyPep8Naming
+def fill_ledger(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+
+    Receipt = apps.get_model("kirppu", "Receipt")
+    ReceiptItem = apps.get_model("kirppu", "ReceiptItem")
+    ReceiptExtraRow = apps.get_model("kirppu", "ReceiptExtraRow")
+    VendorLedgerEntry = apps.get_model("kirppu", "VendorLedgerEntry")
+
+    finished = {"receipt__status": "FINI"}
+    purchases = {}
+    for row in (ReceiptItem.objects.using(db_alias)
+                .filter(receipt__type="PURCHASE", action="ADD", **finished)
+                .values("receipt", "item__vendor")
+                .annotate(price_sum=models.Sum("item__price"))
+                .order_by("receipt", "item__vendor")):
+        purchases.setdefault(row["receipt"], []).append((row["item__vendor"], row["price_sum"]))
+    compensations = dict(ReceiptItem.objects.using(db_alias)
+                         .filter(receipt__type="COMPENSATION", **finished)
+                         .values("receipt")
+                         .annotate(price_sum=models.Sum("item__price"))
+                         .order_by()
+                         .values_list("receipt", "price_sum"))
+    extras = {}
+    for row in (ReceiptExtraRow.objects.using(db_alias)
+                .filter(receipt__type="COMPENSATION", **finished)
+                .values("receipt", "type")
+                .annotate(value_sum=models.Sum("value"))
+                .order_by()):
+        extras[(row["receipt"], row["type"])] = row["value_sum"]
+
+    zero = Decimal(0)
+    balances = {}
+    entries = []
+    receipts = (Receipt.objects.using(db_alias)
+                .filter(status="FINI", end_time__isnull=False, type__in=("PURCHASE", "COMPENSATION"))
+                .order_by("end_time", "pk")
+                .values_list("pk", "type", "vendor_id", "end_time"))
+    for receipt_id, receipt_type, receipt_vendor_id, end_time in receipts.iterator():
+        if receipt_type == "PURCHASE":
+            changes = [(vendor_id, price_sum, zero, zero) for vendor_id, price_sum in purchases.get(receipt_id, ())]
+        elif receipt_vendor_id is not None:
+            changes = [(
+                receipt_vendor_id,
+                -compensations.get(receipt_id, zero),
+                extras.get((receipt_id, "PRO"), zero),
+                extras.get((receipt_id, "PRO_FIX"), zero),
+            )]
+        else:
+            continue
+        for vendor_id, change, provision, provision_fix in changes:
+            balances[vendor_id] = balances.get(vendor_id, zero) + change
+            entries.append(VendorLedgerEntry(
+                vendor_id=vendor_id,
+                receipt_id=receipt_id,
+                end_time=end_time,
+                change=change,
+                provision=provision,
+                provision_fix=provision_fix,
+                balance=balances[vendor_id],
+            ))
+    VendorLedgerEntry.objects.using(db_alias).bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kirppu', '0050_vendor_item_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorLedgerEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('end_time', models.DateTimeField(help_text='End time of the receipt.')),
+                ('change', models.DecimalField(decimal_places=2, help_text='Sold items, or negative payout.', max_digits=12)),
+                ('provision', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=12)),
+                ('provision_fix', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=12)),
+                ('balance', models.DecimalField(decimal_places=2, help_text='Balance of the vendor after the receipt.', max_digits=12)),
+                ('receipt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger', to='kirppu.receipt')),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger', to='kirppu.vendor')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['vendor', 'end_time', 'receipt'], name='kirppu_vend_vendor__c99665_idx')],
+                'unique_together': {('vendor', 'receipt')},
+            },
+        ),
+        migrations.RunPython(
+            fill_ledger,
+            reverse_code=migrations.RunPython.noop,
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.8 on 2026-10-18 06:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kirppu', '0051_vendor_ledger'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='itemstatelogrollup',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='itemstatelogrollup',
+            name='pending',
+            field=models.BooleanField(default=False, help_text='Whether the row has not been folded yet.'),
+        ),
+        migrations.AddIndex(
+            model_name='itemstatelogrollup',
+            index=models.Index(fields=['bucket', 'itemtype'], name='kirppu_item_bucket_05dac2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='itemstatelogrollup',
+            index=models.Index(fields=['pending', 'bucket'], name='kirppu_item_pending_743ba2_idx'),
+        ),
+    ]
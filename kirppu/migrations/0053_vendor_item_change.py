@@ -0,0 +1,49 @@
+# Generated by Django 5.0.8 on 2026-10-18 06:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F
+
+
+# noinspection PyPep8Naming
+def migrate_changed(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    VendorItemSummary = apps.get_model("kirppu", "VendorItemSummary")
+    VendorItemChange = apps.get_model("kirppu", "VendorItemChange")
+    changed = (VendorItemSummary.objects
+               .using(db_alias)
+               .exclude(summary_version=F("version"))
+               .values_list("vendor_id", flat=True))
+    VendorItemChange.objects.using(db_alias).bulk_create(
+        VendorItemChange(vendor_id=vendor_id) for vendor_id in changed
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kirppu', '0052_item_state_log_rollup_pending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorItemChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='kirppu.vendor')),
+            ],
+        ),
+        migrations.RunPython(
+            code=migrate_changed,
+            # Summaries are recalculated from all items, so all of them are stale when migrating back.
+            reverse_code=migrations.RunPython.noop,
+        ),
+        migrations.RemoveField(
+            model_name='vendoritemsummary',
+            name='summary_version',
+        ),
+        migrations.RemoveField(
+            model_name='vendoritemsummary',
+            name='version',
+        ),
+    ]
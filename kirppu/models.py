@@ -1,3 +1,4 @@
+import datetime
 from decimal import Decimal
 import enum
 import random
@@ -7,11 +8,13 @@ import warnings
 
 from django.core.exceptions import ValidationError, ImproperlyConfigured
 from django.core.validators import MinLengthValidator, MinValueValidator, RegexValidator
-from django.db import models, transaction, IntegrityError
-from django.db.models import F, Sum, Q
+from django.db import connection, models, router, transaction, IntegrityError
+from django.db.models import F, Sum, Q, signals
+from django.db.models.functions import TruncMinute
 import django.http
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.encoding import force_str
 from django.utils.translation import gettext_lazy as _
 from django.utils.module_loading import import_string
 from django.conf import settings
@@ -916,13 +919,12 @@ class Box(models.Model):
             )
 
             # Create rest of the items for the box.
-            for i in range(count - 1):
-                Item.new(
-                    name=item_title,
-                    box=obj,
-                    no_code=True,
-                    **kwargs
-                )
+            Item.new_many(
+                [item_title] * (count - 1),
+                box=obj,
+                no_code=True,
+                **kwargs
+            )
 
         return obj
 
@@ -952,6 +954,49 @@ class ItemType(models.Model):
         return query.order_by("order").values_list("id", "title")
 
 
+def _bulk_create_with_signals(model, objs):
+    """
+    Store `objs` with `bulk_create` and send the `pre_save` and `post_save` signals
+    `Model.save` would have sent for each of them. Requires a backend that returns the primary keys.
+    """
+    using = router.db_for_write(model)
+    for obj in objs:
+        signals.pre_save.send(sender=model, instance=obj, raw=False, using=using, update_fields=None)
+    objs = model.objects.using(using).bulk_create(objs)
+    for obj in objs:
+        signals.post_save.send(sender=model, instance=obj, created=True, raw=False, using=using, update_fields=None)
+    return objs
+
+
+class ItemQuerySet(models.QuerySet):
+    """
+    QuerySet of Items that marks `VendorItemSummary` of affected vendors changed when summarized fields are written.
+    """
+    # Fields of Item that affect VendorItemSummaryRow.
+    SUMMARY_FIELDS = frozenset(("state", "hidden", "abandoned", "price", "vendor", "vendor_id", "itemtype",
+                                "itemtype_id"))
+
+    def update(self, **kwargs):
+        if self.SUMMARY_FIELDS.isdisjoint(kwargs):
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            VendorItemSummary.objects.db_manager(self.db).mark_changed(self.values_list("vendor_id", flat=True))
+            return super().update(**kwargs)
+    update.alters_data = True
+
+    def delete(self):
+        with transaction.atomic(using=self.db, savepoint=False):
+            VendorItemSummary.objects.db_manager(self.db).mark_changed(self.values_list("vendor_id", flat=True))
+            return super().delete()
+    delete.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            VendorItemSummary.objects.db_manager(self.db).mark_changed({obj.vendor_id for obj in objs})
+            return super().bulk_create(objs, *args, **kwargs)
+
+
 class Item(models.Model):
     ADVERTISED = "AD"
     BROUGHT = "BR"
@@ -1040,11 +1085,33 @@ class Item(models.Model):
         help_text=_(u"Forgotten or lost property/item"),
     )
 
+    objects = ItemQuerySet.as_manager()
+
     class Meta:
         permissions = (
             ("register_override", _("Can register items after registration is closed")),
         )
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and ItemQuerySet.SUMMARY_FIELDS.isdisjoint(update_fields):
+            return super().save(*args, **kwargs)
+
+        using = kwargs.get("using") or router.db_for_write(Item, instance=self)
+        vendors = [self.vendor_id]
+        if self.pk is not None and (update_fields is None or "vendor" in update_fields):
+            # The item may be moved from another vendor.
+            vendors.extend(Item.objects.using(using).filter(pk=self.pk).values_list("vendor_id", flat=True))
+        with transaction.atomic(using=using, savepoint=False):
+            VendorItemSummary.objects.db_manager(using).mark_changed(vendors)
+            return super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        using = kwargs.get("using") or router.db_for_write(Item, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            VendorItemSummary.objects.db_manager(using).mark_changed([self.vendor_id])
+            return super().delete(*args, **kwargs)
+
     def __str__(self):
         if self.box_id is None:
             code_or_box = self.code
@@ -1077,6 +1144,13 @@ class Item(models.Model):
         price=lambda self: str(self.price).replace(".", ","),
     )
 
+    # Django's generic get_FOO_display rebuilds and hashes the choice dictionary on every call,
+    # which is measurable in list endpoints.
+    _STATE_DISPLAY = dict(STATE)
+
+    def get_state_display(self):
+        return force_str(self._STATE_DISPLAY.get(self.state, self.state), strings_only=True)
+
     def get_itemtype_display(self):
         return self.itemtype.title
 
@@ -1122,15 +1196,65 @@ class Item(models.Model):
         obj.full_clean()
         obj.save()
 
-        ItemStateLog.objects.create(item=obj, old_state="", new_state=obj.state)
+        log = ItemStateLog.objects.create(item=obj, old_state="", new_state=obj.state)
+        ItemStateLogRollup.objects.add_logs([log])
 
         return obj
 
+    @classmethod
+    def new_many(cls, names: typing.Sequence[str], no_code: bool = False, **kwargs) -> typing.List["Item"]:
+        """
+        Construct and store new Items that differ only by their name, with a constant number of queries.
+        The `pre_save` and `post_save` signals are sent for each Item and ItemStateLog as with `new`.
+
+        :param names: Name for each Item to create.
+        :param no_code: If True, no codes will be generated for the Items.
+        :param kwargs: Item Constructor arguments common to all the Items.
+        :return: New stored Item objects with calculated codes, in order of `names`.
+        """
+        objs = [cls(name=name, **kwargs) for name in names]
+        if not objs:
+            return objs
+        if not no_code:
+            for obj, code in zip(objs, cls.gen_barcodes(len(objs))):
+                obj.code = code
+
+        # Related objects are common to all Items and codes are known to be unique,
+        # so the database needs to be consulted only for the first Item.
+        checked_in_db = [f.name for f in cls._meta.concrete_fields if f.is_relation] + ["code"]
+        for index, obj in enumerate(objs):
+            obj.full_clean(exclude=checked_in_db if index > 0 else None)
+
+        with transaction.atomic():
+            if connection.features.can_return_rows_from_bulk_insert:
+                _bulk_create_with_signals(cls, objs)
+            else:
+                for obj in objs:
+                    obj.save()
+            logs = _bulk_create_with_signals(ItemStateLog, [
+                ItemStateLog(item=obj, old_state="", new_state=obj.state)
+                for obj in objs
+            ])
+            ItemStateLogRollup.objects.add_logs(logs)
+
+        return objs
+
     @classmethod
     def gen_barcode(cls):
         """
         Generate new random barcode for item.
 
+        :return: The newly generated code.
+        :rtype: str
+        """
+        return cls.gen_barcodes(1)[0]
+
+    @classmethod
+    def gen_barcodes(cls, count: int) -> typing.List[str]:
+        """
+        Generate `count` new random barcodes for items.
+        Collisions with existing codes are checked with one query per generated batch.
+
         Format of the code:
             random:     36 bits
             checksum:    4 bits
@@ -1138,20 +1262,26 @@ class Item(models.Model):
             total:      40 bits
 
 
-        :return: The newly generated code.
-        :rtype: str
+        :param count: Number of codes to generate.
+        :return: The newly generated unique codes.
         """
         checksum_bits = 4
         data_bits = cls.CODE_BITS - checksum_bits
-        key = None
         i_max = 2 ** data_bits - 1
-        while key is None or Item.objects.filter(code=key).exists():
-            key = b32_encode(
-                pack([
-                    (data_bits, random.randint(1, i_max)),
-                ], checksum_bits=checksum_bits)
-            )
-        return key
+        keys = []
+        while len(keys) < count:
+            candidates = {
+                b32_encode(
+                    pack([
+                        (data_bits, random.randint(1, i_max)),
+                    ], checksum_bits=checksum_bits)
+                )
+                for _ in range(count - len(keys))
+            }
+            candidates.difference_update(keys)
+            taken = set(Item.objects.filter(code__in=candidates).values_list("code", flat=True))
+            keys.extend(candidates - taken)
+        return keys
 
     def is_locked(self):
         return self.state != Item.ADVERTISED
@@ -1336,6 +1466,25 @@ class ReceiptItem(models.Model):
         return str(self.item)
 
 
+class ReceiptQuerySet(models.QuerySet):
+    def for_listing(self):
+        """
+        Fetch related objects used by `Receipt.as_dict` and `Receipt.as_transfer_dict` with the receipts,
+        instead of querying them separately for each receipt.
+        """
+        return self.select_related(
+            "clerk__user",
+            "counter",
+            "src_account",
+            "dst_account",
+        ).prefetch_related(
+            models.Prefetch(
+                "receiptnote_set",
+                queryset=ReceiptNote.objects.select_related("clerk__user").order_by("timestamp"),
+            ),
+        )
+
+
 class Receipt(models.Model):
     PENDING = "PEND"
     FINISHED = "FINI"
@@ -1377,6 +1526,8 @@ class Receipt(models.Model):
     dst_account = models.ForeignKey(Account, on_delete=models.CASCADE,
                                     related_name="dst_receipts", null=True, blank=True)
 
+    objects = ReceiptQuerySet.as_manager()
+
     def items_list(self):
         return [
             self._item_dict(row)
@@ -1417,7 +1568,7 @@ class Receipt(models.Model):
         end_time=lambda self: format_datetime(self.end_time) if self.end_time is not None else None,
         clerk=lambda self: self.clerk.as_dict(),
         counter=lambda self: self.counter.name,
-        notes=lambda self: [note.as_dict() for note in self.receiptnote_set.order_by("timestamp")] if self.pk else [],
+        notes=lambda self: [note.as_dict() for note in self.notes_in_order()],
         type_display=lambda self: self.get_type_display(),
     )
 
@@ -1429,6 +1580,18 @@ class Receipt(models.Model):
         __extend=as_dict,
     )
 
+    def notes_in_order(self):
+        """
+        Get notes of the receipt in timestamp order, using notes prefetched by `for_listing` if available.
+
+        :rtype: list[ReceiptNote]
+        """
+        if self.pk is None:
+            return []
+        if "receiptnote_set" in getattr(self, "_prefetched_objects_cache", {}):
+            return list(self.receiptnote_set.all())
+        return list(self.receiptnote_set.select_related("clerk__user").order_by("timestamp"))
+
     def calculate_total(self):
         result = ReceiptItem.objects.filter(action=ReceiptItem.ADD, receipt=self)\
             .aggregate(price_total=Sum("item__price"))
@@ -1440,6 +1603,22 @@ class Receipt(models.Model):
         self.total = (price_total or 0) + (extras_total or 0)
         return self.total
 
+    def add_to_total(self, value):
+        """
+        Adjust total by `value` without re-aggregating all rows of the receipt.
+
+        Use this when a single row is added (positive value) or removed (negative value). The receipt
+        should be locked for update in the current transaction for the result to be valid.
+        `calculate_total` can be used to verify or repair the total afterwards.
+
+        :param value: Amount to add to the total.
+        :type value: Decimal
+        :return: The new total.
+        :rtype: Decimal
+        """
+        self.total = (self.total or 0) + value
+        return self.total
+
     def __str__(self):
         return "{type}: {start} / {clerk}".format(
             type=self.get_type_display(),
@@ -1561,12 +1740,14 @@ class ItemStateLogManager(models.Manager):
 
     def log_state(self, item, new_state, request):
         def actual(counter, clerk):
-            return self.create(
+            obj = self.create(
                 item=item,
                 old_state=item.state,
                 new_state=new_state,
                 clerk=clerk,
                 counter=counter)
+            ItemStateLogRollup.objects.add_logs([obj])
+            return obj
         return self._make_log_state(request, item, actual)
 
     def log_states(self, item_set, new_state, request):
@@ -1581,7 +1762,9 @@ class ItemStateLogManager(models.Manager):
                 )
                 for item in item_set
             ]
-            return self.bulk_create(objs)
+            objs = self.bulk_create(objs)
+            ItemStateLogRollup.objects.add_logs(objs)
+            return objs
         return self._make_log_state(request, None, actual)
 
 
@@ -1618,6 +1801,510 @@ class ItemStateLog(models.Model):
         )
 
 
+class ItemStateLogRollupManager(models.Manager):
+    @staticmethod
+    def bucket_of(time):
+        return time.replace(second=0, microsecond=0)
+
+    def add_logs(self, logs: typing.Iterable[ItemStateLog]):
+        """
+        Add newly created state logs to the rollup.
+
+        :param logs: ItemStateLog objects with their `item` loaded.
+        """
+        deltas = {}
+        for log in logs:
+            item = log.item
+            key = (self.bucket_of(log.time), item.itemtype_id, log.old_state, log.new_state)
+            count, price_sum = deltas.get(key, (0, Decimal(0)))
+            deltas[key] = (count + 1, price_sum + item.price)
+        self._append(deltas)
+
+    def add_price_changes(self, items: typing.Iterable["Item"], new_price):
+        """
+        Add price change of items to the rollup. This must be called before the new price is set to the items.
+
+        The change is recorded as a change of value in the current state of each item, without a transition,
+        so that the value removed from the state in next transition is the same that was added to it.
+
+        :param items: Items with their current price and state.
+        :param new_price: The price that is set to the items.
+        """
+        bucket = self.bucket_of(timezone.now())
+        deltas = {}
+        for item in items:
+            change = Decimal(new_price) - item.price
+            if change:
+                key = (bucket, item.itemtype_id, "", item.state)
+                deltas[key] = (0, deltas.get(key, (0, Decimal(0)))[1] + change)
+        self._append(deltas)
+
+    def _append(self, deltas: dict):
+        # Changes are only appended, so that concurrent writers never wait for each other. They are folded into
+        # one row per key later by `fold`.
+        self.bulk_create([
+            ItemStateLogRollup(bucket=bucket, itemtype_id=itemtype_id, old_state=old_state, new_state=new_state,
+                               count=count, price_sum=price_sum, pending=True)
+            for (bucket, itemtype_id, old_state, new_state), (count, price_sum) in deltas.items()
+        ])
+
+    def fold(self, event: "Event", before: datetime.datetime):
+        """
+        Combine pending rows of given Event in buckets older than `before` with the other rows of the same
+        transition, so that each transition of a bucket has one row.
+
+        Reading the rollup does not need this, but it keeps the rollup small.
+        """
+        item_types = ItemType.objects.using(self.db).filter(event=event).values("pk")
+        first = self.filter(itemtype__in=item_types, pending=True, bucket__lt=before) \
+            .aggregate(first=models.Min("bucket"))["first"]
+        if first is None:
+            return
+
+        with transaction.atomic(using=self.db):
+            # Rows deleted by a concurrent fold are not returned after their lock is released,
+            # so each row is folded only once.
+            rows = self.select_for_update().filter(itemtype__in=item_types, bucket__gte=first, bucket__lt=before)
+            folded = {}
+            for row in rows:
+                key = (row.bucket, row.itemtype_id, row.old_state, row.new_state)
+                folded.setdefault(key, []).append(row)
+            folded = {key: key_rows for key, key_rows in folded.items()
+                      if len(key_rows) > 1 or key_rows[0].pending}
+
+            ids = [row.pk for key_rows in folded.values() for row in key_rows]
+            for index in range(0, len(ids), 500):
+                self.filter(pk__in=ids[index:index + 500]).delete()
+            self.bulk_create(
+                (
+                    ItemStateLogRollup(
+                        bucket=bucket, itemtype_id=itemtype_id, old_state=old_state, new_state=new_state,
+                        count=sum(row.count for row in key_rows),
+                        price_sum=sum((row.price_sum for row in key_rows), Decimal(0)),
+                    )
+                    for (bucket, itemtype_id, old_state, new_state), key_rows in folded.items()
+                ),
+                batch_size=500,
+            )
+
+    def rebuild(self, event: "Event"):
+        """
+        Recalculate the rollup of given Event from its ItemStateLog. Price changes between transitions
+        are lost in this, as the current item prices are used for all transitions.
+        """
+        with transaction.atomic(using=self.db):
+            self.filter(itemtype__event=event).delete()
+            rows = (
+                ItemStateLog.objects
+                .using(self.db)
+                .filter(item__itemtype__event=event)
+                .annotate(bucket=TruncMinute("time", tzinfo=datetime.timezone.utc))
+                .values("bucket", "item__itemtype", "old_state", "new_state")
+                .annotate(count=models.Count("id"), price_sum=Sum("item__price"))
+                .order_by()
+            )
+            self.bulk_create(
+                ItemStateLogRollup(
+                    bucket=row["bucket"],
+                    itemtype_id=row["item__itemtype"],
+                    old_state=row["old_state"],
+                    new_state=row["new_state"],
+                    count=row["count"],
+                    price_sum=row["price_sum"],
+                )
+                for row in rows
+            )
+
+
+class ItemStateLogRollup(models.Model):
+    """
+    Per-minute summary of ItemStateLog for statistics graphs, maintained when the logs are written.
+
+    New changes are appended as pending rows, so a transition may have several rows in a bucket
+    until they are folded together.
+    """
+    objects = ItemStateLogRollupManager()
+
+    bucket = models.DateTimeField(help_text="Start of the minute of the transitions.")
+    itemtype = models.ForeignKey(ItemType, on_delete=models.CASCADE)
+    old_state = models.CharField(
+        choices=Item.STATE,
+        max_length=2,
+    )
+    new_state = models.CharField(
+        choices=Item.STATE,
+        max_length=2,
+    )
+    count = models.IntegerField(default=0)
+    price_sum = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal(0))
+    pending = models.BooleanField(default=False, help_text="Whether the row has not been folded yet.")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["bucket", "itemtype"]),
+            models.Index(fields=["pending", "bucket"]),
+        ]
+
+    def __repr__(self):
+        return "<ItemStateLogRollup bucket={} itemtype={} old={} new={} count={} price_sum={}>".format(
+            self.bucket,
+            self.itemtype_id,
+            self.old_state,
+            self.new_state,
+            self.count,
+            self.price_sum,
+        )
+
+
+class VendorItemSummaryManager(models.Manager):
+    def mark_changed(self, vendors):
+        """
+        Mark summaries of vendors to be recalculated. This must be called in the same transaction
+        with the changes to the items. The marks are only appended, so concurrent writers do not wait
+        for each other here.
+
+        :param vendors: Vendor ids, or query of vendor ids.
+        """
+        if isinstance(vendors, models.QuerySet):
+            vendors = vendors.order_by().distinct()
+        VendorItemChange.objects.using(self.db).bulk_create(
+            VendorItemChange(vendor_id=vendor_id) for vendor_id in set(vendors) if vendor_id is not None
+        )
+
+    def refresh(self, event: "Event"):
+        """
+        Recalculate summaries of vendors of given Event whose items have changed since the last refresh.
+        This is run periodically by `update_stats` management command, not when the summaries are read.
+        """
+        missing = list(Vendor.objects
+                       .using(self.db)
+                       .filter(event=event, item_summary__isnull=True)
+                       .values_list("id", flat=True))
+        if missing:
+            with transaction.atomic(using=self.db):
+                self.bulk_create([VendorItemSummary(vendor_id=vendor_id) for vendor_id in missing],
+                                 ignore_conflicts=True)
+                self.mark_changed(missing)
+
+        # Changes are read before the items. A change committed after this has a mark that is not read here,
+        # so it is left for the next refresh.
+        changes = {}
+        for change_id, vendor_id in (VendorItemChange.objects
+                                     .using(self.db)
+                                     .filter(vendor__event=event)
+                                     .values_list("id", "vendor_id")):
+            changes.setdefault(vendor_id, []).append(change_id)
+        if not changes:
+            return
+
+        # Items are aggregated without locks, so that refreshing does not block writers of the items.
+        rows = list(Item.objects
+                    .using(self.db)
+                    .filter(vendor_id__in=changes.keys())
+                    .values("vendor", "itemtype", "state", "hidden", "abandoned")
+                    .annotate(count=models.Count("id"), price_sum=Sum("price"))
+                    .order_by())
+
+        with transaction.atomic(using=self.db):
+            # Item writes do not lock the summaries, so these only serialize concurrent refreshes.
+            # Summaries being refreshed concurrently are skipped.
+            locked = self.select_for_update(skip_locked=True) \
+                .filter(vendor_id__in=changes.keys()) \
+                .values_list("vendor_id", flat=True)
+            # If a concurrent refresh has removed the changes read above, it read the items later than this.
+            vendor_ids = set(VendorItemChange.objects
+                             .using(self.db)
+                             .filter(pk__in=[max(changes[vendor_id]) for vendor_id in locked])
+                             .values_list("vendor_id", flat=True))
+            if not vendor_ids:
+                return
+
+            VendorItemSummaryRow.objects.using(self.db).filter(vendor_id__in=vendor_ids).delete()
+            VendorItemSummaryRow.objects.using(self.db).bulk_create(
+                VendorItemSummaryRow(
+                    vendor_id=row["vendor"],
+                    itemtype_id=row["itemtype"],
+                    state=row["state"],
+                    hidden=row["hidden"],
+                    abandoned=row["abandoned"],
+                    count=row["count"],
+                    price_sum=row["price_sum"],
+                )
+                for row in rows
+                if row["vendor"] in vendor_ids
+            )
+
+            ids = [change_id for vendor_id in vendor_ids for change_id in changes[vendor_id]]
+            for index in range(0, len(ids), 500):
+                VendorItemChange.objects.using(self.db).filter(pk__in=ids[index:index + 500]).delete()
+
+    def invalidate(self, event: "Event"):
+        """
+        Mark all summaries of given Event to be recalculated.
+        """
+        self.mark_changed(self.filter(vendor__event=event).values_list("vendor_id", flat=True))
+
+
+class VendorItemSummary(models.Model):
+    """
+    Summary state of a vendor for maintaining `VendorItemSummaryRow`.
+    Writes to items append `VendorItemChange` rows, and `VendorItemSummaryManager.refresh` recalculates
+    the rows of vendors that have them. Only the refresh locks this.
+    """
+    objects = VendorItemSummaryManager()
+
+    vendor = models.OneToOneField(Vendor, on_delete=models.CASCADE, primary_key=True, related_name="item_summary")
+
+    def __repr__(self):
+        return "<VendorItemSummary vendor={}>".format(self.vendor_id)
+
+
+class VendorItemChange(models.Model):
+    """
+    Change to items of a vendor that is not yet in `VendorItemSummaryRow`.
+    """
+    vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE)
+
+    def __repr__(self):
+        return "<VendorItemChange id={} vendor={}>".format(self.pk, self.vendor_id)
+
+
+class VendorItemSummaryRow(models.Model):
+    """
+    Count and price sum of items of a vendor per item type, state, hidden and abandoned, for statistics.
+    """
+    vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE)
+    itemtype = models.ForeignKey(ItemType, on_delete=models.CASCADE)
+    state = models.CharField(
+        choices=Item.STATE,
+        max_length=8,
+    )
+    hidden = models.BooleanField()
+    abandoned = models.BooleanField()
+    count = models.IntegerField()
+    price_sum = models.DecimalField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        unique_together = (
+            ("vendor", "itemtype", "state", "hidden", "abandoned"),
+        )
+
+    def __repr__(self):
+        return "<VendorItemSummaryRow vendor={} itemtype={} state={} hidden={} abandoned={} count={} price_sum={}>".format(
+            self.vendor_id,
+            self.itemtype_id,
+            self.state,
+            self.hidden,
+            self.abandoned,
+            self.count,
+            self.price_sum,
+        )
+
+
+class VendorLedgerEntryManager(models.Manager):
+    def _receipt_changes(self, receipt: "Receipt") -> typing.Dict[int, typing.Tuple[Decimal, Decimal, Decimal]]:
+        """
+        Calculate changes of vendor balances by a finished receipt in the same way as `AccountingWriter`.
+
+        :return: Dictionary of vendor id to (change, provision, provision fix).
+        """
+        zero = Decimal(0)
+        rows = ReceiptItem.objects.using(self.db).filter(receipt=receipt)
+        if receipt.type == Receipt.TYPE_PURCHASE:
+            sums = (rows
+                    .filter(action=ReceiptItem.ADD)
+                    .values("item__vendor")
+                    .annotate(price_sum=Sum("item__price"))
+                    .order_by())
+            return {row["item__vendor"]: (row["price_sum"], zero, zero) for row in sums}
+
+        if receipt.type == Receipt.TYPE_COMPENSATION and receipt.vendor_id is not None:
+            compensation = rows.aggregate(price_sum=Sum("item__price"))["price_sum"] or zero
+            extras = dict(ReceiptExtraRow.objects
+                          .using(self.db)
+                          .filter(receipt=receipt)
+                          .values("type")
+                          .annotate(value_sum=Sum("value"))
+                          .order_by()
+                          .values_list("type", "value_sum"))
+            return {receipt.vendor_id: (
+                -compensation,
+                extras.get(ReceiptExtraRow.TYPE_PROVISION, zero),
+                extras.get(ReceiptExtraRow.TYPE_PROVISION_FIX, zero),
+            )}
+        return {}
+
+    def lock_receipt_vendors(self, receipt: "Receipt"):
+        """
+        Lock the vendors whose balances `record` may change for the receipt. Call this in the transaction
+        before locking or writing items of the receipt, so that vendors are always locked before their items,
+        as in item check-in. Otherwise concurrent transactions may deadlock.
+        """
+        vendors = Q(pk__in=ReceiptItem.objects.using(self.db).filter(receipt=receipt).values("item__vendor"))
+        vendors |= Q(pk__in=self.filter(receipt=receipt).values("vendor"))
+        if receipt.vendor_id is not None:
+            vendors |= Q(pk=receipt.vendor_id)
+        self.lock_vendors(vendors)
+
+    def lock_vendors(self, vendors: Q):
+        """
+        Lock vendors matching the Q object. They are locked in order of their ids, so that transactions
+        locking several vendors lock them in the same order.
+        """
+        list(Vendor.objects
+             .using(self.db)
+             .select_for_update()
+             .filter(vendors)
+             .order_by("pk")
+             .values_list("pk", flat=True))
+
+    def record(self, receipt: "Receipt"):
+        """
+        Write entries of a finished receipt, and update running balances of entries after it.
+        Call this in the transaction that finishes the receipt, or changes rows of a finished receipt.
+        Entries written earlier for the receipt are replaced.
+        """
+        if receipt.end_time is None:
+            # Cannot be ordered with other receipts.
+            return
+        changes = self._receipt_changes(receipt)
+        previous_vendor_ids = set(self.filter(receipt=receipt).values_list("vendor_id", flat=True))
+        vendor_ids = set(changes) | previous_vendor_ids
+        if not vendor_ids:
+            return
+
+        # Serialize concurrent writes of balances of the same vendors.
+        # The vendors are already locked if `lock_receipt_vendors` was called.
+        self.lock_vendors(Q(pk__in=vendor_ids))
+        if previous_vendor_ids:
+            self.filter(receipt=receipt).delete()
+
+        before = Q(end_time__lt=receipt.end_time) | Q(end_time=receipt.end_time, receipt_id__lt=receipt.pk)
+        previous = self.filter(vendor=models.OuterRef("pk")).filter(before).order_by("-end_time", "-receipt_id")
+        balances = dict(Vendor.objects
+                        .using(self.db)
+                        .filter(pk__in=vendor_ids)
+                        .annotate(balance=models.Subquery(previous.values("balance")[:1]))
+                        .values_list("pk", "balance"))
+
+        entries = []
+        for vendor_id, (change, provision, provision_fix) in sorted(changes.items()):
+            balances[vendor_id] = (balances[vendor_id] or 0) + change
+            entries.append(VendorLedgerEntry(
+                vendor_id=vendor_id,
+                receipt=receipt,
+                end_time=receipt.end_time,
+                change=change,
+                provision=provision,
+                provision_fix=provision_fix,
+                balance=balances[vendor_id],
+            ))
+        self.bulk_create(entries)
+
+        # Usually the receipt is the last one of the vendors. Otherwise, the entries after it are updated.
+        later = list(self
+                     .filter(vendor_id__in=vendor_ids)
+                     .exclude(before)
+                     .exclude(receipt=receipt)
+                     .order_by("vendor_id", "end_time", "receipt_id"))
+        for entry in later:
+            balances[entry.vendor_id] = (balances[entry.vendor_id] or 0) + entry.change
+            entry.balance = balances[entry.vendor_id]
+        if later:
+            self.bulk_update(later, ["balance"])
+
+    def rebuild(self, event: "Event"):
+        """
+        Recalculate all entries of given Event from its finished receipts.
+        """
+        with transaction.atomic(using=self.db):
+            self.filter(vendor__event=event).delete()
+            balances = {}
+            entries = []
+            receipts = (Receipt.objects
+                        .using(self.db)
+                        .filter(clerk__event=event, status=Receipt.FINISHED, end_time__isnull=False,
+                                type__in=(Receipt.TYPE_PURCHASE, Receipt.TYPE_COMPENSATION))
+                        .only("type", "end_time", "vendor_id")
+                        .order_by("end_time", "pk"))
+            for receipt in receipts.iterator():
+                for vendor_id, (change, provision, provision_fix) in sorted(self._receipt_changes(receipt).items()):
+                    balances[vendor_id] = balances.get(vendor_id, 0) + change
+                    entries.append(VendorLedgerEntry(
+                        vendor_id=vendor_id,
+                        receipt=receipt,
+                        end_time=receipt.end_time,
+                        change=change,
+                        provision=provision,
+                        provision_fix=provision_fix,
+                        balance=balances[vendor_id],
+                    ))
+                if len(entries) >= 1000:
+                    self.bulk_create(entries)
+                    entries = []
+            self.bulk_create(entries)
+
+    def balances(self, event: "Event", until: typing.Optional[datetime.datetime] = None) -> typing.Dict[int, Decimal]:
+        """
+        Get balances of vendors of given Event after receipts finished at or before given time.
+
+        :param until: Time of the balances. If None, current balances are returned.
+        :return: Dictionary of vendor id to balance. Vendors without receipts are not included.
+        """
+        entries = self.filter(vendor__event=event)
+        if until is not None:
+            entries = entries.filter(end_time__lte=until)
+        latest = entries.filter(vendor=models.OuterRef("vendor")).order_by("-end_time", "-receipt_id")
+        return dict(entries
+                    .filter(pk=models.Subquery(latest.values("pk")[:1]))
+                    .values_list("vendor_id", "balance"))
+
+    def accounting_row_count(self, event: "Event", until: datetime.datetime) -> int:
+        """
+        Get number of rows `AccountingWriter` writes for receipts of given Event finished at or before given time.
+        Each entry has a row, and commission and commission fix have rows of their own.
+        """
+        return self.filter(vendor__event=event, end_time__lte=until).aggregate(
+            rows=models.Count("id")
+            + models.Count("id", filter=~Q(provision=0))
+            + models.Count("id", filter=~Q(provision_fix=0))
+        )["rows"]
+
+
+class VendorLedgerEntry(models.Model):
+    """
+    Change of balance of a vendor by a finished receipt, and the balance after it.
+
+    Entries are ordered by `end_time` and `receipt`, like `AccountingWriter` orders the receipts,
+    and are written by `VendorLedgerEntryManager.record`.
+    """
+    objects = VendorLedgerEntryManager()
+
+    vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE, related_name="ledger")
+    receipt = models.ForeignKey(Receipt, on_delete=models.CASCADE, related_name="ledger")
+    end_time = models.DateTimeField(help_text="End time of the receipt.")
+    change = models.DecimalField(max_digits=12, decimal_places=2, help_text="Sold items, or negative payout.")
+    provision = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal(0))
+    provision_fix = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal(0))
+    balance = models.DecimalField(max_digits=12, decimal_places=2, help_text="Balance of the vendor after the receipt.")
+
+    class Meta:
+        unique_together = (
+            ("vendor", "receipt"),
+        )
+        indexes = [
+            models.Index(fields=["vendor", "end_time", "receipt"]),
+        ]
+
+    def __repr__(self):
+        return "<VendorLedgerEntry vendor={} receipt={} change={} balance={}>".format(
+            self.vendor_id,
+            self.receipt_id,
+            self.change,
+            self.balance,
+        )
+
+
 def default_temporary_access_permit_expiry(minutes: int = None):
     minutes = minutes or settings.KIRPPU_SHORT_CODE_EXPIRATION_TIME_MINUTES
     return timezone.now() + timezone.timedelta(minutes=minutes)
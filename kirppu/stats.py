@@ -1,20 +1,50 @@
 # -*- coding: utf-8 -*-
+import decimal
+import itertools
+import math
+import struct
 from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 
 from django.conf import settings
+from django.core.cache import cache
 from django.db import models
-from django.db.models import F
+from django.db.models.functions import Coalesce, Floor, RowNumber, TruncMinute
+from django.utils.timezone import now
 from django.utils.translation import gettext as _
 
-from .models import Event, Item, ItemType, ItemStateLog
+from .models import (
+    Box,
+    Event,
+    Item,
+    ItemType,
+    ItemStateLog,
+    ItemStateLogRollup,
+    RemoteEvent,
+    Vendor,
+    VendorItemSummary,
+    VendorItemSummaryRow,
+)
 
 __all__ = (
     "ItemCountData",
+    "ItemCountEurosData",
     "ItemEurosData",
+    "cached_iterate_log_values",
+    "cached_iterate_logs",
+    "closed_js_time",
+    "closed_log_values",
+    "distribution",
+    "downsample_log_values",
+    "general_stats",
+    "invalidate_stats_cache",
+    "iterate_log_values",
+    "iterate_log_values_since",
     "iterate_logs",
+    "pack_log_values",
     "RegistrationData",
     "SalesData",
+    "update_summaries",
 )
 
 
@@ -65,22 +95,48 @@ class ItemCollectionData(object):
     GROUP_ITEM_TYPE = "itemtype"
     GROUP_VENDOR = "vendor"
 
-    def __init__(self, group_by, event: Event):
+    def __init__(self, group_by, event: Event, rows=None, item_types=None):
+        """
+        :param group_by: Data set to represent on rows, GROUP_ITEM_TYPE or GROUP_VENDOR.
+        :param event: The Event.
+        :param rows: Already calculated result of `query` annotated with `aggregates`, or None to run the query.
+        :param item_types: Ids of ItemTypes of the Event in order, or None to query them if needed.
+        """
+        if group_by not in (self.GROUP_ITEM_TYPE, self.GROUP_VENDOR):
+            raise ValueError("Unknown group_by value")
         self._group_by = group_by
         self._event = event
-        self._raw_data = self._populate(Item.objects
-                                        .using(self._event.get_real_database_alias())
-                                        .filter(vendor__event=self._event)
-                                        .values(group_by))
+        if rows is None:
+            rows = self.query(group_by, event).annotate(**self.aggregates())
+        self._raw_data = rows
 
         if group_by == self.GROUP_ITEM_TYPE:
-            self._init_for_item_type()
-        elif group_by == self.GROUP_VENDOR:
-            self._init_for_vendor()
+            self._init_for_item_type(item_types)
         else:
-            raise ValueError("Unknown group_by value")
+            self._init_for_vendor()
+
+    @classmethod
+    def query(cls, group_by, event: Event):
+        """
+        :return: Query of items of the event, grouped by `group_by` and waiting for `aggregates`.
+        """
+        query = (Item.objects
+                 .using(event.get_real_database_alias())
+                 .filter(vendor__event=event)
+                 .values(group_by))
+        if group_by == cls.GROUP_VENDOR:
+            # Order vendor data by their id.
+            query = query.order_by("vendor_id")
+        return query
 
-    def _init_for_item_type(self):
+    @classmethod
+    def aggregates(cls) -> dict:
+        """
+        :return: Aggregates for a result list that contains values for all states and sum per group_by value.
+        """
+        raise NotImplementedError()
+
+    def _init_for_item_type(self, item_types):
         # Make the list data associative by item type.
         # The item type in raw_data is pk of ItemType.
         data = {
@@ -99,23 +155,23 @@ class ItemCollectionData(object):
                     item_data[property_key] = cell_value
                 sums[property_key] += cell_value
 
+        if item_types is None:
+            item_types = (ItemType.objects
+                          .using(self._event.get_real_database_alias())
+                          .filter(event=self._event)
+                          .order_by("order")
+                          .values_list("id", flat=True))
+
         # Fill possible gaps and order correctly.
         self._data = OrderedDict(
             (key, data.get(key, self._DEFAULT_VALUES))
-            for key in ItemType.objects
-                               .using(self._event.get_real_database_alias())
-                               .filter(event=self._event)
-                               .order_by("order")
-                               .values_list("id", flat=True)
+            for key in item_types
         )
 
         # Append calculated sum row.
         self._data["sum"] = sums
 
     def _init_for_vendor(self):
-        # Order vendor data by their id.
-        self._raw_data = self._raw_data.order_by("vendor_id")
-
         data = OrderedDict(
             (row["vendor"], row)
             for row in self._raw_data
@@ -136,9 +192,6 @@ class ItemCollectionData(object):
     def keys(self):
         return self._data.keys()
 
-    def _populate(self, query):
-        raise NotImplementedError()
-
     @classmethod
     def columns(cls):
         # XXX: This assumes subclasses of ItemCollectionRow follow these orders.
@@ -204,26 +257,24 @@ def _state_queries(props, aggregate, condition, result, field):
 
 
 class ItemCountData(ItemCollectionData):
-    def _populate(self, query):
-        # Count items per state. query must be already made group_by with query.values.
+    @classmethod
+    def aggregates(cls):
+        # Count items per state.
         states = {
             key: models.Count(models.Case(models.When(
                 models.Q(state=p, hidden=False) if p == Item.ADVERTISED else models.Q(state=p),
                 then=1), output_field=models.IntegerField()))
-            for key, p in self.PROPERTIES.items()
+            for key, p in cls.PROPERTIES.items()
             if p is not None
         }
         abandoned = _state_queries(
-            self.ABANDONED_PROPERTIES, models.Count, models.Q(abandoned=True), 1, models.IntegerField)
+            cls.ABANDONED_PROPERTIES, models.Count, models.Q(abandoned=True), 1, models.IntegerField)
         hidden = _state_queries(
-            self.HIDDEN_PROPERTIES, models.Count, models.Q(hidden=True), 1, models.IntegerField)
+            cls.HIDDEN_PROPERTIES, models.Count, models.Q(hidden=True), 1, models.IntegerField)
         states.update(abandoned)
         states.update(hidden)
-        # Return a result list that contains counts for all states, sum and the value for group_by per list item.
-        return query.annotate(
-            sum=models.Count("id"),
-            **states
-        )
+        states["sum"] = models.Count("id")
+        return states
 
     def data_set(self, key, name):
         return ItemCountRow(key, self._data[key], name)
@@ -239,26 +290,24 @@ class ItemEurosData(ItemCollectionData):
         super(ItemEurosData, self).__init__(*args, **kwargs)
         self.use_cents = False
 
-    def _populate(self, query):
-        # Count item prices per state. query must be already made group_by with query.values.
+    @classmethod
+    def aggregates(cls):
+        # Count item prices per state.
         states = {
             key: models.Sum(models.Case(models.When(
                 models.Q(state=p, hidden=False) if p == Item.ADVERTISED else models.Q(state=p),
                 then=models.F("price")), output_field=models.DecimalField()))
-            for key, p in self.PROPERTIES.items()
+            for key, p in cls.PROPERTIES.items()
             if p is not None
         }
         abandoned = _state_queries(
-            self.ABANDONED_PROPERTIES, models.Sum, models.Q(abandoned=True), models.F("price"), models.DecimalField)
+            cls.ABANDONED_PROPERTIES, models.Sum, models.Q(abandoned=True), models.F("price"), models.DecimalField)
         hidden = _state_queries(
-            self.HIDDEN_PROPERTIES, models.Sum, models.Q(hidden=True), models.F("price"), models.DecimalField)
+            cls.HIDDEN_PROPERTIES, models.Sum, models.Q(hidden=True), models.F("price"), models.DecimalField)
         states.update(abandoned)
         states.update(hidden)
-        # Return a result list that contains prices for all states, sum and the value for group_by per list item.
-        return query.annotate(
-            sum=models.Sum("price"),
-            **states
-        )
+        states["sum"] = models.Sum("price")
+        return states
 
     def data_set(self, key, name):
         return ItemEurosRow(self.use_cents, key, self._data[key], name)
@@ -282,6 +331,166 @@ class ItemEurosRow(ItemCollectionRow):
         return formatted_value
 
 
+def _count_when(condition, distinct_field=None):
+    if distinct_field is not None:
+        return models.Count(models.Case(models.When(condition, then=models.F(distinct_field))), distinct=True)
+    return models.Count(models.Case(models.When(condition, then=1), output_field=models.IntegerField()))
+
+
+def _percentage(part, total):
+    return (part * 100.0 / total) if total > 0 else 0
+
+
+def general_stats(event: Event) -> dict:
+    """
+    Calculate general counters of an Event, with one query per model.
+    The result is cached for KIRPPU_GENERAL_STATS_CACHE_SECONDS.
+
+    :param event: The real Event (see `Event.get_real_event`).
+    """
+    timeout = getattr(settings, "KIRPPU_GENERAL_STATS_CACHE_SECONDS", 0)
+    key = _event_cache_prefix(event) + ":general"
+    if timeout:
+        result = cache.get(key)
+        if result is not None:
+            return result
+
+    database = event.get_real_database_alias()
+    brought_states = (Item.BROUGHT, Item.STAGED, Item.SOLD, Item.COMPENSATED, Item.RETURNED)
+    q = models.Q
+
+    items = Item.objects.using(database).filter(vendor__event=event).aggregate(
+        registered=models.Count("id"),
+        deleted=_count_when(q(hidden=True)),
+        brought=_count_when(q(state__in=brought_states)),
+        sold=_count_when(q(state__in=(Item.STAGED, Item.SOLD, Item.COMPENSATED))),
+        printed_deleted=_count_when(q(hidden=True, printed=True)),
+        printed_not_brought=_count_when(q(printed=True, state=Item.ADVERTISED)),
+        items_in_box=_count_when(q(box__isnull=False)),
+        brought_box_items=_count_when(q(box__isnull=False, state__in=brought_states)),
+        items_in_deleted_boxes=_count_when(q(box__representative_item__hidden=True)),
+    )
+    boxes = Box.objects.using(database).filter(representative_item__vendor__event=event).aggregate(
+        registered=models.Count("id"),
+        deleted=_count_when(q(representative_item__hidden=True)),
+        brought=_count_when(q(representative_item__state__in=brought_states)),
+    )
+    vendors = Vendor.objects.using(database).filter(event=event).aggregate(
+        brought=_count_when(q(item__state__in=brought_states), "id"),
+        total=_count_when(q(item__isnull=False), "id"),
+        mobile=_count_when(q(mobile_view_visited=True), "id"),
+    )
+
+    registered = items["registered"]
+    brought = items["brought"]
+    items_in_box = items["items_in_box"]
+    registered_boxes = boxes["registered"]
+
+    result = {
+        "registered": registered,
+        "deleted": items["deleted"],
+        "deletedOfRegistered": _percentage(items["deleted"], registered),
+        "brought": brought,
+        "broughtOfRegistered": _percentage(brought, registered),
+        "broughtBoxItems": items["brought_box_items"],
+        "broughtBoxItemsOfRegistered": _percentage(items["brought_box_items"], items_in_box),
+        "printedDeleted": items["printed_deleted"],
+        "printedNotBrought": items["printed_not_brought"],
+        "sold": items["sold"],
+        "soldOfBrought": _percentage(items["sold"], brought),
+        "vendors": vendors["brought"],
+        "vendorsTotal": vendors["total"],
+        "vendorsInMobileView": vendors["mobile"],
+
+        "itemsInBox": items_in_box,
+        "itemsNotInBox": registered - items_in_box,
+        "broughtBoxes": boxes["brought"],
+        "broughtBoxesOfRegistered": _percentage(boxes["brought"], registered_boxes),
+        "registeredBoxes": registered_boxes,
+        "deletedBoxes": boxes["deleted"],
+        "deletedOfRegisteredBoxes": _percentage(boxes["deleted"], registered_boxes),
+        "itemsInDeletedBoxes": items["items_in_deleted_boxes"],
+        "itemsInDeletedBoxesOfRegistered": _percentage(items["items_in_deleted_boxes"], registered),
+    }
+    if timeout:
+        cache.set(key, result, timeout)
+    return result
+
+
+def _summary_aggregates(prefix):
+    """
+    Aggregates of `ItemCountData` and `ItemEurosData` (the latter with `prefix`) calculated from VendorItemSummaryRow.
+    """
+    conditions = {
+        key: models.Q(state=p, hidden=False) if p == Item.ADVERTISED else models.Q(state=p)
+        for key, p in ItemCollectionData.PROPERTIES.items()
+        if p is not None
+    }
+    conditions.update(
+        (key, models.Q(state=p, abandoned=True)) for key, p in ItemCollectionData.ABANDONED_PROPERTIES.items())
+    conditions.update(
+        (key, models.Q(state=p, hidden=True)) for key, p in ItemCollectionData.HIDDEN_PROPERTIES.items())
+
+    aggregates = {}
+    for key, condition in conditions.items():
+        aggregates[key] = Coalesce(models.Sum(models.Case(models.When(condition, then=models.F("count")))), 0)
+        aggregates[prefix + key] = models.Sum(models.Case(models.When(condition, then=models.F("price_sum"))))
+    aggregates["sum"] = models.Sum("count")
+    aggregates[prefix + "sum"] = models.Sum("price_sum")
+    return aggregates
+
+
+class ItemCountEurosData(object):
+    """
+    Both `ItemCountData` and `ItemEurosData` for the same grouping, calculated with a single query.
+    They are available as `counts` and `euros`.
+
+    For other than remote events, the query reads VendorItemSummaryRow instead of items,
+    so changes are seen after the next `update_summaries`.
+    """
+    EUROS_PREFIX = "euros_"
+    GROUP_ITEM_TYPE = ItemCollectionData.GROUP_ITEM_TYPE
+    GROUP_VENDOR = ItemCollectionData.GROUP_VENDOR
+
+    def __init__(self, group_by, event: Event, item_types=None):
+        """
+        :param group_by: Data set to represent on rows, see `ItemCollectionData`.
+        :param event: The Event.
+        :param item_types: Ids of ItemTypes of the Event in order, or None to query them if needed.
+        """
+        count_aggregates = ItemCountData.aggregates()
+        euro_aggregates = ItemEurosData.aggregates()
+        if not isinstance(event, RemoteEvent):
+            query = VendorItemSummaryRow.objects.filter(vendor__event=event).values(group_by)
+            if group_by == self.GROUP_VENDOR:
+                query = query.order_by("vendor_id")
+            rows = list(query.annotate(**_summary_aggregates(self.EUROS_PREFIX)))
+        else:
+            aggregates = dict(count_aggregates)
+            aggregates.update((self.EUROS_PREFIX + key, value) for key, value in euro_aggregates.items())
+            rows = list(ItemCollectionData.query(group_by, event).annotate(**aggregates))
+        if group_by == self.GROUP_ITEM_TYPE and item_types is None:
+            item_types = list(ItemType.objects
+                              .using(event.get_real_database_alias())
+                              .filter(event=event)
+                              .order_by("order")
+                              .values_list("id", flat=True))
+
+        count_rows = []
+        euro_rows = []
+        for row in rows:
+            count_row = {key: row[key] for key in count_aggregates}
+            count_row[group_by] = row[group_by]
+            count_rows.append(count_row)
+
+            euro_row = {key: row[self.EUROS_PREFIX + key] for key in euro_aggregates}
+            euro_row[group_by] = row[group_by]
+            euro_rows.append(euro_row)
+
+        self.counts = ItemCountData(group_by, event, rows=count_rows, item_types=item_types)
+        self.euros = ItemEurosData(group_by, event, rows=euro_rows, item_types=item_types)
+
+
 # endregion
 
 
@@ -293,39 +502,136 @@ class ItemEurosRow(ItemCollectionRow):
 class GraphLog(object):
     unix_epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
 
-    def __init__(self, event: Event, as_prices=False, extra_filter=None):
+    def __init__(self, event: Event, as_prices=False, extra_filter=None, resolution: timedelta = None):
+        """
+        :param resolution: Bucket size of the output. Must be a multiple of BUCKET_TD. Default is BUCKET_TD.
+        """
         self._event = event
         self._as_prices = as_prices
         self._filter = extra_filter or dict()
+        self._resolution = resolution or BUCKET_TD
+        if self._resolution % BUCKET_TD:
+            raise ValueError("Resolution must be a multiple of {}".format(BUCKET_TD))
+
+    def query(self):
+        """
+        :return: Query of (bucket, old_state, new_state, value) tuples from ItemStateLogRollup.
+            The same transition may have several tuples in a bucket, as pending rows are read
+            together with the folded ones.
+        """
+        if isinstance(self._event, RemoteEvent):
+            return self._log_query()
 
-    def query(self, only):
-        query = self._create_query().filter(item__vendor__event=self._event)
+        query = self._create_query(ItemStateLogRollup.objects.filter(itemtype__event=self._event))
         query = query.filter(**self._filter)
-        if self._as_prices:
-            return query.only("item__price", *only).annotate(value=F("item__price"))
-        return query.only(*only).annotate(value=models.Value(1, output_field=models.IntegerField()))
+        value = "price_sum" if self._as_prices else "count"
+        return query.values_list("bucket", "old_state", "new_state", value)
+
+    def _log_query(self):
+        # Remote events are read-only copies whose rollup may be missing or not up to date,
+        # so the same tuples are aggregated from their ItemStateLog.
+        query = ItemStateLog.objects.using(self._event.get_real_database_alias()) \
+            .filter(item__itemtype__event=self._event)
+        query = self._create_query(query)
+        query = query.filter(**{"item__" + key: value for key, value in self._filter.items()})
+        value = models.Sum("item__price") if self._as_prices else models.Count("id")
+        return (
+            query
+            .annotate(bucket=TruncMinute("time", tzinfo=timezone.utc))
+            .values("bucket", "old_state", "new_state")
+            .annotate(value=value)
+            .values_list("bucket", "old_state", "new_state", "value")
+        )
+
+    def cache_key(self):
+        filters = ",".join("{}={}".format(k, getattr(v, "pk", v)) for k, v in sorted(self._filter.items()))
+        return "{}:{}:{}:{}:{}".format(_event_cache_prefix(self._event), type(self).__name__, self._as_prices,
+                                       int(self._resolution.total_seconds()), filters)
+
+    @property
+    def as_prices(self) -> bool:
+        return self._as_prices
+
+    @property
+    def resolution(self) -> timedelta:
+        return self._resolution
+
+    def bucket_of(self, time: datetime) -> datetime:
+        return time - (time - self.unix_epoch) % self._resolution
+
+    def use_auto_resolution(self, points: int):
+        """
+        Select the smallest resolution from AUTO_RESOLUTIONS that gives at most `points` buckets
+        over the time span of the data.
+        """
+        span = self.query().aggregate(first=models.Min("bucket"), last=models.Max("bucket"))
+        if span["first"] is None:
+            return
+        length = span["last"] - span["first"]
+        for resolution in AUTO_RESOLUTIONS:
+            if length / resolution < points:
+                break
+        self._resolution = resolution
 
     @classmethod
     def datetime_to_js_time(cls, dt):
         return int((dt - cls.unix_epoch).total_seconds() * 1000)
 
-    def get_log_str(self, bucket_time, balance):
+    @classmethod
+    def js_time_to_datetime(cls, js_time: int):
+        return cls.unix_epoch + timedelta(milliseconds=js_time)
+
+    def parse_values(self, text: str) -> tuple:
+        """
+        Parse values of one output row without the time, as given in CSV output.
+
+        :raises ValueError: If the text is not valid for this formatter.
+        """
+        values = tuple(text.split(","))
+        if len(values) != len(self.zero_values()):
+            raise ValueError("Invalid number of values")
+        try:
+            return tuple(decimal.Decimal(value) if self._as_prices else int(value) for value in values)
+        except decimal.InvalidOperation as e:
+            raise ValueError(str(e))
+
+    def zero_values(self) -> tuple:
+        """
+        :return: Values of a row without the time when nothing has happened.
+        """
+        return self.get_log_values(self.unix_epoch, _empty_balance())[1:]
+
+    def get_log_values(self, bucket_time, balance) -> tuple:
+        """
+        :return: Values of one output row: js_time followed by the graph values.
+        """
         raise NotImplementedError
 
-    def _create_query(self):
+    @staticmethod
+    def format_csv(values) -> str:
+        return "%d,%s\n" % (values[0], ",".join(str(value) for value in values[1:]))
+
+    def get_log_str(self, bucket_time, balance):
+        return self.format_csv(self.get_log_values(bucket_time, balance))
+
+    def _create_query(self, query):
+        """
+        :param query: Query of ItemStateLogRollup or ItemStateLog.
+        :return: The query filtered to the transitions of this graph.
+        """
         raise NotImplementedError
 
 
 class RegistrationData(GraphLog):
     advertised_status = (Item.ADVERTISED,)
 
-    def _create_query(self):
-        return ItemStateLog.objects.using(self._event.get_real_database_alias()).filter(new_state=Item.ADVERTISED)
+    def _create_query(self, query):
+        return query.filter(new_state=Item.ADVERTISED)
 
-    def get_log_str(self, bucket_time, balance):
+    def get_log_values(self, bucket_time, balance):
         entry_time = self.datetime_to_js_time(bucket_time)
         advertised = sum(balance[status] for status in self.advertised_status)
-        return '%d,%s\n' % (
+        return (
             entry_time,
             advertised,
         )
@@ -337,16 +643,16 @@ class SalesData(GraphLog):
     money_status = (Item.SOLD,)
     compensated_status = (Item.COMPENSATED, Item.RETURNED)
 
-    def _create_query(self):
-        return ItemStateLog.objects.using(self._event.get_real_database_alias()).exclude(new_state=Item.ADVERTISED)
+    def _create_query(self, query):
+        return query.exclude(new_state=Item.ADVERTISED)
 
-    def get_log_str(self, bucket_time, balance):
+    def get_log_values(self, bucket_time, balance):
         entry_time = self.datetime_to_js_time(bucket_time)
         brought = sum(balance[status] for status in self.brought_status)
         unsold = sum(balance[status] for status in self.unsold_status)
         money = sum(balance[status] for status in self.money_status)
         compensated = sum(balance[status] for status in self.compensated_status)
-        return '%d,%s,%s,%s,%s\n' % (
+        return (
             entry_time,
             brought,
             unsold,
@@ -355,8 +661,41 @@ class SalesData(GraphLog):
         )
 
 
+BUCKET_TD = timedelta(seconds=60)
+AUTO_RESOLUTIONS = tuple(timedelta(minutes=m) for m in (1, 2, 5, 10, 15, 30, 60, 120, 180, 360, 720, 1440))
+MAX_RESOLUTION = timedelta(days=7)
+
+
+def _empty_balance():
+    return {item_type: 0 for item_type, _item_desc in Item.STATE}
+
+
+def _balance_buckets(rows, balance, bucket_of=None):
+    """
+    Apply rollup rows to balance, yielding the bucket time and the balance after each bucket.
+
+    :param rows: Iterable of (bucket, old_state, new_state, value) tuples, ordered by bucket.
+    :param balance: Balance to start from. The same dictionary is updated and yielded every time.
+    :param bucket_of: Function to combine rollup buckets into larger buckets, e.g. `GraphLog.bucket_of`.
+    """
+    bucket_time = None
+    for entry_time, old_state, new_state, value in rows:
+        if bucket_of is not None:
+            entry_time = bucket_of(entry_time)
+        if bucket_time is not None and entry_time != bucket_time:
+            yield bucket_time, balance
+        bucket_time = entry_time
+
+        if old_state:
+            balance[old_state] -= value
+        balance[new_state] += value
+
+    if bucket_time is not None:
+        yield bucket_time, balance
+
+
 def iterate_logs(using):
-    """ Iterate through ItemStateLog objects returning current sum of each type of object at each timestamp.
+    """ Iterate through ItemStateLog rollup returning current sum of each type of object at each timestamp.
 
     Example of returned CVS: js_time, advertised, brought, unsold, money, compensated
 
@@ -372,34 +711,363 @@ def iterate_logs(using):
     :return: JSON presentation of the objects, one item at a time.
 
     """
-    # Collect the data into buckets of size bucket_td to reduce the amount of data that has to be sent
-    # and parsed at client side.
-    balance = {item_type: 0 for item_type, _item_desc in Item.STATE}
-    bucket_time = None
-    bucket_td = timedelta(seconds=60)
+    return map(using.format_csv, iterate_log_values(using))
 
-    only = "old_state", "new_state", "time"
-    entries = using.query(only)
 
-    for entry in entries.order_by("time"):
-        if bucket_time is None:
-            bucket_time = entry.time
+def iterate_log_values(using):
+    """
+    Same as `iterate_logs`, but yields tuples of values from `GraphLog.get_log_values` instead of lines.
+    """
+    # The data is collected into buckets of size BUCKET_TD by ItemStateLogRollup to reduce the amount of data
+    # that has to be read, sent and parsed at client side.
+    first = True
+    rows = using.query().order_by("bucket")
+    for bucket_time, balance in _balance_buckets(rows, _empty_balance(), using.bucket_of):
+        if first:
+            first = False
             # Start the graph before the first entry, such that everything starts at zero.
-            yield using.get_log_str(bucket_time - bucket_td, balance)
-        if (entry.time - bucket_time) > bucket_td:
-            # Fart out what was in the old bucket and start a new bucket.
-            yield using.get_log_str(bucket_time, balance)
-            bucket_time = entry.time
+            yield using.get_log_values(bucket_time - using.resolution, _empty_balance())
+        yield using.get_log_values(bucket_time, balance)
 
-        item_weight = entry.value
 
-        if entry.old_state:
-            balance[entry.old_state] -= item_weight
-        balance[entry.new_state] += item_weight
+def iterate_log_values_since(using, since: int, last_values: tuple):
+    """
+    Continue `iterate_log_values` output from a finished row the client already has, yielding only newer rows.
+    The row must be earlier than `closed_js_time`, as changes to its bucket after `since` are not read again.
 
-    # Fart out the last bucket.
-    if bucket_time is not None:
-        yield using.get_log_str(bucket_time, balance)
+    The balance is not read from history; as every value is a sum over item states, the values of
+    newer rows are the client's values plus the changes since that row. Only finished buckets are
+    returned, so that the last row can be used as the starting point of the next call.
+
+    :param using: GraphLog used to create the output.
+    :type using: GraphLog
+    :param since: js_time of the row the client has.
+    :param last_values: Values of that row without the time, from `GraphLog.parse_values`.
+    :raises OverflowError: If `since` is out of the range of datetime. Raised already by the call,
+        not when the rows are iterated.
+    """
+    start = using.js_time_to_datetime(since) + using.resolution
+    return _iterate_log_values_since(using, start, last_values)
+
+
+def _iterate_log_values_since(using, start: datetime, last_values: tuple):
+    query = using.query().filter(
+        bucket__gte=start,
+        bucket__lt=_closed_before(using),
+    )
+    for bucket_time, balance in _balance_buckets(query.order_by("bucket"), _empty_balance(), using.bucket_of):
+        values = using.get_log_values(bucket_time, balance)
+        yield (values[0],) + tuple(last + change for last, change in zip(last_values, values[1:]))
+
+
+def closed_log_values(using) -> tuple:
+    """
+    Get the last finished row of `iterate_log_values` output, which can be used to call `iterate_log_values_since`.
+    If there is no finished row, a zero row just before the first unfinished bucket is returned.
+
+    :param using: GraphLog used to create the output.
+    :type using: GraphLog
+    :return: Tuple of js_time and values of the row without the time.
+    """
+    closed_before = _closed_before(using)
+    closed_js_time = using.datetime_to_js_time(closed_before)
+    last = None
+    for row in cached_iterate_log_values(using):
+        if row[0] >= closed_js_time:
+            break
+        last = row
+    if last is None:
+        return using.datetime_to_js_time(closed_before - using.resolution), using.zero_values()
+    return last[0], last[1:]
+
+
+def closed_js_time(using) -> int:
+    """
+    Get the time before which rows of `iterate_log_values` output are finished and do not change anymore.
+    A client that has the full output resumes with `iterate_log_values_since` from its last row earlier than this,
+    because later rows, including the last one, may still get changes.
+
+    :param using: GraphLog used to create the output.
+    :type using: GraphLog
+    :return: js_time of the first unfinished bucket.
+    """
+    return using.datetime_to_js_time(_closed_before(using))
+
+
+def _closed_before(using):
+    """
+    :return: Start of the first output bucket of `using` that is not finished yet.
+    """
+    # Transitions of the previous rollup bucket may still be in uncommitted transactions, so it is not closed yet.
+    close_limit = now() - 2 * BUCKET_TD
+    return using.bucket_of(close_limit + BUCKET_TD)
+
+
+def cached_iterate_logs(using):
+    """
+    Same as `iterate_logs`, but output of finished buckets is stored in Django cache,
+    so that only buckets newer than those need to be read from database.
+
+    :param using: GraphLog used to create the output.
+    :type using: GraphLog
+    """
+    return map(using.format_csv, cached_iterate_log_values(using))
+
+
+def cached_iterate_log_values(using):
+    """
+    Same as `cached_iterate_logs`, but yields tuples of values like `iterate_log_values`.
+    """
+    timeout = getattr(settings, "KIRPPU_STATS_CACHE_SECONDS", 0)
+    if not timeout:
+        yield from iterate_log_values(using)
+        return
+
+    key = "{}:{}".format(_cache_generation(using._event), using.cache_key())
+    state = cache.get(key)
+    if state is None:
+        rows, balance, closed_until = [], _empty_balance(), None
+        query = using.query()
+    else:
+        rows, balance, closed_until = state
+        query = using.query().filter(bucket__gte=closed_until)
+    yield from rows
+
+    closed_before = _closed_before(using)
+    closed_rows = []
+    closed_balance = None
+    first = state is None
+    for bucket_time, balance in _balance_buckets(query.order_by("bucket"), balance, using.bucket_of):
+        out = []
+        if first:
+            first = False
+            out.append(using.get_log_values(bucket_time - using.resolution, _empty_balance()))
+        out.append(using.get_log_values(bucket_time, balance))
+
+        if bucket_time < closed_before:
+            closed_rows.extend(out)
+            closed_balance = dict(balance)
+            closed_until = bucket_time + using.resolution
+        yield from out
+
+    if closed_balance is not None:
+        cache.set(key, (rows + closed_rows, closed_balance, closed_until), timeout)
+
+
+def downsample_log_values(rows, points: int):
+    """
+    Reduce rows from `iterate_log_values` to at most `points` rows with Largest-Triangle-Three-Buckets algorithm,
+    keeping the rows that best preserve the shape of the graph. First and last rows are always kept.
+    As the graph has several lines, the triangle area is summed over all of them.
+
+    :param rows: Iterable of value tuples.
+    :param points: Maximum number of rows to return. Must be at least 3.
+    :return: List of value tuples.
+    """
+    rows = list(rows)
+    if len(rows) <= points:
+        return rows
+
+    result = [rows[0]]
+    # Rows between the first and last are divided into points - 2 buckets, from each of which one row is selected.
+    every = (len(rows) - 2) / (points - 2)
+    for index in range(points - 2):
+        start = int(index * every) + 1
+        end = int((index + 1) * every) + 1
+        next_end = min(int((index + 2) * every) + 1, len(rows))
+        next_bucket = rows[end:next_end] if index < points - 3 else rows[-1:]
+        average = [sum(float(row[column]) for row in next_bucket) / len(next_bucket)
+                   for column in range(len(rows[0]))]
+
+        previous = result[-1]
+        previous_time = float(previous[0])
+        best = None
+        best_area = -1.0
+        for row in rows[start:end]:
+            area = 0.0
+            row_time = float(row[0])
+            for column in range(1, len(row)):
+                area += abs(
+                    (previous_time - average[0]) * (float(row[column]) - float(previous[column]))
+                    - (previous_time - row_time) * (average[column] - float(previous[column]))
+                )
+            if area > best_area:
+                best_area = area
+                best = row
+        result.append(best)
+
+    result.append(rows[-1])
+    return result
+
+
+PACKED_CONTENT_TYPE = "application/x-kirppu-stats"
+
+
+def pack_log_values(rows, as_prices=False, chunk_size=256):
+    """
+    Encode rows from `iterate_log_values` into compact binary form. All numbers are little-endian:
+
+        uint32  number of columns in a row, including the time
+        int64   time of the first row in milliseconds, or zero if there are no rows
+        for each row:
+            int64   difference to the time of the previous row in milliseconds
+            int32[] for each other column, difference to the value of the previous row (zero before first row)
+
+    The time difference is 64 bits, as there may be weeks between rows. Prices are in cents.
+
+    :param rows: Iterable of value tuples.
+    :param as_prices: Whether the values are prices.
+    :param chunk_size: Number of rows in one yielded bytes object.
+    :return: Generator of bytes.
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        yield struct.pack("<Iq", 0, 0)
+        return
+
+    columns = len(first)
+    scale = 100 if as_prices else 1
+    yield struct.pack("<Iq", columns, first[0])
+
+    row_format = struct.Struct("<q%di" % (columns - 1))
+    previous = [first[0]] + [0] * (columns - 1)
+    chunk = []
+    for row in itertools.chain((first,), rows):
+        current = [row[0]] + [int(value * scale) for value in row[1:]]
+        chunk.append(row_format.pack(*(c - p for c, p in zip(current, previous))))
+        previous = current
+        if len(chunk) >= chunk_size:
+            yield b"".join(chunk)
+            chunk = []
+    if chunk:
+        yield b"".join(chunk)
+
+
+def _event_cache_prefix(event):
+    return "kirppu-stats:{}:{}".format(event.get_real_database_alias(), event.pk)
+
+
+def _cache_generation(event) -> str:
+    key = _event_cache_prefix(event) + ":generation"
+    return "{}:{}".format(key, cache.get(key, 0))
+
+
+def update_summaries(event: Event):
+    """
+    Fold the pending ItemStateLogRollup rows of given Event in finished buckets, and refresh changed
+    vendor item summaries. This is run periodically with `update_stats` management command instead of
+    when reading, so that reading the statistics does not write or lock anything.
+    """
+    ItemStateLogRollup.objects.fold(event, ItemStateLogRollup.objects.bucket_of(now() - BUCKET_TD))
+    VendorItemSummary.objects.refresh(event)
+
+
+def invalidate_stats_cache(event):
+    """
+    Invalidate cached statistics graphs of given Event, e.g. after its ItemStateLogRollup has been rebuilt.
+    """
+    key = _event_cache_prefix(event) + ":generation"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+# endregion
+
+
+########################
+
+
+# region Distributions.
+
+# Percentiles shown for distributions, as (percentile, label).
+DISTRIBUTION_PERCENTILES = ((68, "68%"), (95, "95%"), (99.7, "99.7%"))
+
+
+# Largest number of histogram buckets. A larger step is used if the given one would give more buckets.
+DISTRIBUTION_MAX_BUCKETS = 200
+
+
+def distribution(query: models.QuerySet, field: str, step: int, max_buckets: int = DISTRIBUTION_MAX_BUCKETS) -> dict:
+    """
+    Calculate histogram and summary numbers of a distribution in the database.
+    Only the summary numbers, histogram buckets and values needed for percentiles are read from the database.
+
+    Percentiles are interpolated linearly between the closest values.
+
+    :param query: Query having one row per value.
+    :param field: Name of the non-negative value in `query`. This must not be an aggregate,
+        but can be e.g. a `Subquery` annotation. Rows where it is null are not counted.
+    :param step: Width of a histogram bucket.
+    :param max_buckets: If the histogram with `step` would have more buckets than this,
+        the step is multiplied so that it does not.
+    :return: Dictionary of `count`, `mean`, `pstdev` (population standard deviation), `median`,
+        `percentiles` as list of (value, label) for DISTRIBUTION_PERCENTILES, `step` as it was used, and `frequency`,
+        where `frequency[i]` is the number of values in range [i * step, (i + 1) * step).
+        The last bucket is always empty.
+    """
+    query = query.filter(**{field + "__isnull": False}).order_by()
+    summary = query.aggregate(
+        count=models.Count("pk"),
+        mean=models.Avg(field),
+        pstdev=models.StdDev(field, sample=False),
+        max=models.Max(field),
+    )
+    count = summary["count"]
+    result = {
+        "count": count,
+        "step": step,
+        "frequency": [],
+    }
+    if count == 0:
+        return result
+
+    max_value = float(summary["max"])
+    step *= max(1, math.ceil(max_value / (step * (max_buckets - 2))))
+    result["step"] = step
+    frequency = dict(
+        query
+        .annotate(_bucket=Floor(models.F(field) / step))
+        .values("_bucket")
+        .annotate(_count=models.Count("pk"))
+        .values_list("_bucket", "_count")
+    )
+    frequency = {int(bucket): bucket_count for bucket, bucket_count in frequency.items()}
+
+    # Positions of the sorted values needed for median and percentiles.
+    median_positions = (count // 2,) if count % 2 == 1 else (count // 2 - 1, count // 2)
+    percentile_ranks = [(p / 100) * (count - 1) for p, _label in DISTRIBUTION_PERCENTILES]
+    wanted = set(median_positions)
+    for rank in percentile_ranks:
+        wanted.update((math.floor(rank), min(math.floor(rank) + 1, count - 1)))
+    # The wrapper only avoids a cast of decimal fields that Django adds inside the window on SQLite.
+    order = models.ExpressionWrapper(models.F(field), output_field=models.FloatField())
+    at = dict(
+        query
+        .annotate(_position=models.Window(RowNumber(), order_by=order.asc()))
+        .filter(_position__in=[pos + 1 for pos in wanted])
+        .values_list("_position", field)
+    )
+    at = {pos - 1: float(value) for pos, value in at.items()}
+    # Values may have been removed after counting. Use the largest value for the positions that were not found.
+    at.update((pos, max_value) for pos in wanted if pos not in at)
+
+    result["frequency"] = [frequency.get(bucket, 0) for bucket in range(math.floor(max_value / step) + 2)]
+    result["mean"] = float(summary["mean"])
+    result["pstdev"] = float(summary["pstdev"])
+    result["median"] = sum(at[pos] for pos in median_positions) / len(median_positions)
+
+    percentiles = []
+    for rank, (_percentile, label) in zip(percentile_ranks, DISTRIBUTION_PERCENTILES):
+        pos = math.floor(rank)
+        value = at[pos]
+        if rank > pos:
+            value += (rank - pos) * (at[pos + 1] - value)
+        percentiles.append((value, label))
+    result["percentiles"] = percentiles
+    return result
 
 
 # endregion
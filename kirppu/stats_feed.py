@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import logging
+import typing
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import stats
+from .models import Event, RemoteEvent
+
+__all__ = (
+    "StatsFeed",
+    "subscribe",
+)
+
+logger = logging.getLogger(__name__)
+
+
+class StatsFeed(object):
+    """
+    Producer of live statistics of one event.
+
+    One feed is shared by all viewers of the event in this process, so the database is read once per
+    interval regardless of the number of viewers. The feed is started by the first viewer and stopped
+    when the last viewer leaves.
+
+    Messages are server-sent events:
+    `sales` and `registration` contain new finished graph rows in the CSV format of the graph endpoints,
+    one row per data line, and `general` contains counters of `stats.general_stats` as JSON.
+    """
+    _feeds: dict[tuple, "StatsFeed"] = {}
+
+    def __init__(self, event: typing.Union[Event, RemoteEvent]):
+        self._event = event
+        self._key = self.key_of(event)
+        self._subscribers: set[asyncio.Queue] = set()
+        self._task: typing.Optional[asyncio.Task] = None
+        self._graphs = {
+            "sales": stats.SalesData(event=event),
+            "registration": stats.RegistrationData(event=event),
+        }
+        self._last_rows: dict[str, tuple] = {}
+        self._general = None
+
+    @staticmethod
+    def key_of(event) -> tuple:
+        return event.get_real_database_alias(), event.pk
+
+    @classmethod
+    def get(cls, event) -> "StatsFeed":
+        feed = cls._feeds.get(cls.key_of(event))
+        if feed is None:
+            feed = cls._feeds[cls.key_of(event)] = cls(event)
+        return feed
+
+    def add(self) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self._subscribers.add(queue)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        elif self._general is not None:
+            queue.put_nowait(self._general_message(self._general))
+        return queue
+
+    def remove(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+        if not self._subscribers:
+            if self._task is not None:
+                self._task.cancel()
+                self._task = None
+            if self._feeds.get(self._key) is self:
+                del self._feeds[self._key]
+
+    async def _run(self):
+        interval = getattr(settings, "KIRPPU_LIVE_STATS_INTERVAL", 10)
+        try:
+            await sync_to_async(self._start)()
+            while True:
+                for message in await sync_to_async(self._poll)():
+                    self._publish(message)
+                await asyncio.sleep(interval)
+        except Exception:
+            logger.exception("Live statistics feed of %s failed", self._key)
+            # End all subscriptions. Clients reconnect to a new feed after the retry interval.
+            if self._feeds.get(self._key) is self:
+                del self._feeds[self._key]
+            self._publish(None)
+
+    def _publish(self, message: typing.Optional[str]):
+        for queue in self._subscribers:
+            queue.put_nowait(message)
+
+    def _start(self):
+        for name, formatter in self._graphs.items():
+            js_time, values = stats.closed_log_values(formatter)
+            self._last_rows[name] = (js_time,) + values
+
+    def _poll(self) -> list[str]:
+        messages = []
+        for name, formatter in self._graphs.items():
+            last = self._last_rows[name]
+            rows = list(stats.iterate_log_values_since(formatter, last[0], last[1:]))
+            if rows:
+                self._last_rows[name] = rows[-1]
+                messages.append(self._message(name, [formatter.format_csv(row).rstrip("\n") for row in rows]))
+
+        general = stats.general_stats(self._event)
+        if general != self._general:
+            self._general = general
+            messages.append(self._general_message(general))
+        return messages
+
+    @classmethod
+    def _general_message(cls, general) -> str:
+        return cls._message("general", [json.dumps(general)])
+
+    @staticmethod
+    def _message(name: str, lines: list[str]) -> str:
+        return "event: {}\n{}\n".format(name, "".join("data: {}\n".format(line) for line in lines))
+
+
+async def subscribe(event: typing.Union[Event, RemoteEvent]) -> typing.AsyncIterator[str]:
+    """
+    Iterate server-sent event messages of the live statistics feed of the event.
+    A comment is sent after a while without messages to keep the connection open.
+    """
+    interval = getattr(settings, "KIRPPU_LIVE_STATS_INTERVAL", 10)
+    feed = StatsFeed.get(event)
+    queue = feed.add()
+    try:
+        yield "retry: {}\n\n".format(int(interval * 1000))
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=max(interval * 3, 15))
+            except asyncio.TimeoutError:
+                yield ":\n\n"
+                continue
+            if message is None:
+                break
+            yield message
+    finally:
+        feed.remove(queue)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+import csv
+import io
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.test import TestCase
+from django.utils.timezone import now
+
+from ..models import Item, Receipt, ReceiptExtraRow, ReceiptItem, VendorLedgerEntry
+from ..views import accounting
+from .factories import (
+    ClerkFactory,
+    CounterFactory,
+    EventFactory,
+    EventPermissionFactory,
+    ItemFactory,
+    ReceiptFactory,
+    ReceiptItemFactory,
+    UserFactory,
+    VendorFactory,
+)
+
+
+class AccountingTest(TestCase):
+    def setUp(self):
+        self.event = EventFactory()
+        self.clerk = ClerkFactory(event=self.event)
+        self.counter = CounterFactory(event=self.event)
+        self.vendors = [VendorFactory(event=self.event) for _ in range(2)]
+        self.start = start = now() - timedelta(hours=1)
+
+        for index in range(4):
+            items = [
+                ItemFactory(vendor=vendor, price=Decimal("1.50"), state=Item.SOLD)
+                for vendor in self.vendors
+            ]
+            self._receipt(Receipt.TYPE_PURCHASE, items, start + timedelta(minutes=index))
+
+        compensated = list(Item.objects.filter(vendor=self.vendors[0]))
+        Item.objects.filter(vendor=self.vendors[0]).update(state=Item.COMPENSATED)
+        receipt = self._receipt(Receipt.TYPE_COMPENSATION, compensated, start + timedelta(minutes=10),
+                                vendor=self.vendors[0])
+        ReceiptExtraRow.objects.create(receipt=receipt, type=ReceiptExtraRow.TYPE_PROVISION, value=Decimal("-0.60"))
+        VendorLedgerEntry.objects.rebuild(self.event)
+
+    def _receipt(self, type_, items, end_time, **kwargs):
+        receipt = ReceiptFactory(clerk=self.clerk, counter=self.counter, type=type_, status=Receipt.FINISHED,
+                                 end_time=end_time, **kwargs)
+        for item in items:
+            ReceiptItemFactory(receipt=receipt, item=item)
+        return receipt
+
+    def _rows(self, **kwargs):
+        output = io.StringIO()
+        accounting.accounting_receipt(output, self.event, **kwargs)
+        return list(csv.reader(io.StringIO(output.getvalue())))
+
+    def test_rows(self):
+        rows = self._rows()
+        v0, v1 = (str(v.pk) for v in self.vendors)
+
+        # Header, 4 purchases for 2 vendors, payout, commission, forfeit of the other vendor, empty sanity row.
+        self.assertEqual(1 + 8 + 2 + 1 + 1, len(rows))
+        self.assertEqual([v0, "150", "150"], [rows[1][2], rows[1][4], rows[1][5]])
+        self.assertEqual([v0, "-540", "60"], [rows[9][2], rows[9][4], rows[9][5]])
+        self.assertEqual([v0, "-60", "0"], [rows[10][2], rows[10][4], rows[10][5]])
+        self.assertEqual([v1, "-600", "0", "0"], [rows[11][2], rows[11][4], rows[11][5], rows[11][6]])
+        self.assertEqual([], rows[12])
+
+    def test_chunked(self):
+        expected = self._rows()
+        with mock.patch.object(accounting, "RECEIPT_CHUNK_SIZE", 2):
+            # Receipts, and their rows and extra rows per each of three chunks, ledger balances,
+            # and the two sanity sums.
+            with self.assertNumQueries(1 + 3 * 2 + 1 + 2):
+                rows = self._rows()
+        # Forfeit rows have the time of the export.
+        self.assertEqual([r[:1] + r[2:] for r in expected], [r[:1] + r[2:] for r in rows])
+
+    def test_view(self):
+        user = UserFactory()
+        EventPermissionFactory(event=self.event, user=user, can_see_accounting=True)
+        self.client.force_login(user)
+        response = self.client.get("/kirppu/%s/accounting/" % self.event.slug)
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.streaming)
+        self.assertEqual(13, b"".join(response.streaming_content).count(b"\n"))
+
+        url = "/kirppu/%s/accounting/" % self.event.slug
+        response = self.client.get(url, {"since": (self.start + timedelta(minutes=5)).isoformat()})
+        self.assertEqual(5, b"".join(response.streaming_content).count(b"\n"))
+        self.assertEqual(400, self.client.get(url, {"since": "yesterday"}).status_code)
+
+    def test_since(self):
+        expected = self._rows()
+        since = self.start + timedelta(minutes=1, seconds=30)
+        with self.assertNumQueries(1 + 1 + 1 + 2 + 1):
+            rows = self._rows(since=since)
+
+        # Two last purchases, payout and commission, and forfeit.
+        self.assertEqual(1 + 4 + 2 + 1 + 1, len(rows))
+        # Balances and event numbers continue from the ledger. Forfeit time differs.
+        self.assertEqual([r[:1] + r[2:] for r in expected[5:12]], [r[:1] + r[2:] for r in rows[1:8]])
+
+    def test_since_without_receipts(self):
+        expected = self._rows()
+        rows = self._rows(since=now())
+        # Forfeit of the remaining balance.
+        self.assertEqual([expected[11][0], str(self.vendors[1].pk), "-600", "0", "0"],
+                         rows[1][:1] + rows[1][2:3] + rows[1][4:])
+
+    def test_ledger_difference(self):
+        VendorLedgerEntry.objects.filter(vendor=self.vendors[1]).update(balance=Decimal("1.00"))
+        rows = self._rows()
+        index = rows.index([])
+        self.assertEqual(["", str(self.vendors[1].pk), "In Ledger", "100"], rows[index + 2])
+        self.assertEqual(["", str(self.vendors[1].pk), "In Receipts", "600"], rows[index + 3])
+
+
+class VendorLedgerTest(TestCase):
+    def setUp(self):
+        self.event = EventFactory()
+        clerk = ClerkFactory(event=self.event)
+        counter = CounterFactory(event=self.event)
+        self.vendors = [VendorFactory(event=self.event) for _ in range(2)]
+        self.start = now() - timedelta(hours=1)
+
+        self.receipts = []
+        for index in range(3):
+            receipt = ReceiptFactory(clerk=clerk, counter=counter, status=Receipt.FINISHED,
+                                     end_time=self.start + timedelta(minutes=index))
+            for vendor in self.vendors[:index + 1]:
+                ReceiptItemFactory(receipt=receipt, item=ItemFactory(vendor=vendor, state=Item.SOLD))
+            self.receipts.append(receipt)
+
+    def _entries(self):
+        return list(VendorLedgerEntry.objects
+                    .order_by("vendor_id", "end_time", "receipt_id")
+                    .values_list("vendor_id", "receipt_id", "change", "balance"))
+
+    def test_record(self):
+        for receipt in self.receipts:
+            VendorLedgerEntry.objects.record(receipt)
+        v0, v1 = (v.pk for v in self.vendors)
+        r0, r1, r2 = (r.pk for r in self.receipts)
+        self.assertEqual([
+            (v0, r0, Decimal("1.25"), Decimal("1.25")),
+            (v0, r1, Decimal("1.25"), Decimal("2.50")),
+            (v0, r2, Decimal("1.25"), Decimal("3.75")),
+            (v1, r1, Decimal("1.25"), Decimal("1.25")),
+            (v1, r2, Decimal("1.25"), Decimal("2.50")),
+        ], self._entries())
+
+        VendorLedgerEntry.objects.rebuild(self.event)
+        self.assertEqual(5, len(self._entries()))
+
+    def test_out_of_order(self):
+        for receipt in reversed(self.receipts):
+            VendorLedgerEntry.objects.record(receipt)
+        recorded = self._entries()
+        VendorLedgerEntry.objects.rebuild(self.event)
+        self.assertEqual(self._entries(), recorded)
+
+    def test_record_again(self):
+        for receipt in self.receipts:
+            VendorLedgerEntry.objects.record(receipt)
+        ReceiptItem.objects.filter(receipt=self.receipts[1], item__vendor=self.vendors[1]) \
+            .update(action=ReceiptItem.REMOVED_LATER)
+        VendorLedgerEntry.objects.record(self.receipts[1])
+
+        self.assertEqual({self.vendors[0].pk: Decimal("3.75"), self.vendors[1].pk: Decimal("1.25")},
+                         VendorLedgerEntry.objects.balances(self.event))
+
+    def test_balances(self):
+        VendorLedgerEntry.objects.rebuild(self.event)
+        with self.assertNumQueries(1):
+            balances = VendorLedgerEntry.objects.balances(self.event, until=self.start + timedelta(seconds=90))
+        self.assertEqual({self.vendors[0].pk: Decimal("2.50"), self.vendors[1].pk: Decimal("1.25")}, balances)
+        self.assertEqual({}, VendorLedgerEntry.objects.balances(self.event, until=self.start - timedelta(1)))
@@ -0,0 +1,49 @@
+import json
+import unittest
+
+from django.test import SimpleTestCase, override_settings
+
+from ..ajax_util import JsonSerializer, OrjsonSerializer, get_serializer, make_json_response, orjson
+
+
+class SerializerTest(SimpleTestCase):
+    data = [{"code": "A%d" % i, "price": i, "counts": {125: i}, "name": "ä\"x"} for i in range(7)]
+
+    def _check_stream(self, serializer: JsonSerializer):
+        serializer.chunk_size = 3
+        chunks = list(serializer.iter_list(self.data))
+        self.assertEqual(4, len(chunks))
+        self.assertEqual(json.loads(json.dumps(self.data)), json.loads(b"".join(chunks)))
+        self.assertEqual([], json.loads(b"".join(serializer.iter_list([]))))
+
+    def test_stdlib_stream(self):
+        self._check_stream(JsonSerializer())
+
+    @unittest.skipIf(orjson is None, "orjson not installed")
+    def test_orjson_stream(self):
+        self._check_stream(OrjsonSerializer())
+
+    @unittest.skipIf(orjson is None, "orjson not installed")
+    def test_orjson_fallback(self):
+        value = {"big": 2 ** 70}
+        self.assertEqual(value, json.loads(OrjsonSerializer().dumps(value)))
+
+    @override_settings(KIRPPU_AJAX_STREAM_THRESHOLD=5)
+    def test_response_streaming(self):
+        response = make_json_response(self.data)
+        self.assertTrue(response.streaming)
+        self.assertEqual(len(self.data), len(json.loads(b"".join(response.streaming_content))))
+
+        response = make_json_response(self.data[:5])
+        self.assertFalse(response.streaming)
+        self.assertEqual(5, len(json.loads(response.content)))
+
+    def test_serializer_setting(self):
+        with override_settings(KIRPPU_AJAX_SERIALIZER="kirppu.ajax_util.JsonSerializer"):
+            self.assertIs(JsonSerializer, type(get_serializer()))
+        with override_settings(KIRPPU_AJAX_SERIALIZER="kirppu.tests.test_ajax_util.DummySerializer"):
+            self.assertIs(DummySerializer, type(get_serializer()))
+
+
+class DummySerializer(JsonSerializer):
+    pass
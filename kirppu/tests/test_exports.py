@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from decimal import Decimal
+from unittest import mock
+from xml.etree import ElementTree
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import Client, TestCase, override_settings
+from django.utils.timezone import now
+
+from .. import exports
+from ..models import Item, Receipt
+from ..views import accounting
+from .factories import (
+    ClerkFactory,
+    CounterFactory,
+    EventFactory,
+    EventPermissionFactory,
+    ItemFactory,
+    ReceiptFactory,
+    ReceiptItemFactory,
+    UserFactory,
+    VendorFactory,
+)
+
+SHEET = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = override_settings(KIRPPU_EXPORT_DIR=self.directory, KIRPPU_EXPORT_WORKERS=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.event = EventFactory()
+        vendor = VendorFactory(event=self.event)
+        self.sold = ItemFactory(vendor=vendor, state=Item.SOLD, price=Decimal("2.50"), name="Sold <&>")
+        self.brought = ItemFactory(vendor=vendor, state=Item.BROUGHT, price=Decimal("1.25"), name="Brought")
+        receipt = ReceiptFactory(clerk=ClerkFactory(event=self.event), counter=CounterFactory(event=self.event),
+                                 status=Receipt.FINISHED, end_time=now())
+        ReceiptItemFactory(receipt=receipt, item=self.sold)
+        self.vendor = vendor
+
+    def _write(self, table, fmt) -> bytes:
+        output = io.BytesIO()
+        exports.FORMATS[fmt].writer(exports.TABLES[table](self.event), output)
+        return output.getvalue()
+
+    def test_items_table(self):
+        table = exports.items_table(self.event)
+        self.assertEqual([int, str, Decimal, bool, bool, bool, str], [c.type for c in table.columns])
+        self.assertEqual([
+            [self.vendor.id, self.brought.code, Decimal("1.25"), True, False, False, "Brought"],
+            [self.vendor.id, self.sold.code, Decimal("2.50"), True, True, False, "Sold <&>"],
+        ], list(table.rows))
+
+    def test_accounting_table(self):
+        output = io.StringIO()
+        accounting.accounting_receipt(output, self.event)
+        expected = list(csv.reader(io.StringIO(output.getvalue())))[1:]
+        expected = expected[:expected.index([])]
+
+        table = exports.accounting_table(self.event)
+        rows = [["" if v is None else str(v) for v in row] for row in table.rows]
+        # Forfeit rows have the time of the export.
+        self.assertEqual([r[:1] + r[2:] for r in expected], [r[:1] + r[2:] for r in rows])
+        self.assertEqual(2, len(rows))
+
+    def test_xlsx(self):
+        with zipfile.ZipFile(io.BytesIO(self._write("items", "xlsx"))) as archive:
+            self.assertIn("xl/workbook.xml", archive.namelist())
+            sheet = ElementTree.fromstring(archive.read("xl/worksheets/sheet1.xml"))
+
+        rows = sheet.findall("{0}sheetData/{0}row".format(SHEET))
+        self.assertEqual(3, len(rows))
+        cells = rows[2].findall(SHEET + "c")
+        self.assertIsNone(cells[2].get("t"))
+        self.assertEqual("2.50", cells[2].find(SHEET + "v").text)
+        self.assertEqual(("b", "1"), (cells[4].get("t"), cells[4].find(SHEET + "v").text))
+        self.assertEqual("Sold <&>", cells[6].find("{0}is/{0}t".format(SHEET)).text)
+
+    def test_json(self):
+        result = json.loads(self._write("items", "json"), parse_float=Decimal)
+        self.assertEqual({"name": "Price", "type": "decimal"}, result["columns"][2])
+        self.assertEqual([Decimal("1.25"), Decimal("2.50")], result["data"][2])
+        self.assertEqual([True, True], result["data"][3])
+        self.assertEqual(["Brought", "Sold <&>"], result["data"][6])
+
+    def test_json_empty(self):
+        Item.objects.all().delete()
+        result = json.loads(self._write("items", "json"))
+        self.assertEqual([[]] * 7, result["data"])
+
+    def test_csv(self):
+        rows = list(csv.reader(io.StringIO(self._write("items", "csv").decode("utf-8"))))
+        self.assertEqual(["Vendor id", "Barcode", "Price"], rows[0][:3])
+        self.assertEqual(3, len(rows))
+
+    def test_view(self):
+        user = UserFactory()
+        EventPermissionFactory(event=self.event, user=user, can_see_accounting=True)
+        self.client.force_login(user)
+
+        response = self.client.post("/kirppu/%s/export/" % self.event.slug, {"table": "items", "format": "xlsx"})
+        self.assertEqual(302, response.status_code)
+        response = self.client.get(response["Location"])
+        self.assertEqual(200, response.status_code)
+        self.assertIn("attachment", response["Content-Disposition"])
+        self.assertIn("items.xlsx", response["Content-Disposition"])
+        content = b"".join(response.streaming_content)
+        response.close()
+        self.assertTrue(zipfile.is_zipfile(io.BytesIO(content)))
+
+    def test_view_running(self):
+        user = UserFactory()
+        EventPermissionFactory(event=self.event, user=user, can_see_accounting=True)
+        self.client.force_login(user)
+
+        path = os.path.join(self.directory, "%d-items-abc.csv.part" % self.event.pk)
+        open(path, "wb").close()
+        response = self.client.get("/kirppu/%s/export/abc" % self.event.slug)
+        self.assertEqual(202, response.status_code)
+        self.assertEqual("2", response["Refresh"])
+
+        self.assertEqual(404, self.client.get("/kirppu/%s/export/other" % self.event.slug).status_code)
+
+    def test_view_errors(self):
+        user = UserFactory()
+        self.client.force_login(user)
+        url = "/kirppu/%s/export/" % self.event.slug
+        self.assertEqual(403, self.client.post(url, {"table": "items", "format": "csv"}).status_code)
+
+        EventPermissionFactory(event=self.event, user=user, can_see_accounting=True)
+        self.assertEqual(400, self.client.post(url, {"table": "items", "format": "doc"}).status_code)
+        self.assertEqual(400, self.client.post(url, {"table": "other", "format": "csv"}).status_code)
+        self.assertEqual(405, self.client.get(url, {"table": "items", "format": "csv"}).status_code)
+
+        csrf_client = Client(enforce_csrf_checks=True)
+        csrf_client.force_login(user)
+        self.assertEqual(403, csrf_client.post(url, {"table": "items", "format": "csv"}).status_code)
+        self.assertEqual([], os.listdir(self.directory))
+
+    @override_settings(KIRPPU_EXPORT_MAX_AGE=60, KIRPPU_EXPORT_PART_MAX_AGE=3600)
+    def test_remove_old_exports(self):
+        old = time.time() - 120
+        for name in ("1-items-old.csv", "1-items-old.csv.error", "1-items-running.csv.part"):
+            path = os.path.join(self.directory, name)
+            open(path, "wb").close()
+            os.utime(path, (old, old))
+        exports._remove_old_exports(self.directory)
+        self.assertEqual(["1-items-running.csv.part"], os.listdir(self.directory))
+
+        old = time.time() - 7200
+        os.utime(os.path.join(self.directory, "1-items-running.csv.part"), (old, old))
+        exports._remove_old_exports(self.directory)
+        self.assertEqual([], os.listdir(self.directory))
+
+    @override_settings(KIRPPU_EXPORT_DIR=None)
+    def test_default_directory(self):
+        with mock.patch.object(exports.tempfile, "gettempdir", return_value=self.directory):
+            path = exports._export_dir()
+            self.assertEqual(0o700, os.stat(path).st_mode & 0o777)
+            self.assertEqual(path, exports._export_dir())
+
+            os.chmod(path, 0o755)
+            with self.assertRaises(ImproperlyConfigured):
+                exports._export_dir()
@@ -1,7 +1,21 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+from decimal import Decimal
+
+from django.test import TestCase, override_settings
 
 from ..models import Item
-from .factories import EventFactory, EventPermissionFactory, ItemFactory, ItemTypeFactory, UserFactory, VendorFactory
+from ..views.item_dump import item_dump
+from .factories import (
+    BoxFactory,
+    EventFactory,
+    EventPermissionFactory,
+    ItemFactory,
+    ItemTypeFactory,
+    UserFactory,
+    VendorFactory,
+)
 
 
 class ItemDumpTest(TestCase):
@@ -65,3 +79,51 @@ class ItemDumpTest(TestCase):
         content = resp.getvalue()
         # CSV: 5 items + header
         self.assertEqual(5 + 1, content.count(b"\n"))
+
+    @override_settings(KIRPPU_CSV_FLUSH_ROWS=2)
+    def test_chunks(self):
+        self._addPermission()
+        self._addItems(count=5)
+        resp = self._get()
+
+        # Header at once, then two chunks of two items and the rest.
+        chunks = list(resp.streaming_content)
+        self.assertEqual([1, 2, 2, 1], [c.count(b"\n") for c in chunks])
+
+    def test_gzip(self):
+        self._addPermission()
+        self._addItems(count=5)
+        plain = self._get().getvalue()
+        resp = self.client.get("/kirppu/%s/itemdump/" % self.event.slug, HTTP_ACCEPT_ENCODING="gzip, deflate")
+
+        self.assertEqual("gzip", resp["Content-Encoding"])
+        self.assertIn("Accept-Encoding", resp["Vary"])
+        self.assertEqual(plain, gzip.decompress(resp.getvalue()))
+
+        resp = self.client.get("/kirppu/%s/itemdump/" % self.event.slug, HTTP_ACCEPT_ENCODING="gzip;q=0")
+        self.assertFalse(resp.has_header("Content-Encoding"))
+        self.assertEqual(plain, resp.getvalue())
+
+    def test_values(self):
+        self._addPermission()
+        vendor = VendorFactory(user=self.user, event=self.event)
+        item = ItemFactory(vendor=vendor, state=Item.SOLD, price=Decimal("2.50"), name="B")
+        box_item = ItemFactory(vendor=vendor, state=Item.ADVERTISED, name="A")
+        BoxFactory(adopt=True, items=[box_item], description="Boxed")
+
+        with self.assertNumQueries(1):
+            rows = list(csv.reader(io.StringIO(self._dump(as_text=False))))
+        self.assertEqual([
+            [str(vendor.id), box_item.code, "1.25", "", "", "", "Boxed"],
+            [str(vendor.id), item.code, "2.50", "X", "X", "", "B"],
+        ], rows[1:])
+
+        with self.assertNumQueries(2):
+            text = self._dump(as_text=True)
+        self.assertIn("  2.50  \u2612  \u2612  \u2610  B\n", text)
+
+    def _dump(self, as_text):
+        output = io.StringIO()
+        for _ in item_dump(output, self.event, as_text):
+            pass
+        return output.getvalue()
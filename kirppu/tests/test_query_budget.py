@@ -0,0 +1,589 @@
+# -*- coding: utf-8 -*-
+"""
+Query-count budgets for checkout API functions.
+
+Every function registered in `AJAX_SCOPES` must have a scenario and an upper bound for the number of
+SQL queries it may run here. The scenarios are run against an Event seeded with background data.
+Size of the data is controlled with environment variable `KIRPPU_BUDGET_SCALE`, where 1 equals
+50000 items, 3000 vendors and 500 boxes. Default scale is small to keep the regular test run fast:
+
+    KIRPPU_BUDGET_SCALE=1 KIRPPU_BUDGET_RESULTS=budget.json py.test kirppu/tests/test_query_budget.py
+
+If `KIRPPU_BUDGET_RESULTS` is set, query counts and wall-clock times of the measured calls are written
+to that JSON file, along with optional `KIRPPU_BUDGET_LABEL` (e.g. commit id) for comparisons.
+"""
+import datetime
+import json
+import os
+import random
+import time
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+
+from kirppuauth.models import User
+from ..ajax_util import AJAX_SCOPES, clear_auth_cache, invalidate_event_cache
+from ..models import (
+    Box,
+    Item,
+    ItemStateLog,
+    ItemStateLogRollup,
+    Receipt,
+    ReceiptItem,
+    Vendor,
+    VendorNote,
+)
+from ..util import b32_encode, pack
+from . import ResultMixin
+from .api_access import Api
+from .factories import (
+    AccountFactory,
+    BoxFactory,
+    ClerkFactory,
+    CounterFactory,
+    EventFactory,
+    EventPermissionFactory,
+    ItemFactory,
+    ItemTypeFactory,
+    ReceiptFactory,
+    VendorFactory,
+)
+
+SCALE = float(os.environ.get("KIRPPU_BUDGET_SCALE", "0.01"))
+RESULTS_FILE = os.environ.get("KIRPPU_BUDGET_RESULTS")
+
+FULL_ITEMS = 50000
+FULL_VENDORS = 3000
+FULL_BOXES = 500
+BOX_SIZE = 10
+ITEMS_PER_RECEIPT = 5
+
+# Function name -> (scenario, query budget, expected status).
+BUDGETS = {}
+
+
+def budget(queries: int, status: int = 200):
+    """
+    Register a scenario for the AJAX function with the same name.
+    The scenario prepares needed state, and returns a callable doing the measured request.
+    """
+    def decorator(fn):
+        BUDGETS[fn.__name__] = (fn, queries, status)
+        return fn
+    return decorator
+
+
+class Seeder(object):
+    """Bulk-create background data for an Event using the factories."""
+
+    def __init__(self, event, item_types, scale):
+        self.event = event
+        self.item_types = item_types
+        self.item_count = max(int(FULL_ITEMS * scale), 100)
+        self.vendor_count = max(int(FULL_VENDORS * scale), 10)
+        self.box_count = max(int(FULL_BOXES * scale), 2)
+        self._code_seq = 0
+        self._random = random.Random(1)
+
+    def code(self):
+        self._code_seq += 1
+        return b32_encode(pack([(36, 0x800000000 + self._code_seq)], checksum_bits=4))
+
+    def seed(self):
+        # Built directly: UserFactory hashes a password for each user.
+        users = User.objects.bulk_create(
+            User(username="bg_vendor_%d" % i, first_name="Vendor", last_name=str(i), password="!")
+            for i in range(self.vendor_count)
+        )
+        vendors = Vendor.objects.bulk_create(
+            VendorFactory.build(user=user, event=self.event, terms_accepted=now())
+            for user in users
+        )
+
+        states = (
+            [Item.ADVERTISED] * 3 + [Item.BROUGHT] * 3 + [Item.SOLD] * 2 + [Item.COMPENSATED, Item.RETURNED]
+        )
+        single_count = self.item_count - self.box_count * BOX_SIZE
+        items = Item.objects.bulk_create(
+            ItemFactory.build(
+                vendor=self._random.choice(vendors),
+                itemtype=self._random.choice(self.item_types),
+                code=self.code(),
+                state=self._random.choice(states),
+                price=Decimal(self._random.randint(100, 2000)) / 100,
+            )
+            for _ in range(single_count)
+        )
+
+        for box_number in range(self.box_count):
+            vendor = self._random.choice(vendors)
+            state = self._random.choice(states)
+            box_items = Item.objects.bulk_create(
+                ItemFactory.build(
+                    vendor=vendor,
+                    itemtype=self.item_types[0],
+                    code=self.code() if i == 0 else None,
+                    state=state,
+                )
+                for i in range(BOX_SIZE)
+            )
+            box = Box.objects.create(
+                description="Background box %d" % box_number,
+                representative_item=box_items[0],
+                box_number=1000 + box_number,
+            )
+            Item.objects.filter(pk__in=[i.pk for i in box_items]).update(box=box)
+            items.extend(box_items)
+
+        self._seed_logs(items)
+        self._seed_receipts(items)
+
+    def _seed_logs(self, items):
+        ItemStateLog.objects.bulk_create(
+            ItemStateLog(item=item, old_state="", new_state=Item.ADVERTISED) for item in items
+        )
+        ItemStateLog.objects.bulk_create(
+            ItemStateLog(item=item, old_state=Item.ADVERTISED, new_state=Item.BROUGHT)
+            for item in items if item.state != Item.ADVERTISED
+        )
+        ItemStateLog.objects.bulk_create(
+            ItemStateLog(item=item, old_state=Item.BROUGHT, new_state=Item.SOLD)
+            for item in items if item.state in (Item.SOLD, Item.COMPENSATED)
+        )
+        # Spread the log times over two sale days.
+        ids = list(ItemStateLog.objects.filter(item__vendor__event=self.event).values_list("pk", flat=True))
+        start = now() - datetime.timedelta(days=2)
+        chunk = max(len(ids) // 200, 1)
+        for index in range(0, len(ids), chunk):
+            ItemStateLog.objects.filter(pk__in=ids[index:index + chunk]).update(
+                time=start + datetime.timedelta(minutes=index // chunk * 15))
+        ItemStateLogRollup.objects.rebuild(self.event)
+
+    def _seed_receipts(self, items):
+        sold = [item for item in items if item.state in (Item.SOLD, Item.COMPENSATED)]
+        counter = CounterFactory(event=self.event, private_key=None,
+                                 default_store_location=AccountFactory(event=self.event))
+        clerk = ClerkFactory(event=self.event)
+        receipt_items = []
+        for index in range(0, len(sold), ITEMS_PER_RECEIPT):
+            content = sold[index:index + ITEMS_PER_RECEIPT]
+            receipt = ReceiptFactory(
+                clerk=clerk,
+                counter=counter,
+                status=Receipt.FINISHED,
+                end_time=now(),
+                total=sum(item.price for item in content),
+            )
+            receipt_items.extend(ReceiptItem(item=item, receipt=receipt) for item in content)
+        ReceiptItem.objects.bulk_create(receipt_items)
+
+
+@override_settings(KIRPPU_COUNTER_LIST=True)
+class QueryBudgetTest(TestCase, ResultMixin):
+    results = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.event = EventFactory()
+        cls.item_types = [ItemTypeFactory(event=cls.event) for _ in range(5)]
+        Seeder(cls.event, cls.item_types, SCALE).seed()
+
+        cls.account = AccountFactory(event=cls.event, balance=Decimal(100000))
+        cls.other_account = AccountFactory(event=cls.event)
+        cls.counter = CounterFactory(event=cls.event, default_store_location=cls.account)
+        cls.clerk = ClerkFactory(event=cls.event)
+        EventPermissionFactory(event=cls.event, user=cls.clerk.user, can_perform_overseer_actions=True,
+                               can_see_accounting=True, can_see_statistics=True)
+
+        cls.vendor = VendorFactory(event=cls.event)
+        itemtype = cls.item_types[0]
+
+        def items(state, count=20):
+            return ItemFactory.create_batch(count, vendor=cls.vendor, itemtype=itemtype, state=state)
+
+        cls.advertised = items(Item.ADVERTISED)
+        cls.brought = items(Item.BROUGHT)
+        cls.sold = items(Item.SOLD)
+
+        cls.box_brought = _make_box(cls.vendor, itemtype, Item.BROUGHT, 1)
+        cls.box_advertised = _make_box(cls.vendor, itemtype, Item.ADVERTISED, 2)
+        cls.box_sold = _make_box(cls.vendor, itemtype, Item.SOLD, 3)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if RESULTS_FILE:
+            with open(RESULTS_FILE, "w") as f:
+                json.dump({
+                    "label": os.environ.get("KIRPPU_BUDGET_LABEL", ""),
+                    "time": now().isoformat(),
+                    "scale": SCALE,
+                    "results": dict(sorted(cls.results.items())),
+                }, f, indent=2)
+
+    def setUp(self):
+        self.api = Api(client=self.client, event=self.event)
+        self.assertSuccess(self.api.clerk_login(code=self.clerk.get_code(), counter=self.counter.private_key))
+
+    def _check_budget(self, name):
+        scenario, queries, status = BUDGETS[name]
+        call = scenario(self)
+
+        # Measure with cold caches, so that the result does not depend on test order.
+        clear_auth_cache()
+        invalidate_event_cache()
+        cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = call()
+            if response.streaming:
+                content = b"".join(response.streaming_content)
+            else:
+                content = response.content
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual(status, response.status_code, "Expected {}, got {} / {}".format(
+            status, response.status_code, content.decode("utf-8")))
+        self.results[name] = {
+            "queries": len(captured),
+            "budget": queries,
+            "seconds": round(elapsed, 6),
+        }
+        self.assertLessEqual(len(captured), queries, "Query budget exceeded for {}:\n{}".format(
+            name, "\n".join(q["sql"] for q in captured.captured_queries)))
+
+    def test_all_functions_have_budget(self):
+        registered = {name for scope in AJAX_SCOPES.values() for name in scope}
+        self.assertEqual(set(), registered - set(BUDGETS), "Functions without query budget")
+
+    # Scenario helpers.
+
+    def start_receipt(self):
+        return self.assertSuccess(self.api.receipt_start()).json()
+
+    def reserve(self, *items):
+        for item in items:
+            self.assertSuccess(self.api.item_reserve(code=item.code))
+
+    def suspended_receipt(self):
+        receipt = self.start_receipt()
+        self.reserve(self.brought[0])
+        self.assertSuccess(self.api.receipt_suspend(note="Wait"))
+        return receipt
+
+    def start_compensation(self):
+        return self.assertSuccess(self.api.item_compensate_start(vendor=self.vendor.pk)).json()
+
+
+def _make_box(vendor, itemtype, state, box_number):
+    box_items = ItemFactory.create_batch(BOX_SIZE, vendor=vendor, itemtype=itemtype, state=state)
+    return BoxFactory(adopt=True, items=box_items, box_number=box_number)
+
+
+# region Scenarios
+
+@budget(9)
+def box_find(t: QueryBudgetTest):
+    return lambda: t.api.box_find(box_number=t.box_brought.box_number, box_item_count=2)
+
+
+@budget(20)
+def box_checkin(t: QueryBudgetTest):
+    rep = t.box_advertised.representative_item
+    return lambda: t.api.box_checkin(code=rep.code, box_info=t.box_advertised.box_number)
+
+
+@budget(20)
+def box_item_reserve(t: QueryBudgetTest):
+    t.start_receipt()
+    return lambda: t.api.box_item_reserve(box_number=t.box_brought.box_number, box_item_count=3)
+
+
+@budget(33)
+def box_item_release(t: QueryBudgetTest):
+    t.start_receipt()
+    t.assertSuccess(t.api.box_item_reserve(box_number=t.box_brought.box_number, box_item_count=3))
+    return lambda: t.api.box_item_release(box_number=t.box_brought.box_number, box_item_count=2)
+
+
+@budget(9)
+def vendor_note_add(t: QueryBudgetTest):
+    return lambda: t.api.vendor_note_add(vendor_id=t.vendor.pk, note="Note")
+
+
+@budget(12)
+def vendor_notes(t: QueryBudgetTest):
+    for _ in range(3):
+        VendorNote.objects.create(vendor=t.vendor, clerk=t.clerk, text="Note")
+    return lambda: t.api.vendor_notes(vendor_id=t.vendor.pk)
+
+
+@budget(8)
+def vendor_note_complete(t: QueryBudgetTest):
+    note = VendorNote.objects.create(vendor=t.vendor, clerk=t.clerk, text="Note")
+    return lambda: t.api.vendor_note_complete(vendor_id=t.vendor.pk, note_id=note.pk)
+
+
+@budget(16)
+def receipt_suspend(t: QueryBudgetTest):
+    t.start_receipt()
+    t.reserve(t.brought[0])
+    return lambda: t.api.receipt_suspend(note="Wait")
+
+
+@budget(17)
+def receipt_continue(t: QueryBudgetTest):
+    t.suspended_receipt()
+    return lambda: t.api.receipt_continue(code=t.brought[0].code)
+
+
+@budget(17)
+def receipt_overseer_continue(t: QueryBudgetTest):
+    receipt = t.suspended_receipt()
+    return lambda: t.api.receipt_overseer_continue(receipt_id=receipt["id"])
+
+
+@budget(7)
+def list_accounts(t: QueryBudgetTest):
+    return lambda: t.api.list_accounts()
+
+
+@budget(8)
+def list_transfers(t: QueryBudgetTest):
+    for _ in range(3):
+        t.assertSuccess(t.api.transfer_money(src_id=t.account.pk, dst_id=t.other_account.pk, amount="1",
+                                             note="Transfer", auth=t.clerk.access_code, commit="1"))
+    return lambda: t.api.list_transfers()
+
+
+@budget(19)
+def transfer_money(t: QueryBudgetTest):
+    return lambda: t.api.transfer_money(src_id=t.account.pk, dst_id=t.other_account.pk, amount="1",
+                                        note="Transfer", auth=t.clerk.access_code, commit="1")
+
+
+@budget(10)
+def clerk_login(t: QueryBudgetTest):
+    return lambda: t.api.clerk_login(code=t.clerk.get_code(), counter=t.counter.private_key)
+
+
+@budget(5)
+def clerk_logout(t: QueryBudgetTest):
+    return lambda: t.api.clerk_logout()
+
+
+@budget(6)
+def counter_validate(t: QueryBudgetTest):
+    return lambda: t.api.counter_validate(key=t.counter.private_key)
+
+
+@budget(4)
+def counter_list(t: QueryBudgetTest):
+    return lambda: t.api.counter_list(code=t.clerk.get_code())
+
+
+@budget(6)
+def item_find(t: QueryBudgetTest):
+    return lambda: t.api.item_find(code=t.brought[0].code, available=1)
+
+
+@budget(9)
+def item_search(t: QueryBudgetTest):
+    return lambda: t.api.item_search(query="", code="", box_number="", vendor=t.vendor.pk, min_price="",
+                                     max_price="", item_type="", item_state="", is_box="", show_hidden="")
+
+
+@budget(16)
+def item_edit(t: QueryBudgetTest):
+    return lambda: t.api.item_edit(code=t.brought[0].code, price="2.50", state=Item.BROUGHT)
+
+
+@budget(5)
+def item_list(t: QueryBudgetTest):
+    return lambda: t.api.item_list(vendor=t.vendor.pk)
+
+
+@budget(6)
+def vendor_returnable_items(t: QueryBudgetTest):
+    return lambda: t.api.vendor_returnable_items(vendor=t.vendor.pk)
+
+
+@budget(7)
+def compensable_items(t: QueryBudgetTest):
+    return lambda: t.api.compensable_items(vendor=t.vendor.pk)
+
+
+@budget(6)
+def box_list(t: QueryBudgetTest):
+    return lambda: t.api.box_list(vendor=t.vendor.pk)
+
+
+@budget(16)
+def item_checkin(t: QueryBudgetTest):
+    item = t.advertised[0]
+    return lambda: t.api.item_checkin(code=item.code, vendor=item.vendor_id)
+
+
+@budget(13)
+def item_checkin_many(t: QueryBudgetTest):
+    codes = [item.code for item in t.advertised[:10]]
+    return lambda: t.api.item_checkin_many(codes=json.dumps(codes), vendor=t.vendor.pk)
+
+
+@budget(15)
+def item_checkout(t: QueryBudgetTest):
+    item = t.brought[0]
+    return lambda: t.api.item_checkout(code=item.code, vendor=item.vendor_id)
+
+
+@budget(10)
+def item_compensate_start(t: QueryBudgetTest):
+    return lambda: t.api.item_compensate_start(vendor=t.vendor.pk)
+
+
+@budget(18)
+def item_compensate(t: QueryBudgetTest):
+    t.start_compensation()
+    return lambda: t.api.item_compensate(code=t.sold[0].code)
+
+
+@budget(20)
+def box_item_compensate(t: QueryBudgetTest):
+    t.start_compensation()
+    item = Item.objects.filter(box=t.box_sold).exclude(pk=t.box_sold.representative_item_id).first()
+    return lambda: t.api.box_item_compensate(pk=item.pk, box_code=t.box_sold.representative_item.code)
+
+
+@budget(26)
+def item_compensate_end(t: QueryBudgetTest):
+    t.start_compensation()
+    for item in t.sold[:5]:
+        t.assertSuccess(t.api.item_compensate(code=item.code))
+    return lambda: t.api.item_compensate_end()
+
+
+@budget(6)
+def vendor_get(t: QueryBudgetTest):
+    return lambda: t.api.vendor_get(id=t.vendor.pk)
+
+
+@budget(5)
+def vendor_find(t: QueryBudgetTest):
+    return lambda: t.api.vendor_find(q=t.vendor.user.last_name)
+
+
+@budget(11)
+def vendor_token_create(t: QueryBudgetTest):
+    return lambda: t.api.vendor_token_create(vendor_id=t.vendor.pk)
+
+
+@budget(12)
+def receipt_start(t: QueryBudgetTest):
+    return lambda: t.api.receipt_start()
+
+
+@budget(16)
+def item_reserve(t: QueryBudgetTest):
+    t.start_receipt()
+    return lambda: t.api.item_reserve(code=t.brought[0].code)
+
+
+@budget(15)
+def item_reserve_many(t: QueryBudgetTest):
+    t.start_receipt()
+    codes = [item.code for item in t.brought[:10]]
+    return lambda: t.api.item_reserve_many(codes=json.dumps(codes))
+
+
+@budget(20)
+def item_release(t: QueryBudgetTest):
+    t.start_receipt()
+    t.reserve(t.brought[0])
+    return lambda: t.api.item_release(code=t.brought[0].code)
+
+
+@budget(29)
+def receipt_finish(t: QueryBudgetTest):
+    receipt = t.start_receipt()
+    t.reserve(*t.brought[:5])
+    return lambda: t.api.receipt_finish(id=receipt["id"])
+
+
+@budget(54)
+def receipt_abort(t: QueryBudgetTest):
+    receipt = t.start_receipt()
+    t.reserve(*t.brought[:5])
+    return lambda: t.api.receipt_abort(id=receipt["id"])
+
+
+@budget(11)
+def receipt_get(t: QueryBudgetTest):
+    receipt = t.start_receipt()
+    t.reserve(*t.brought[:5])
+    return lambda: t.api.receipt_get(id=receipt["id"])
+
+
+@budget(14)
+def receipt_activate(t: QueryBudgetTest):
+    receipt = t.start_receipt()
+    t.reserve(*t.brought[:5])
+    return lambda: t.api.receipt_activate(id=receipt["id"])
+
+
+@budget(8)
+def receipt_pending(t: QueryBudgetTest):
+    t.suspended_receipt()
+    return lambda: t.api.receipt_pending()
+
+
+@budget(6)
+def receipt_compensated(t: QueryBudgetTest):
+    t.start_compensation()
+    return lambda: t.api.receipt_compensated(vendor=t.vendor.pk)
+
+
+@budget(2)
+def get_barcodes(t: QueryBudgetTest):
+    return lambda: t.api.get_barcodes(codes=json.dumps([item.code for item in t.brought[:5]]))
+
+
+@budget(7)
+def items_abandon(t: QueryBudgetTest):
+    return lambda: t.api.items_abandon(vendor=t.vendor.pk)
+
+
+@budget(11)
+def item_mark_lost(t: QueryBudgetTest):
+    return lambda: t.api.item_mark_lost(code=t.brought[0].code)
+
+
+@budget(5)
+def stats_sales_data(t: QueryBudgetTest):
+    return lambda: t.api.stats_sales_data(prices="true")
+
+
+@budget(5)
+def stats_registration_data(t: QueryBudgetTest):
+    return lambda: t.api.stats_registration_data()
+
+
+@budget(6)
+def stats_group_sales_data(t: QueryBudgetTest):
+    return lambda: t.api.stats_group_sales_data(type_id=t.item_types[0].pk)
+
+# endregion
+
+
+def _make_test(name):
+    def test(self):
+        self._check_budget(name)
+    test.__name__ = "test_" + name
+    return test
+
+
+for _name in BUDGETS:
+    setattr(QueryBudgetTest, "test_" + _name, _make_test(_name))
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from ..models import Account, Receipt, ReceiptNote
+from . import ResultMixin
+from .api_access import Api
+from .factories import (
+    ClerkFactory,
+    CounterFactory,
+    EventFactory,
+    EventPermissionFactory,
+    ReceiptFactory,
+    VendorFactory,
+)
+
+
+class ReceiptListingQueryTest(TestCase, ResultMixin):
+    """Listing endpoints must not make queries per listed receipt."""
+
+    def setUp(self):
+        self.event = EventFactory()
+        self.vendor = VendorFactory(event=self.event)
+        self.counter = CounterFactory(event=self.event)
+        self.clerk = ClerkFactory(event=self.event)
+        EventPermissionFactory(event=self.event, user=self.clerk.user, can_perform_overseer_actions=True)
+        self.account = Account.objects.create(event=self.event, name="Other")
+
+        self.api = Api(client=self.client, event=self.event)
+        self.assertSuccess(self.api.clerk_login(code=self.clerk.get_code(), counter=self.counter.private_key))
+
+    def _add_receipts(self, count):
+        for _ in range(count):
+            clerk = ClerkFactory(event=self.event)
+            kwargs = dict(clerk=clerk, counter=self.counter)
+            receipts = [
+                ReceiptFactory(status=Receipt.SUSPENDED, **kwargs),
+                ReceiptFactory(type=Receipt.TYPE_COMPENSATION, vendor=self.vendor, **kwargs),
+                ReceiptFactory(type=Receipt.TYPE_TRANSFER, status=Receipt.FINISHED,
+                               src_account=self.counter.default_store_location, dst_account=self.account,
+                               **kwargs),
+            ]
+            for receipt in receipts:
+                ReceiptNote.objects.create(receipt=receipt, clerk=clerk, text="Note")
+
+    def _count_queries(self, fn, expected_len):
+        with CaptureQueriesContext(connection) as queries:
+            result = self.assertSuccess(fn()).json()
+        self.assertEqual(expected_len, len(result))
+        return len(queries)
+
+    def _check(self, fn):
+        self._add_receipts(1)
+        single = self._count_queries(fn, 1)
+        self._add_receipts(4)
+        multiple = self._count_queries(fn, 5)
+        self.assertEqual(single, multiple)
+
+    def test_receipt_pending(self):
+        self._check(lambda: self.api.receipt_pending())
+
+    def test_receipt_compensated(self):
+        self._check(lambda: self.api.receipt_compensated(vendor=self.vendor.pk))
+
+    def test_list_transfers(self):
+        self._check(lambda: self.api.list_transfers())
@@ -1,8 +1,11 @@
+from decimal import Decimal
+
 from django.test import TestCase
+from django.utils.timezone import now
 
 from . import ResultMixin
 
-from ..models import ReceiptItem, Item, Receipt
+from ..models import ReceiptItem, Item, Receipt, VendorLedgerEntry
 from .factories import BoxFactory, ReceiptItemFactory, ItemFactory, UserFactory
 
 
@@ -63,3 +66,12 @@ class ReceiptRemovalTests(TestCase, ResultMixin):
         self.assertTrue(Item.BROUGHT in result_states)
         self.assertTrue(Item.SOLD in result_states)
         self.assertEqual(125, self.receipt.total_cents)
+
+    def test_ledger(self):
+        self.receipt.end_time = now()
+        self.receipt.save(update_fields=["end_time"])
+        VendorLedgerEntry.objects.record(self.receipt)
+        self.assertEqual({self.item.vendor_id: Decimal("2.50")}, VendorLedgerEntry.objects.balances(self.event))
+
+        self._perform(self.item.code)
+        self.assertEqual({self.item.vendor_id: Decimal("1.25")}, VendorLedgerEntry.objects.balances(self.event))
@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 
+import json
 from http import HTTPStatus
+from unittest import mock
 
 import faker
+from django.db.models.sql.compiler import SQLCompiler, SQLUpdateCompiler
 from django.test import TestCase
 
-from ..models import Clerk, Item, Receipt, ReceiptItem
+from ..models import Clerk, EventPermission, Item, Receipt, ReceiptItem, Vendor
 from . import ResultMixin
 from .api_access import Api
 from .factories import *
@@ -225,3 +228,103 @@ class StatesTest(TestCase, ResultMixin):
 
         self.assertEqual(sus_receipt["id"], res_receipt["id"])
 
+    def test_incremental_total(self):
+        box = BoxFactory(adopt=True, items=self.items[5:], box_number=1)
+        Item.objects.all().update(state=Item.BROUGHT)
+        receipt = self.assertSuccess(self.api.receipt_start()).json()
+
+        def check_total(ret):
+            db_receipt = Receipt.objects.get(pk=receipt["id"])
+            self.assertEqual(ret.json()["total"], db_receipt.total_cents)
+            incremental = db_receipt.total
+            self.assertEqual(db_receipt.calculate_total(), incremental)
+
+        check_total(self.assertSuccess(self.api.item_reserve(code=self.items[0].code)))
+        check_total(self.assertSuccess(self.api.item_reserve(code=self.items[1].code)))
+        check_total(self.assertSuccess(self.api.box_item_reserve(box_number=box.box_number, box_item_count=3)))
+        check_total(self.assertSuccess(self.api.box_item_release(box_number=box.box_number, box_item_count=2)))
+
+        self.assertSuccess(self.api.item_release(code=self.items[0].code))
+        db_receipt = Receipt.objects.get(pk=receipt["id"])
+        self.assertEqual(db_receipt.calculate_total(), db_receipt.total)
+        self.assertEqual(2 * 125, db_receipt.total_cents)
+
+    def test_reserve_many(self):
+        Item.objects.all().update(state=Item.BROUGHT)
+        receipt = self.assertSuccess(self.api.receipt_start()).json()
+        codes = [self.items[0].code, self.items[1].code, "NOTFOUND", self.items[0].code]
+
+        ret = self.assertSuccess(self.api.item_reserve_many(codes=json.dumps(codes))).json()
+
+        self.assertEqual([200, 200, 404, 409], [r["status"] for r in ret["items"]])
+        self.assertEqual(codes, [r["code"] for r in ret["items"]])
+        self.assertEqual(Item.STAGED, ret["items"][0]["result"]["state"])
+        self.assertEqual(250, ret["total"])
+        self.assertEqual(2, Item.objects.filter(state=Item.STAGED).count())
+        self.assertEqual(2, ReceiptItem.objects.filter(receipt__pk=receipt["id"], action=ReceiptItem.ADD).count())
+
+        finished_receipt = self.assertSuccess(self.api.receipt_finish(id=receipt["id"])).json()
+        self.assertEqual(250, finished_receipt["total"])
+
+    def test_checkin_many(self):
+        other = ItemFactory(vendor=VendorFactory(event=self.event))
+        codes = [self.items[0].code, self.items[1].code, other.code]
+
+        ret = self.assertSuccess(self.api.item_checkin_many(codes=json.dumps(codes), vendor=self.vendor.id)).json()
+
+        self.assertEqual([200, 200, HTTPStatus.ACCEPTED], [r["status"] for r in ret["items"]])
+        self.assertEqual(2, Item.objects.filter(state=Item.BROUGHT).count())
+        self.assertEqual(Item.ADVERTISED, Item.objects.get(pk=other.pk).state)
+
+        ret = self.assertSuccess(self.api.item_checkin_many(codes=json.dumps(codes[:1]), vendor=self.vendor.id)).json()
+        self.assertEqual(HTTPStatus.CONFLICT, ret["items"][0]["status"])
+
+    def _locks_and_item_updates(self, request):
+        """Models of rows locked and updates of Items by the request, in order of execution."""
+        executed = []
+        execute_sql = SQLCompiler.execute_sql
+
+        def record(compiler, *args, **kwargs):
+            if compiler.query.select_for_update:
+                executed.append((compiler.query.model, compiler.query.order_by))
+            elif isinstance(compiler, SQLUpdateCompiler) and compiler.query.model is Item:
+                executed.append((Item, None))
+            return execute_sql(compiler, *args, **kwargs)
+
+        with mock.patch.object(SQLCompiler, "execute_sql", record):
+            self.assertSuccess(request())
+        return executed
+
+    def test_vendors_locked_before_items(self):
+        # Vendors are locked before their items everywhere, so that concurrent requests cannot deadlock.
+        EventPermission.objects.create(event=self.event, user=self.clerk.user, can_perform_overseer_actions=True)
+        other = ItemFactory(vendor=VendorFactory(event=self.event), state=Item.BROUGHT)
+        Item.objects.filter(pk=self.items[0].pk).update(state=Item.BROUGHT)
+        receipt = self.assertSuccess(self.api.receipt_start()).json()
+        self.assertSuccess(self.api.item_reserve(code=self.items[0].code))
+        self.assertSuccess(self.api.item_reserve(code=other.code))
+
+        for request in (
+                lambda: self.api.receipt_finish(id=receipt["id"]),
+                lambda: self.api.item_edit(code=other.code, price=str(other.price), state=Item.BROUGHT),
+                lambda: self.api.item_checkin_many(codes=json.dumps([self.items[1].code]), vendor=self.vendor.id),
+        ):
+            executed = self._locks_and_item_updates(request)
+            models = [model for model, _order in executed]
+            self.assertIn(Item, models)
+            self.assertLess(models.index(Vendor), models.index(Item), executed)
+
+        self.assertEqual(Item.BROUGHT, Item.objects.get(pk=other.pk).state)
+
+    def test_counter_key_change_ends_session(self):
+        self.assertSuccess(self.api.item_find(code=self.items[0].code))
+        # Changing the key must invalidate cached login validation.
+        self.counter.assign_private_key()
+        self.assertResult(self.api.item_find(code=self.items[0].code), expect=HTTPStatus.UNAUTHORIZED)
+
+    def test_checkout_deactivation(self):
+        self.assertSuccess(self.api.item_find(code=self.items[0].code))
+        # Saving the event must invalidate cached Event.
+        self.event.checkout_active = False
+        self.event.save(update_fields=("checkout_active",))
+        self.assertResult(self.api.item_find(code=self.items[0].code), expect=HTTPStatus.NOT_FOUND)
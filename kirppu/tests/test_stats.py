@@ -0,0 +1,662 @@
+# -*- coding: utf-8 -*-
+import gzip
+import struct
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+
+from .. import stats
+from ..models import (
+    EventPermission,
+    Item,
+    ItemStateLog,
+    ItemStateLogRollup,
+    RemoteEvent,
+    VendorItemChange,
+    VendorItemSummary,
+)
+from ..stats import ItemCountData, ItemEurosData
+from ..stats_feed import StatsFeed, subscribe
+from . import ResultMixin
+from .api_access import Api
+from .factories import (
+    BoxFactory,
+    ClerkFactory,
+    CounterFactory,
+    EventFactory,
+    EventPermissionFactory,
+    ItemFactory,
+    ItemTypeFactory,
+    UserFactory,
+    VendorFactory,
+)
+
+
+class StatsGraphTest(TestCase, ResultMixin):
+    def setUp(self):
+        cache.clear()
+        self.event = EventFactory()
+        self.vendor = VendorFactory(event=self.event)
+        self.type_a = ItemTypeFactory(event=self.event)
+        self.type_b = ItemTypeFactory(event=self.event)
+        self.items_a = Item.new_many(["a"] * 3, vendor=self.vendor, itemtype=self.type_a, price=Decimal("1.50"))
+        self.items_b = Item.new_many(["b"] * 2, vendor=self.vendor, itemtype=self.type_b, price=Decimal("4"))
+
+        self.counter = CounterFactory(event=self.event)
+        self.clerk = ClerkFactory(event=self.event)
+        EventPermissionFactory(event=self.event, user=self.clerk.user, can_see_statistics=True,
+                               can_perform_overseer_actions=True)
+        self.api = Api(client=self.client, event=self.event)
+        self.assertSuccess(self.api.clerk_login(code=self.clerk.get_code(), counter=self.counter.private_key))
+
+    def _sell(self, *items):
+        for item in items:
+            self.assertSuccess(self.api.item_checkin(code=item.code, vendor=self.vendor.pk))
+        receipt = self.assertSuccess(self.api.receipt_start()).json()
+        self.assertSuccess(self.api.item_reserve(code=items[0].code))
+        self.assertSuccess(self.api.receipt_finish(id=receipt["id"]))
+
+    @staticmethod
+    def _last_row(response):
+        content = b"".join(response.streaming_content).decode("utf-8")
+        return content.splitlines()[-1].split(",")[1:]
+
+    def test_sales_data(self):
+        self._sell(*self.items_a)
+        self._sell(*self.items_b)
+
+        # brought, unsold, money, compensated
+        self.assertEqual(["5", "3", "2", "0"], self._last_row(self.api.stats_sales_data()))
+        self.assertEqual(["12.50", "7.00", "5.50", "0"], self._last_row(self.api.stats_sales_data(prices="true")))
+        self.assertEqual(["2", "1", "1", "0"], self._last_row(self.api.stats_group_sales_data(type_id=self.type_b.pk)))
+        self.assertEqual(["5"], self._last_row(self.api.stats_registration_data()))
+
+    @staticmethod
+    def _unpack(content, as_prices=False):
+        columns, previous_time = struct.unpack_from("<Iq", content)
+        if columns == 0:
+            return []
+        deltas = struct.Struct("<q%di" % (columns - 1))
+        previous = [previous_time] + [0] * (columns - 1)
+        rows = []
+        for row in deltas.iter_unpack(content[12:]):
+            previous = [p + d for p, d in zip(previous, row)]
+            rows.append([previous[0]] + [Decimal(v) / 100 if as_prices else v for v in previous[1:]])
+        return rows
+
+    def test_packed_output(self):
+        self._sell(*self.items_a)
+        self._sell(*self.items_b)
+
+        for endpoint, kwargs in (
+                (self.api.stats_sales_data, dict()),
+                (self.api.stats_sales_data, dict(prices="true")),
+                (self.api.stats_registration_data, dict()),
+                (self.api.stats_group_sales_data, dict(type_id=self.type_a.pk)),
+        ):
+            csv = b"".join(endpoint(**kwargs).streaming_content).decode("utf-8")
+            packed = endpoint(output="packed", **kwargs)
+            self.assertEqual(stats.PACKED_CONTENT_TYPE, packed["Content-Type"])
+            csv_rows = [line.split(",") for line in csv.splitlines()]
+            csv_rows = [[int(row[0])] + [Decimal(v) for v in row[1:]] for row in csv_rows]
+            self.assertEqual(csv_rows, self._unpack(b"".join(packed.streaming_content),
+                                                            as_prices="prices" in kwargs))
+
+    def test_packed_gzip(self):
+        self._sell(*self.items_a)
+        url = self.api.stats_sales_data.url
+        plain = self.client.get(url, dict(output="packed"))
+        compressed = self.client.get(url, dict(output="packed"), HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual("gzip", compressed["Content-Encoding"])
+        self.assertIn("Accept-Encoding", compressed["Vary"])
+        self.assertEqual(b"".join(plain.streaming_content), gzip.decompress(b"".join(compressed.streaming_content)))
+
+        refused = self.client.get(url, dict(output="packed"), HTTP_ACCEPT_ENCODING="gzip;q=0, deflate")
+        self.assertFalse(refused.has_header("Content-Encoding"))
+
+    def test_packed_long_gap(self):
+        rows = [(0, 1), (40 * 24 * 3600 * 1000, 2)]
+        content = b"".join(stats.pack_log_values(rows))
+        self.assertEqual([list(row) for row in rows], self._unpack(content))
+
+    def test_packed_empty(self):
+        content = b"".join(self.api.stats_group_sales_data(type_id=ItemTypeFactory(event=self.event).pk,
+                                                            output="packed").streaming_content)
+        self.assertEqual([], self._unpack(content))
+
+    def test_unknown_output(self):
+        self.assertResult(self.api.stats_sales_data(output="xml"), 400)
+
+    def test_rollup_matches_logs(self):
+        self._sell(*self.items_a)
+        self._sell(*self.items_b)
+
+        def rows():
+            return sorted(ItemStateLogRollup.objects.values_list(
+                "bucket", "itemtype", "old_state", "new_state", "count", "price_sum"))
+
+        self.assertTrue(ItemStateLogRollup.objects.filter(pending=True).exists())
+        # Reading does not fold the rows.
+        pending = list(stats.iterate_log_values(stats.SalesData(event=self.event)))
+        self.assertTrue(ItemStateLogRollup.objects.filter(pending=True).exists())
+        with mock.patch.object(stats, "now", return_value=now() + timedelta(minutes=2)):
+            call_command("update_stats")
+        self.assertFalse(ItemStateLogRollup.objects.filter(pending=True).exists())
+        self.assertEqual(pending, list(stats.iterate_log_values(stats.SalesData(event=self.event))))
+        incremental = rows()
+        self.assertEqual(ItemStateLog.objects.count(), sum(row[4] for row in incremental))
+
+        ItemStateLogRollup.objects.rebuild(self.event)
+        self.assertEqual(incremental, rows())
+
+    def test_price_edit(self):
+        item = self.items_a[0]
+        self.assertSuccess(self.api.item_edit(code=item.code, price="2.50", state=Item.ADVERTISED))
+        self.assertEqual(["13.50"], self._last_row(self.api.stats_registration_data(prices="true")))
+        self.assertSuccess(self.api.item_checkin(code=item.code, vendor=self.vendor.pk))
+
+        expected = (["13.50"], ["2.50", "2.50", "0", "0"])
+        self.assertEqual(expected, (
+            self._last_row(self.api.stats_registration_data(prices="true")),
+            self._last_row(self.api.stats_sales_data(prices="true")),
+        ))
+        ItemStateLogRollup.objects.rebuild(self.event)
+        stats.invalidate_stats_cache(self.event)
+        self.assertEqual(expected, (
+            self._last_row(self.api.stats_registration_data(prices="true")),
+            self._last_row(self.api.stats_sales_data(prices="true")),
+        ))
+
+        self.assertSuccess(self.api.item_edit(code=item.code, price="3", state=Item.BROUGHT))
+        self.assertEqual(["3.00", "3.00", "0", "0"], self._last_row(self.api.stats_sales_data(prices="true")))
+
+    def test_remote_event(self):
+        self._sell(*self.items_a)
+        self._sell(*self.items_b)
+        remote = RemoteEvent.objects.get(pk=self.event.pk)
+        for formatter in (
+                lambda event: stats.SalesData(event=event, as_prices=True),
+                lambda event: stats.SalesData(event=event, extra_filter=dict(itemtype=self.type_b)),
+                lambda event: stats.RegistrationData(event=event),
+        ):
+            expected = list(stats.iterate_log_values(formatter(self.event)))
+            self.assertEqual(expected, list(stats.iterate_log_values(formatter(remote))))
+
+        # The rollup is not used for remote events.
+        ItemStateLogRollup.objects.all().delete()
+        self.assertEqual((5, 3, 2, 0), list(stats.iterate_log_values(stats.SalesData(event=remote)))[-1][1:])
+
+
+@override_settings(KIRPPU_STATS_CACHE_SECONDS=60)
+class CachedStatsGraphTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.event = EventFactory()
+        self.itemtype = ItemTypeFactory(event=self.event)
+        self.start = now().replace(second=0, microsecond=0) - timedelta(minutes=30)
+
+    def _transition(self, minute, old_state, new_state, count=1):
+        ItemStateLogRollup.objects.create(
+            bucket=self.start + timedelta(minutes=minute),
+            itemtype=self.itemtype,
+            old_state=old_state,
+            new_state=new_state,
+            count=count,
+            price_sum=count,
+        )
+
+    def _lines(self):
+        return list(stats.cached_iterate_logs(stats.SalesData(event=self.event)))
+
+    def test_finished_buckets_cached(self):
+        self._transition(0, Item.ADVERTISED, Item.BROUGHT, 3)
+        self._transition(1, Item.BROUGHT, Item.SOLD)
+        self._transition(29, Item.BROUGHT, Item.SOLD)
+        first = self._lines()
+        self.assertEqual(first, list(stats.iterate_logs(stats.SalesData(event=self.event))))
+
+        # Changes to finished buckets are not seen, but newer buckets are.
+        self._transition(1, Item.ADVERTISED, Item.BROUGHT)
+        self._transition(30, Item.BROUGHT, Item.SOLD)
+        # Only the newer buckets are read.
+        with self.assertNumQueries(1):
+            second = self._lines()
+        self.assertEqual(first[:3], second[:3])
+        self.assertEqual(5, len(second))
+        self.assertTrue(second[-1].endswith(",3,0,3,0\n"), second[-1])
+
+        stats.invalidate_stats_cache(self.event)
+        self.assertEqual(list(stats.iterate_logs(stats.SalesData(event=self.event))), self._lines())
+
+    def test_since(self):
+        self._transition(0, Item.ADVERTISED, Item.BROUGHT, 3)
+        self._transition(1, Item.BROUGHT, Item.SOLD)
+        self._transition(5, Item.BROUGHT, Item.SOLD)
+        self._transition(30, Item.BROUGHT, Item.SOLD)  # Not finished yet.
+        formatter = stats.SalesData(event=self.event)
+        full = list(stats.iterate_log_values(formatter))
+
+        with self.assertNumQueries(1):
+            rows = list(stats.iterate_log_values_since(formatter, full[2][0], full[2][1:]))
+        self.assertEqual(full[3:4], rows)
+        self.assertEqual([], list(stats.iterate_log_values_since(formatter, full[3][0], full[3][1:])))
+
+    def test_since_api(self):
+        self._transition(0, Item.ADVERTISED, Item.BROUGHT, 3)
+        self._transition(2, Item.BROUGHT, Item.SOLD, 2)
+        self.client.force_login(UserFactory(is_staff=True))
+        api = Api(client=self.client, event=self.event)
+
+        since = stats.GraphLog.datetime_to_js_time(self.start)
+        response = api.stats_sales_data(since=since, balance="3,3,0,0")
+        lines = b"".join(response.streaming_content).decode("utf-8").splitlines()
+        self.assertEqual(["%d,3,1,2,0" % (since + 2 * 60000)], lines)
+
+        self.assertEqual(400, api.stats_sales_data(since=since).status_code)
+        self.assertEqual(400, api.stats_sales_data(since=stats.closed_js_time(stats.SalesData(event=self.event)),
+                                                   balance="3,3,0,0").status_code)
+        self.assertEqual(400, api.stats_sales_data(since=since, balance="3,3").status_code)
+        self.assertEqual(400, api.stats_sales_data(since="x", balance="3,3,0,0").status_code)
+        # Out of range since is rejected before the streaming response starts.
+        for output in ("csv", "packed"):
+            self.assertEqual(400, api.stats_sales_data(since=str(-10 ** 20), balance="3,3,0,0",
+                                                       output=output).status_code)
+
+        response = api.stats_sales_data(resolution="auto", points="3")
+        lines = b"".join(response.streaming_content).decode("utf-8").splitlines()
+        self.assertEqual(["%d,0,0,0,0" % (since - 60000), "%d,3,3,0,0" % since, "%d,3,1,2,0" % (since + 2 * 60000)],
+                         lines)
+        self.assertEqual(400, api.stats_sales_data(resolution="0").status_code)
+        self.assertEqual(400, api.stats_sales_data(resolution="10081").status_code)
+        self.assertEqual(400, api.stats_sales_data(resolution=str(10 ** 20)).status_code)
+        self.assertEqual(400, api.stats_sales_data(points="2").status_code)
+
+    def test_resume(self):
+        self._transition(0, Item.ADVERTISED, Item.BROUGHT, 3)
+        self._transition(29, Item.BROUGHT, Item.SOLD)
+        self.client.force_login(UserFactory(is_staff=True))
+        api = Api(client=self.client, event=self.event)
+
+        response = api.stats_sales_data()
+        closed = int(response["X-Kirppu-Closed-Before"])
+        rows = [line.split(",") for line in b"".join(response.streaming_content).decode("utf-8").splitlines()]
+        finished = [row for row in rows if int(row[0]) < closed]
+        self.assertEqual(2, len(finished))
+        self.assertEqual(3, len(rows))
+
+        # A transition later in the unfinished bucket is seen when resuming from the last finished row.
+        self._transition(29, Item.BROUGHT, Item.SOLD)
+        with mock.patch.object(stats, "now", return_value=now() + timedelta(minutes=2)):
+            response = api.stats_sales_data(since=finished[-1][0], balance=",".join(finished[-1][1:]))
+            lines = b"".join(response.streaming_content).decode("utf-8").splitlines()
+        self.assertEqual(["%s,3,1,2,0" % rows[-1][0]], lines)
+
+    def test_resolution(self):
+        # Align the first transition to start of a bucket.
+        offset = (-(self.start - stats.GraphLog.unix_epoch) % timedelta(minutes=5)) // timedelta(minutes=1)
+        self._transition(offset, Item.ADVERTISED, Item.BROUGHT, 3)
+        self._transition(offset + 1, Item.BROUGHT, Item.SOLD)
+        self._transition(offset + 7, Item.BROUGHT, Item.SOLD)
+        self._transition(offset + 20, Item.BROUGHT, Item.SOLD)
+        minutes = list(stats.iterate_log_values(stats.SalesData(event=self.event)))
+
+        resolution = timedelta(minutes=5)
+        formatter = stats.SalesData(event=self.event, resolution=resolution)
+        rows = list(stats.iterate_log_values(formatter))
+        for row in rows[1:]:
+            # Each row equals the last minute row of that bucket.
+            bucket_end = row[0] + 5 * 60000
+            self.assertEqual(row[1:], [m for m in minutes if m[0] < bucket_end][-1][1:])
+        self.assertEqual(4, len(rows))
+        self.assertEqual(rows, self._lines_with(formatter))
+
+        # Second call reads the finished buckets from cache.
+        self._transition(30, Item.BROUGHT, Item.SOLD)
+        self.assertEqual(rows[:3], self._lines_with(stats.SalesData(event=self.event, resolution=resolution))[:3])
+
+    def _lines_with(self, formatter):
+        return list(stats.cached_iterate_log_values(formatter))
+
+    def test_auto_resolution(self):
+        self._transition(0, Item.ADVERTISED, Item.BROUGHT, 3)
+        self._transition(29, Item.BROUGHT, Item.SOLD)
+        formatter = stats.SalesData(event=self.event)
+        formatter.use_auto_resolution(10)
+        self.assertEqual(timedelta(minutes=5), formatter.resolution)
+        formatter.use_auto_resolution(1000)
+        self.assertEqual(timedelta(minutes=1), formatter.resolution)
+
+    def test_downsample(self):
+        rows = [(minute * 60000, minute % 7, 0) for minute in range(100)]
+        rows[50] = (50 * 60000, 100, 0)
+        result = stats.downsample_log_values(rows, 10)
+        self.assertEqual(10, len(result))
+        self.assertEqual(rows[0], result[0])
+        self.assertEqual(rows[-1], result[-1])
+        self.assertIn(rows[50], result)
+        self.assertEqual(sorted(result), result)
+        self.assertEqual(rows[:5], stats.downsample_log_values(rows[:5], 10))
+
+    def test_filters_cached_separately(self):
+        self._transition(0, Item.ADVERTISED, Item.BROUGHT, 3)
+        self._lines()
+
+        other = ItemTypeFactory(event=self.event)
+        formatter = stats.SalesData(event=self.event, extra_filter=dict(itemtype=other))
+        self.assertEqual([], list(stats.cached_iterate_logs(formatter)))
+
+
+class GeneralStatsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.event = EventFactory()
+        vendor = VendorFactory(event=self.event, mobile_view_visited=True)
+        other_vendor = VendorFactory(event=self.event)
+        VendorFactory(event=self.event)  # No items.
+
+        ItemFactory(vendor=vendor, state=Item.ADVERTISED, printed=True)
+        ItemFactory(vendor=vendor, state=Item.ADVERTISED, printed=True, hidden=True)
+        ItemFactory(vendor=vendor, state=Item.SOLD)
+        ItemFactory(vendor=other_vendor, state=Item.ADVERTISED)
+        BoxFactory(vendor=other_vendor, item_count=3)
+        box = BoxFactory(vendor=vendor, item_count=2)
+        Item.objects.filter(box=box).update(state=Item.BROUGHT, hidden=True)
+
+    def test_counts(self):
+        with self.assertNumQueries(3):
+            general = stats.general_stats(self.event)
+
+        self.assertEqual({
+            "registered": 9,
+            "deleted": 3,
+            "brought": 3,
+            "sold": 1,
+            "printedDeleted": 1,
+            "printedNotBrought": 2,
+            "vendors": 1,
+            "vendorsTotal": 2,
+            "vendorsInMobileView": 1,
+            "itemsInBox": 5,
+            "itemsNotInBox": 4,
+            "broughtBoxItems": 2,
+            "registeredBoxes": 2,
+            "deletedBoxes": 1,
+            "broughtBoxes": 1,
+            "itemsInDeletedBoxes": 2,
+        }, {k: v for k, v in general.items() if not k.endswith(("Of", "OfRegistered", "OfBrought", "OfRegisteredBoxes"))})
+        self.assertEqual(100.0 / 3, general["soldOfBrought"])
+
+    @override_settings(KIRPPU_GENERAL_STATS_CACHE_SECONDS=30)
+    def test_cached(self):
+        general = stats.general_stats(self.event)
+        with self.assertNumQueries(0):
+            self.assertEqual(general, stats.general_stats(self.event))
+
+    def test_view(self):
+        user = UserFactory()
+        EventPermissionFactory(event=self.event, user=user, can_see_statistics=True)
+        self.client.force_login(user)
+        ItemFactory(vendor=VendorFactory(event=self.event), state=Item.COMPENSATED, price=Decimal("7"))
+        response = self.client.get("/kirppu/%s/stats/statistical/" % self.event.slug)
+        self.assertEqual(10, response.context["general"]["registered"])
+        self.assertEqual(0, response.context["general"]["purchases"])
+        self.assertEqual(2, response.context["brought"]["count"])
+        self.assertEqual(2, response.context["brought"]["median"])
+        self.assertEqual(1, response.context["compensations"]["count"])
+        self.assertEqual(7, response.context["compensations"]["median"])
+        self.assertEqual([1, 0], response.context["compensations"]["frequency"])
+
+
+class DistributionTest(TestCase):
+    def setUp(self):
+        self.event = EventFactory()
+        vendor = VendorFactory(event=self.event)
+        for price in ("5", "1", "3", "2", "4"):
+            ItemFactory(vendor=vendor, price=Decimal(price))
+        self.items = Item.objects.filter(vendor__event=self.event)
+
+    def test_distribution(self):
+        with self.assertNumQueries(3):
+            result = stats.distribution(self.items, "price", 2)
+
+        self.assertEqual(5, result["count"])
+        self.assertEqual(2, result["step"])
+        self.assertEqual([1, 2, 2, 0], result["frequency"])
+        self.assertAlmostEqual(3, result["mean"])
+        self.assertAlmostEqual(2 ** 0.5, result["pstdev"])
+        self.assertEqual(3, result["median"])
+        self.assertEqual(["68%", "95%", "99.7%"], [label for _, label in result["percentiles"]])
+        for expected, (actual, _) in zip((3.72, 4.8, 4.988), result["percentiles"]):
+            self.assertAlmostEqual(expected, actual)
+
+    def test_even_count(self):
+        Item.objects.filter(vendor__event=self.event, price=Decimal("5")).delete()
+        result = stats.distribution(self.items, "price", 1)
+        self.assertEqual(2.5, result["median"])
+        self.assertEqual([0, 1, 1, 1, 1, 0], result["frequency"])
+
+    def test_max_buckets(self):
+        ItemFactory(vendor=VendorFactory(event=self.event), price=Decimal("10000"))
+        result = stats.distribution(self.items, "price", 1, max_buckets=10)
+        self.assertEqual(1250, result["step"])
+        self.assertEqual([5, 0, 0, 0, 0, 0, 0, 0, 1, 0], result["frequency"])
+        self.assertEqual(3.5, result["median"])
+
+    def test_empty(self):
+        result = stats.distribution(self.items.none(), "price", 5)
+        self.assertEqual({"count": 0, "step": 5, "frequency": []}, result)
+
+
+class ItemCountEurosDataTest(TestCase):
+    def setUp(self):
+        self.event = EventFactory()
+        self.types = [ItemTypeFactory(event=self.event) for _ in range(3)]
+        for index, state in enumerate((Item.ADVERTISED, Item.BROUGHT, Item.SOLD, Item.COMPENSATED)):
+            vendor = VendorFactory(event=self.event)
+            ItemFactory.create_batch(index + 1, vendor=vendor, itemtype=self.types[index % 2], state=state,
+                                     price=Decimal("2.50"))
+            ItemFactory(vendor=vendor, itemtype=self.types[0], state=Item.BROUGHT, abandoned=True)
+
+    def test_same_as_separate(self):
+        VendorItemSummary.objects.refresh(self.event)
+        for group_by in (ItemCountData.GROUP_ITEM_TYPE, ItemCountData.GROUP_VENDOR):
+            with self.assertNumQueries(2 if group_by == ItemCountData.GROUP_ITEM_TYPE else 1):
+                combined = stats.ItemCountEurosData(group_by, event=self.event)
+            counts = ItemCountData(group_by, event=self.event)
+            euros = ItemEurosData(group_by, event=self.event)
+
+            self.assertEqual(list(counts.keys()), list(combined.counts.keys()))
+            self.assertEqual(list(euros.keys()), list(combined.euros.keys()))
+            for key in counts.keys():
+                expect_counts = counts.data_set(key, "x")
+                expect_euros = euros.data_set(key, "x")
+                actual_counts = combined.counts.data_set(key, "x")
+                actual_euros = combined.euros.data_set(key, "x")
+                self.assertEqual(list(expect_counts.property_values), list(actual_counts.property_values))
+                self.assertEqual(list(expect_euros.property_values), list(actual_euros.property_values))
+                if group_by == ItemCountData.GROUP_VENDOR:
+                    # Gap and sum rows of item types have only the main properties.
+                    self.assertEqual(expect_counts.row_obj(), actual_counts.row_obj())
+                    self.assertEqual(expect_euros.row_obj(), actual_euros.row_obj())
+
+    def test_view(self):
+        user = UserFactory()
+        EventPermissionFactory(event=self.event, user=user, can_see_statistics=True)
+        self.client.force_login(user)
+        VendorItemSummary.objects.refresh(self.event)
+        response = self.client.get("/kirppu/%s/stats/" % self.event.slug)
+        self.assertEqual(len(self.types) + 1, len(response.context["number_of_items"]))
+        self.assertEqual(4, len(response.context["vendor_item_data_euros"]))
+
+
+@override_settings(KIRPPU_LIVE_STATS_INTERVAL=0.01, KIRPPU_STATS_CACHE_SECONDS=0,
+                   KIRPPU_GENERAL_STATS_CACHE_SECONDS=0)
+class StatsFeedTest(TestCase):
+    def setUp(self):
+        self.event = EventFactory()
+        self.itemtype = ItemTypeFactory(event=self.event)
+        self.start = now().replace(second=0, microsecond=0) - timedelta(minutes=30)
+
+    async def _transition(self, minute, old_state, new_state):
+        await ItemStateLogRollup.objects.acreate(
+            bucket=self.start + timedelta(minutes=minute),
+            itemtype=self.itemtype,
+            old_state=old_state,
+            new_state=new_state,
+            count=1,
+            price_sum=1,
+        )
+
+    async def test_feed(self):
+        await self._transition(0, Item.ADVERTISED, Item.BROUGHT)
+        messages = subscribe(self.event)
+        other = subscribe(self.event)
+        self.assertEqual("retry: 10\n\n", await anext(messages))
+        self.assertEqual("retry: 10\n\n", await anext(other))
+
+        general = await anext(messages)
+        self.assertTrue(general.startswith("event: general\ndata: {"), general)
+        self.assertEqual(general, await anext(other))
+
+        await self._transition(5, Item.BROUGHT, Item.SOLD)
+        js_time = stats.GraphLog.datetime_to_js_time(self.start + timedelta(minutes=5))
+        expected = "event: sales\ndata: %d,1,0,1,0\n\n" % js_time
+        self.assertEqual(expected, await anext(messages))
+        self.assertEqual(expected, await anext(other))
+
+        key = StatsFeed.key_of(self.event)
+        await messages.aclose()
+        self.assertIn(key, StatsFeed._feeds)
+        await other.aclose()
+        self.assertNotIn(key, StatsFeed._feeds)
+
+    async def test_view(self):
+        url = "/kirppu/%s/stats/live" % self.event.slug
+        user = await sync_to_async(UserFactory)()
+        await self.async_client.aforce_login(user)
+        self.assertEqual(403, (await self.async_client.get(url)).status_code)
+
+        await EventPermission.objects.acreate(event=self.event, user=user, can_see_statistics=True)
+        response = await self.async_client.get(url)
+        self.assertEqual("text/event-stream", response["Content-Type"])
+        content = aiter(response.streaming_content)
+        self.assertEqual(b"retry: 10\n\n", await anext(content))
+        await content.aclose()
+        self.assertNotIn(StatsFeed.key_of(self.event), StatsFeed._feeds)
+
+    def test_requires_asgi(self):
+        user = UserFactory()
+        EventPermissionFactory(event=self.event, user=user, can_see_statistics=True)
+        self.client.force_login(user)
+        self.assertEqual(501, self.client.get("/kirppu/%s/stats/live" % self.event.slug).status_code)
+
+
+class VendorItemSummaryTest(TestCase):
+    def setUp(self):
+        self.event = EventFactory()
+        self.itemtype = ItemTypeFactory(event=self.event)
+        self.vendors = [VendorFactory(event=self.event) for _ in range(3)]
+        for vendor in self.vendors:
+            ItemFactory.create_batch(2, vendor=vendor, itemtype=self.itemtype, price=Decimal("1.50"))
+
+    def _assert_same(self):
+        VendorItemSummary.objects.refresh(self.event)
+        combined = stats.ItemCountEurosData(ItemCountData.GROUP_VENDOR, event=self.event)
+        counts = ItemCountData(ItemCountData.GROUP_VENDOR, event=self.event)
+        euros = ItemEurosData(ItemCountData.GROUP_VENDOR, event=self.event)
+        self.assertEqual(list(counts.keys()), list(combined.counts.keys()))
+        for key in counts.keys():
+            self.assertEqual(counts.data_set(key, "x").row_obj(), combined.counts.data_set(key, "x").row_obj())
+            self.assertEqual(euros.data_set(key, "x").row_obj(), combined.euros.data_set(key, "x").row_obj())
+
+    @staticmethod
+    def _changed():
+        return sorted(set(VendorItemChange.objects.values_list("vendor_id", flat=True)))
+
+    def test_changes(self):
+        self._assert_same()
+
+        item = Item.objects.filter(vendor=self.vendors[0]).first()
+        item.state = Item.BROUGHT
+        item.save(update_fields=("state",))
+        self._assert_same()
+
+        Item.objects.filter(vendor=self.vendors[1]).update(hidden=True)
+        self._assert_same()
+
+        Item.new_many(["new"] * 2, vendor=self.vendors[2], itemtype=self.itemtype, price=Decimal("3"))
+        self._assert_same()
+
+        Item.objects.filter(vendor=self.vendors[2]).delete()
+        self._assert_same()
+
+        item.vendor = self.vendors[2]
+        item.save()
+        self._assert_same()
+
+    def test_only_changed_recalculated(self):
+        VendorItemSummary.objects.refresh(self.event)
+        with self.assertNumQueries(2):
+            # Missing summaries and changes.
+            VendorItemSummary.objects.refresh(self.event)
+
+        Item.objects.filter(vendor=self.vendors[0]).update(abandoned=True)
+        with self.assertNumQueries(1):
+            # Fields not in the summary do not mark it changed.
+            Item.objects.filter(vendor=self.vendors[0]).update(printed=True)
+
+        self.assertEqual([self.vendors[0].pk], self._changed())
+        self._assert_same()
+        self.assertEqual([], self._changed())
+
+    def test_read_only(self):
+        VendorItemSummary.objects.refresh(self.event)
+        Item.objects.filter(vendor=self.vendors[0]).update(hidden=True)
+        with CaptureQueriesContext(connection) as captured:
+            stats.ItemCountEurosData(ItemCountData.GROUP_VENDOR, event=self.event)
+        self.assertTrue(all(query["sql"].startswith("SELECT") for query in captured))
+        self.assertEqual([self.vendors[0].pk], self._changed())
+
+    def test_changed_during_refresh(self):
+        VendorItemSummary.objects.refresh(self.event)
+        Item.objects.filter(vendor=self.vendors[0]).update(hidden=True)
+        select_for_update = VendorItemSummary.objects.select_for_update
+
+        def change_before_write(*args, **kwargs):
+            # Items of the vendor are changed after they were read for the refresh.
+            Item.objects.filter(vendor=self.vendors[0]).update(hidden=False)
+            return select_for_update(*args, **kwargs)
+
+        with mock.patch.object(VendorItemSummary.objects, "select_for_update", change_before_write):
+            VendorItemSummary.objects.refresh(self.event)
+        self.assertEqual([self.vendors[0].pk], self._changed())
+        self._assert_same()
+
+    def test_refreshed_concurrently(self):
+        VendorItemSummary.objects.refresh(self.event)
+        Item.objects.filter(vendor=self.vendors[0]).update(hidden=True)
+        select_for_update = VendorItemSummary.objects.select_for_update
+        calls = []
+
+        def refresh_before_write(*args, **kwargs):
+            calls.append(None)
+            if len(calls) == 1:
+                # Another refresh reads a newer change and finishes before this one.
+                Item.objects.filter(vendor=self.vendors[0]).update(hidden=False)
+                VendorItemSummary.objects.refresh(self.event)
+            return select_for_update(*args, **kwargs)
+
+        with mock.patch.object(VendorItemSummary.objects, "select_for_update", refresh_before_write):
+            VendorItemSummary.objects.refresh(self.event)
+        self.assertEqual(2, len(calls))
+        self.assertEqual([], self._changed())
+        # The older refresh did not replace the newer summary.
+        self._assert_same()
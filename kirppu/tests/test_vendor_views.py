@@ -2,9 +2,12 @@
 
 import factory
 from django.conf import settings
+from django.db import connection
+from django.db.models.signals import post_save, pre_save
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
-from ..models import Box, Item
+from ..models import Box, Item, ItemStateLog
 from . import ResultMixin
 from .factories import *
 
@@ -117,6 +120,46 @@ class InitialAddTest(_VendorTest):
         data = ApiItemFactory(item_type=self.type.id, suffixes="1-10")
         result = self.assertSuccess(self.client.post("/kirppu/%s/vendor/item/" % self.event.slug, data=data)).json()
         self.assertEqual(10, len(result))
+        self.assertEqual(10, len({item["code"] for item in result}))
+        self.assertEqual(10, ItemStateLog.objects.filter(item__vendor=self.vendor).count())
+
+    def test_register_item_suffixes_query_count(self):
+        self._defaults()
+        url = "/kirppu/%s/vendor/item/" % self.event.slug
+
+        def queries(suffixes):
+            data = ApiItemFactory(item_type=self.type.id, suffixes=suffixes)
+            with CaptureQueriesContext(connection) as captured:
+                self.assertSuccess(self.client.post(url, data=data))
+            return len(captured)
+
+        self.assertEqual(queries("1"), queries("1-20"))
+
+    def test_register_item_suffixes_signals(self):
+        self._defaults()
+        sent = []
+
+        def handler(signal, sender, instance, **kwargs):
+            sent.append((signal, sender, kwargs.get("created"), instance.pk))
+
+        for signal in (pre_save, post_save):
+            signal.connect(handler, sender=Item)
+            self.addCleanup(signal.disconnect, handler, sender=Item)
+
+        data = ApiItemFactory(item_type=self.type.id, suffixes="1-3")
+        self.assertSuccess(self.client.post("/kirppu/%s/vendor/item/" % self.event.slug, data=data))
+        ids = list(Item.objects.filter(vendor=self.vendor).order_by("pk").values_list("pk", flat=True))
+        self.assertEqual(3, len(ids))
+        self.assertEqual(3, count(lambda s: s[0] is pre_save and s[3] is None, sent))
+        self.assertEqual(ids, sorted(s[3] for s in sent if s[0] is post_save and s[2]))
+
+    @override_settings(KIRPPU_MAX_ITEMS_PER_VENDOR=5)
+    def test_register_item_suffixes_over_limit(self):
+        self._defaults()
+        data = ApiItemFactory(item_type=self.type.id, suffixes="1-10")
+        result = self.client.post("/kirppu/%s/vendor/item/" % self.event.slug, data=data)
+        self.assertContains(result, "maximum", status_code=400)
+        self.assertEqual(5, Item.objects.filter(vendor=self.vendor).count())
 
     def test_register_item_for_other_event_itemtype(self):
         self.test_register_vendor_and_items()
@@ -164,6 +207,20 @@ class InitialAddTest(_VendorTest):
         self.assertContains(result, data["description"])
         self.assertEqual(5, Item.objects.count())
 
+    def test_register_box_query_count(self):
+        self._defaults()
+        url = "/kirppu/%s/vendor/box/" % self.event.slug
+
+        def queries(count):
+            data = ApiBoxFactory(item_type=self.type.id, count=count)
+            with CaptureQueriesContext(connection) as captured:
+                self.assertContains(self.client.post(url, data=data), data["description"])
+            return len(captured)
+
+        # Kept within one bulk insert batch of SQLite.
+        self.assertEqual(queries(2), queries(60))
+        self.assertEqual(62, ItemStateLog.objects.filter(item__vendor=self.vendor).count())
+
     # endregion
 
 
@@ -285,3 +342,33 @@ class ManipulationTest(_VendorTest):
         self.assertEqual(1, count(lambda b: b.is_printed(), result.context["boxes"]))
 
     # endregion
+
+
+class BoxAdjustTest(_VendorTest):
+    def setUp(self):
+        super().setUp()
+        self._defaults()
+        self.box = BoxFactory(vendor=self.vendor, item_count=5)
+        self.code = self.box.representative_item.code
+
+        staff = UserFactory(is_staff=True)
+        self.client.force_login(staff)
+
+    def _adjust(self, item_count):
+        self.assertRedirects(self.client.post("/kirppu/%s/adjust_box" % self.event.slug, data={
+            "code": self.code,
+            "vendor_id": self.vendor.pk,
+            "item_count": item_count,
+        }), "/kirppu/%s/adjust_box" % self.event.slug)
+        return Item.objects.filter(box=self.box, hidden=False).count()
+
+    def test_shrink_and_grow(self):
+        self.assertEqual(3, self._adjust(3))
+        self.assertEqual(2, Item.objects.filter(box=self.box, hidden=True).count())
+
+        # Hidden items are restored first, then new ones are added.
+        self.assertEqual(8, self._adjust(8))
+        self.assertEqual(0, Item.objects.filter(box=self.box, hidden=True).count())
+        self.assertEqual(8, Item.objects.filter(box=self.box).count())
+        # Factory does not log the initial items.
+        self.assertEqual(3, ItemStateLog.objects.filter(item__box=self.box).count())
@@ -33,12 +33,14 @@ from .views import (
 from .views import access_signup
 from .views import accounting
 from .views import event_management
+from .views import exports
 from .views.frontpage import front_page
 from .checkout_api import checkout_js
 from .views.mobile import index as mobile_index, logout as mobile_logout
 from .views.vendors import change_vendor, create_vendor
 from .views.item_dump import dump_items_view
 from .views.flow_stats import flow_stats
+from .views.live_stats import live_stats
 
 
 app_name = "kirppu"
@@ -48,6 +50,8 @@ event_urls = [
     path(r'accounting/live', accounting.live_accounts, name="live_accounts"),
     path('accounting/flow', flow_stats),
     path(r'itemdump/', dump_items_view, name="item_dump"),
+    path(r'export/', exports.export_start, name="export"),
+    path(r'export/<slug:token>', exports.export_download, name="export_download"),
     path(r'clerks/', get_clerk_codes, name='clerks'),
     path(r'boxes/', get_boxes_codes, name="box_codes"),
     path(r'checkout/', checkout_view, name='checkout_view'),
@@ -55,6 +59,7 @@ event_urls = [
     path(r'stats/', stats_view, name='stats_view'),
     path(r'stats/type/<str:type_id>', type_stats_view, name='type_stats_view'),
     path(r'stats/statistical/', statistical_stats_view, name='statistical_stats_view'),
+    path(r'stats/live', live_stats, name='live_stats'),
     path(r'', vendor_view, name='vendor_view'),
     path(r'vendor/', vendor_view),
     path(r'vendor/accept_terms', accept_terms, name='accept_terms'),
@@ -296,6 +296,40 @@ def get_query_dict(request: "django.http.HttpRequest") -> typing.Optional["djang
         return request.POST
 
 
+def accepts_gzip(accept_encoding: str) -> bool:
+    """
+    Check whether Accept-Encoding header value allows gzip, taking quality values into account.
+
+    >>> accepts_gzip("gzip, deflate")
+    True
+    >>> accepts_gzip("gzip;q=0, *")
+    False
+    >>> accepts_gzip("br, *;q=0.5")
+    True
+    >>> accepts_gzip("")
+    False
+
+    :param accept_encoding: Value of the header, e.g. `request.META.get("HTTP_ACCEPT_ENCODING", "")`.
+    """
+    qualities = {}
+    for entry in accept_encoding.split(","):
+        coding, *params = entry.split(";")
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    for coding in ("gzip", "x-gzip", "*"):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
 def shorten_text(text, length=80, cut_on_dot=True):
     """
     Get excerpt of 'text' from beginning.
@@ -1,4 +1,8 @@
 import datetime
+import functools
+import inspect
+import operator
+import types
 from functools import wraps
 from django.core.exceptions import PermissionDenied
 import django.forms
@@ -20,17 +24,25 @@ def model_dict_fn(*args, **kwargs):
         >>> class C(object):
         ...     def __init__(self):
         ...         self.a = 3
-        ...     as_dict = model_dict_fn("a")
+        ...     def b(self):
+        ...         return 4
+        ...     as_dict = model_dict_fn("a", "b")
         ...     as_renamed = model_dict_fn(renamed="a")
         ...     as_called = model_dict_fn(multi=lambda self: self.a * 2)
-        >>> C().as_dict(), C().as_renamed(), C().as_called()
-        ({'a': 3}, {'renamed': 3}, {'multi': 6})
+        ...     as_extended = model_dict_fn(b=None, __extend=as_dict)
+        >>> C().as_dict(), C().as_renamed(), C().as_called(), C().as_extended()
+        ({'a': 3, 'b': 4}, {'renamed': 3}, {'multi': 6}, {'a': 3})
+        >>> C().as_dict(exclude=("a",))
+        {'b': 4}
+
+    The field accessors are resolved once per instance class and `exclude` value.
 
     :param args: List of fields.
     :param kwargs: Fields to be renamed or overridden with another function call.
+        Field with None value is not included in the result.
     :return: Function.
     """
-    access = kwargs.pop("__access_fn", lambda self, value: getattr(self, value))
+    access = kwargs.pop("__access_fn", None)
     extend = kwargs.pop("__extend", None)
     fields = {}
     if extend:
@@ -39,31 +51,69 @@ def model_dict_fn(*args, **kwargs):
         fields[plain_key] = plain_key
     fields.update(kwargs)
 
+    resolved = {}
+
     def model_dict(self, exclude=None):
         """
         Get model fields as dictionary (for JSON/AJAX usage). Fields returned:
         {0}
         """
-        exclude = exclude or ()
-        ret = {}
-        for key, value in fields.items():
-            if key in exclude:
-                continue
-            if callable(value):
-                ret[key] = value(self)
-            elif value is None:
-                if value in ret:
-                    del ret[value]
-            else:
-                ret[key] = access(self, value)
-                if callable(ret[key]):
-                    ret[key] = ret[key]()
-        return ret
+        exclude = tuple(exclude) if exclude else ()
+        key = (self.__class__, exclude)
+        fn = resolved.get(key)
+        if fn is None:
+            fn = resolved[key] = _resolve_model_dict(fields, self.__class__, exclude, access)
+        return fn(self)
     model_dict.__doc__ = model_dict.__doc__.format(", ".join(fields.keys()))
     model_dict.fields = fields  # "Base" field dictionary for extend.
     return model_dict
 
 
+def _call_if_callable(value):
+    return value() if callable(value) else value
+
+
+def _resolve_model_dict(fields, cls, exclude, access):
+    """
+    Build the accessor tuple for `fields` of `cls` and return a function creating the dictionary from it.
+
+    Fields referring to methods of `cls` are called directly and concrete model field values are read
+    directly. Other attributes are called only if their value is callable.
+    """
+    from django.db.models.query_utils import DeferredAttribute
+
+    accessors = []
+    for key, value in fields.items():
+        if key in exclude or value is None:
+            continue
+        if callable(value):
+            accessor = value
+        elif access is not None:
+            accessor = functools.partial(_access_and_call, access, value)
+        else:
+            static = inspect.getattr_static(cls, value, None)
+            if isinstance(static, (types.FunctionType, staticmethod, classmethod, functools.partialmethod)):
+                accessor = operator.methodcaller(value)
+            elif isinstance(static, DeferredAttribute):
+                accessor = operator.attrgetter(value)
+            else:
+                accessor = functools.partial(_get_and_call, operator.attrgetter(value))
+        accessors.append((key, accessor))
+    accessors = tuple(accessors)
+
+    def model_dict(self):
+        return {key: accessor(self) for key, accessor in accessors}
+    return model_dict
+
+
+def _access_and_call(access, value, self):
+    return _call_if_callable(access(self, value))
+
+
+def _get_and_call(getter, self):
+    return _call_if_callable(getter(self))
+
+
 def format_datetime(dt):
     """
     Format given datetime in RFC8601 format, that is used with moment.js.
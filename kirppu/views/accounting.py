@@ -1,13 +1,16 @@
 # -*- coding: utf-8 -*-
 from collections import defaultdict
 import csv
+from decimal import Decimal
 import typing
 
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
-from django.db.models import Sum
+from django.db.models import Prefetch, Sum
+from django.http import HttpResponseBadRequest
 from django.shortcuts import get_object_or_404, render
+from django.utils.dateparse import parse_datetime
 from django.utils.translation import gettext_lazy as _, pgettext_lazy, gettext
 from django.utils import timezone
 
@@ -21,6 +24,7 @@ from ..models import (
     ReceiptExtraRow,
     ReceiptItem,
     RemoteEvent,
+    VendorLedgerEntry,
     decimal_to_transport,
 )
 
@@ -50,6 +54,10 @@ EVENTS = dict((
 ))
 
 
+# Number of receipts whose rows are fetched at once.
+RECEIPT_CHUNK_SIZE = 500
+
+
 def _zero_fn():
     return 0
 
@@ -60,35 +68,82 @@ def accounting_receipt_view(request, event_slug):
     if not EventPermission.get(event, request.user).can_see_accounting:
         raise PermissionDenied
 
+    since = request.GET.get("since")
+    if since is not None:
+        since = parse_datetime(since)
+        if since is None:
+            return HttpResponseBadRequest("Invalid since")
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+
     event = event.get_real_event()
     return csv_streamer_view(
         request,
-        lambda output: accounting_receipt(output, event, generator=True),
+        lambda output: accounting_receipt(output, event, generator=True, since=since),
         gettext("accounting")
     )
 
 
+class _NullWriter(object):
+    def writerow(self, row):
+        pass
+
+
 @strip_generator
-def accounting_receipt(output, event: typing.Union[Event, RemoteEvent]):
+def accounting_receipt(output, event: typing.Union[Event, RemoteEvent], since=None):
+    """
+    Write accounting CSV of the event.
+
+    :param since: If given, only receipts finished after this time are written. Vendor balances before them
+        are read from the vendor ledger, or from receipts before them if the event is in another database.
+    """
     writer = csv.writer(output)
     writer.writerow(str(c) for c in COLUMNS)
     # Used here and later for buffer streaming and clearing in case of StringIO.
     yield
 
-    receipts = (Receipt.objects
-                .using(event.get_real_database_alias())
-                .filter(clerk__event=event, status=Receipt.FINISHED)
-                .prefetch_related("receiptitem_set", "receiptitem_set__item", "extra_rows")
-                .order_by("end_time")
-                )
+    # Remote events may have been archived without the ledger.
+    use_ledger = not isinstance(event, RemoteEvent)
+    if since is not None and use_ledger:
+        # Event numbers continue from those of the earlier receipts, so they match the full export.
+        impl = AccountingWriter(writer, VendorLedgerEntry.objects.balances(event, until=since),
+                                first_number=VendorLedgerEntry.objects.accounting_row_count(event, until=since) + 1)
+        receipts = finished_receipts(event, since=since)
+    else:
+        impl = AccountingWriter(writer if since is None else _NullWriter())
+        receipts = finished_receipts(event)
 
-    impl = AccountingWriter(writer)
     for receipt in receipts:
+        if since is not None and receipt.end_time > since:
+            impl.writer = writer
         impl.write_receipt(receipt)
         yield
+    impl.writer = writer
     impl.finish()
     yield
 
+    writer.writerow(())
+    if use_ledger:
+        ledger = {
+            vendor_id: decimal_to_transport(balance)
+            for vendor_id, balance in VendorLedgerEntry.objects.balances(event).items()
+        }
+        differences = sorted(
+            vendor_id
+            for vendor_id in set(ledger) | set(impl.total_vendors)
+            if ledger.get(vendor_id, 0) != impl.total_vendors.get(vendor_id, 0)
+        )
+        if differences:
+            writer.writerow((gettext("Vendor ledger difference:"),))
+            for vendor_id in differences:
+                writer.writerow((None, vendor_id, gettext("In Ledger"), ledger.get(vendor_id, 0)))
+                writer.writerow((None, vendor_id, gettext("In Receipts"), impl.total_vendors.get(vendor_id, 0)))
+
+    if since is not None:
+        # Rest of the checks need all receipts.
+        yield
+        return
+
     items_paid_out = (Item.objects
                       .using(event.get_real_database_alias())
                       .filter(vendor__event=event, state=Item.COMPENSATED)
@@ -102,7 +157,6 @@ def accounting_receipt(output, event: typing.Union[Event, RemoteEvent]):
     items_forfeited = decimal_to_transport(items_forfeited["sum"] or 0)
 
     # Basic sanity checking. Does not really give a straight explanation of why something is amiss.
-    writer.writerow(())
     if items_paid_out != impl.total_payout:
         writer.writerow((gettext("Payout difference:"),))
         writer.writerow((None, gettext("In Items"), items_paid_out))
@@ -116,13 +170,49 @@ def accounting_receipt(output, event: typing.Union[Event, RemoteEvent]):
     yield
 
 
+def finished_receipts(event: typing.Union[Event, RemoteEvent], since=None) -> typing.Iterator[Receipt]:
+    """
+    Iterate finished receipts of the event in the order used by `AccountingWriter`.
+    If `since` is given, only receipts finished after it are included.
+
+    Rows of the receipts are prefetched one chunk at a time, so that the memory use does not depend on
+    number of receipts, and the first rows can be written before all receipts have been read.
+    """
+    receipts = (Receipt.objects
+                .using(event.get_real_database_alias())
+                .filter(clerk__event=event, status=Receipt.FINISHED))
+    if since is not None:
+        receipts = receipts.filter(end_time__gt=since)
+    return (receipts
+            .only("type", "end_time", "vendor_id")
+            .prefetch_related(
+                Prefetch("receiptitem_set", queryset=ReceiptItem.objects
+                         .select_related("item")
+                         .only("action", "receipt_id", "item__vendor_id", "item__price")),
+                Prefetch("extra_rows", queryset=ReceiptExtraRow.objects.only("type", "value", "receipt_id")),
+            )
+            .order_by("end_time", "pk")
+            .iterator(chunk_size=RECEIPT_CHUNK_SIZE)
+            )
+
+
 class AccountingWriter(object):
-    def __init__(self, writer):
-        self.i = 1
+    def __init__(self, writer, vendor_balances: typing.Optional[typing.Dict[int, Decimal]] = None,
+                 first_number: int = 1):
+        """
+        :param writer: CSV writer for the rows.
+        :param vendor_balances: Balances of vendors before the first written receipt, e.g. from the vendor ledger.
+        :param first_number: Event number of the first written row.
+        """
+        self.i = first_number
         self.total_balance = 0
         self.total_vendors = defaultdict(_zero_fn)
         self.writer = writer
 
+        for vid, balance in (vendor_balances or {}).items():
+            self.total_vendors[vid] = decimal_to_transport(balance)
+            self.total_balance += self.total_vendors[vid]
+
         self.total_income = 0
         self.total_payout = 0
         self.total_forfeit = 0
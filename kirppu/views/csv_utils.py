@@ -6,28 +6,45 @@ from urllib.parse import quote
 
 from django.conf import settings
 from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+
+from ..util import accepts_gzip
 
 
 def strip_generator(fn):
     @functools.wraps(fn)
-    def inner(output, event, generator=False):
+    def inner(output, event, generator=False, **kwargs):
         if generator:
             # Return the generator object only when using StringIO.
-            return fn(output, event)
-        for _ in fn(output, event):
+            return fn(output, event, **kwargs)
+        for _ in fn(output, event, **kwargs):
             pass
 
     return inner
 
 
 def csv_streamer_view(request, generator, filename_base):
+    """
+    Stream text written by the generator into a response.
+
+    The generator writes to the given StringIO and yields after each row. The written text is sent when it
+    exceeds `KIRPPU_CSV_FLUSH_BYTES` characters or `KIRPPU_CSV_FLUSH_ROWS` rows, and right after the first
+    yield so that the client receives headers at once. The content is gzipped if the client accepts it.
+    """
     debug = settings.DEBUG and request.GET.get("debug") is not None
+    flush_bytes = getattr(settings, "KIRPPU_CSV_FLUSH_BYTES", 64 * 1024)
+    flush_rows = getattr(settings, "KIRPPU_CSV_FLUSH_ROWS", 1000)
 
     def streamer():
         if debug:
             yield "<!DOCTYPE html>\n<html>\n<body>\n<pre>"
         output = io.StringIO()
+        rows = -1
         for a_string in generator(output):
+            rows += 1
+            if rows != 0 and rows < flush_rows and output.tell() < flush_bytes:
+                continue
             val = output.getvalue()
             if debug:
                 yield html.escape(val, quote=False)
@@ -35,13 +52,25 @@ def csv_streamer_view(request, generator, filename_base):
                 yield val
             output.truncate(0)
             output.seek(0)
+            rows = 0
+        val = output.getvalue()
+        if val:
+            yield html.escape(val, quote=False) if debug else val
         if debug:
             yield "</pre>\n</body>\n</html>"
 
+    gzip = False
     if debug:
         response = HttpResponse("".join(streamer()))
     else:
-        response = StreamingHttpResponse(streamer(), content_type="text/plain; charset=utf-8")
+        gzip = accepts_gzip(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        content = streamer()
+        if gzip:
+            content = compress_sequence(val.encode("utf-8") for val in content)
+        response = StreamingHttpResponse(content, content_type="text/plain; charset=utf-8")
+        if gzip:
+            response["Content-Encoding"] = "gzip"
+        patch_vary_headers(response, ("Accept-Encoding",))
 
     if request.GET.get("download") is not None:
         response["Content-Disposition"] = 'attachment; filename="%s.csv"' % quote(filename_base, safe="")
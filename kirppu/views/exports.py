@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest
+from django.shortcuts import get_object_or_404, redirect
+from django.utils.translation import gettext
+from django.views.decorators.http import require_http_methods
+
+from .. import exports
+from ..models import Event, EventPermission
+
+__all__ = [
+    "export_start",
+    "export_download",
+]
+
+
+def _get_event(request, event_slug) -> Event:
+    event = get_object_or_404(Event, slug=event_slug)
+    if not EventPermission.get(event, request.user).can_see_accounting:
+        raise PermissionDenied
+    return event
+
+
+@login_required
+@require_http_methods(["POST"])
+def export_start(request, event_slug):
+    """
+    Start exporting `table` in `format` given in POST data, and redirect to the download address of the export.
+    """
+    event = _get_event(request, event_slug)
+    table = request.POST.get("table")
+    fmt = request.POST.get("format")
+    if table not in exports.TABLES or fmt not in exports.FORMATS:
+        return HttpResponseBadRequest("Unknown table or format")
+
+    token = exports.start_export(event, table, fmt)
+    return redirect("kirppu:export_download", event_slug=event.slug, token=token)
+
+
+@login_required
+def export_download(request, event_slug, token):
+    """
+    Download an export when it is done. Until then, a page that reloads itself is shown.
+    """
+    event = _get_event(request, event_slug)
+    state = exports.find_export(event, token)
+    if state is None:
+        raise Http404
+
+    if not state.done:
+        response = HttpResponse(gettext("The export is being prepared. This page is reloaded until it is done."),
+                                status=202, content_type="text/plain; charset=utf-8")
+        response["Refresh"] = "2"
+        return response
+    if state.error:
+        return HttpResponse(gettext("The export failed."), status=500, content_type="text/plain; charset=utf-8")
+
+    names = {
+        "accounting": gettext("accounting"),
+        "items": gettext("items"),
+    }
+    spec = exports.FORMATS[state.format]
+    return FileResponse(open(state.path, "rb"), as_attachment=True, content_type=spec.content_type,
+                        filename="{}.{}".format(names[state.table], spec.extension))
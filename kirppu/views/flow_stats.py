@@ -4,7 +4,7 @@ from datetime import timedelta, datetime
 
 from django.contrib.auth.decorators import login_required
 from django.db import models
-from django.http import StreamingHttpResponse, HttpResponseForbidden
+from django.http import StreamingHttpResponse, HttpResponseBadRequest, HttpResponseForbidden
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 
@@ -28,7 +28,14 @@ def flow_stats(request, event_slug):
     event = get_object_or_404(Event, slug=event_slug)
     if not EventPermission.get(event, request.user).can_see_accounting:
         return HttpResponseForbidden()
-    return StreamingHttpResponse(csv_generator(flow_generator(event)), content_type="text/plain")
+    try:
+        minutes = int(request.GET.get("minutes", 60))
+    except ValueError:
+        minutes = 0
+    if not 0 < minutes <= 24 * 60 or (24 * 60) % minutes:
+        return HttpResponseBadRequest("minutes must divide a day evenly")
+    bucket_td = timedelta(minutes=minutes)
+    return StreamingHttpResponse(csv_generator(flow_generator(event, bucket_td)), content_type="text/plain")
 
 
 def csv_generator(generator):
@@ -36,7 +43,7 @@ def csv_generator(generator):
         yield ",".join(str(el) for el in row) + "\n"
 
 
-def flow_generator(event: Event):
+def flow_generator(event: Event, bucket_td: timedelta = timedelta(minutes=60)):
     receipts_q: typing.Iterable[datetime] = (
         Receipt.objects
         .filter(type=Receipt.TYPE_PURCHASE, status=Receipt.FINISHED, clerk__event=event)
@@ -67,13 +74,12 @@ def flow_generator(event: Event):
 
     bucket_index = 0
     bucket_time: datetime | None = None
-    bucket_td = timedelta(minutes=60)
 
     yield make_header()
 
     for entry in entries_q:
         if bucket_time is None:
-            bucket_time = truncate_to_hour(entry.time)
+            bucket_time = truncate_to_bucket(entry.time, bucket_td)
             # Start the graph before the first entry, such that everything starts at zero.
             start_time = bucket_time - bucket_td
             receipt_count, receipts = iter_receipt_times(receipts, bucket_time + bucket_td)
@@ -89,7 +95,7 @@ def flow_generator(event: Event):
             yield make_row(bucket_time, balance, previous_balance, bucket_index)
             dict_copy(balance, previous_balance)
             bucket_index += 1
-            bucket_time = truncate_to_hour(entry.time)
+            bucket_time = truncate_to_bucket(entry.time, bucket_td)
 
         item_weight = entry.value
 
@@ -114,8 +120,9 @@ def flow_generator(event: Event):
         dict_copy(balance, previous_balance)  # unused, but for symmetry.
 
 
-def truncate_to_hour(dt: datetime) -> datetime:
-    return dt.replace(minute=0, second=0, microsecond=0)
+def truncate_to_bucket(dt: datetime, bucket_td: timedelta) -> datetime:
+    day = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day + (dt - day) // bucket_td * bucket_td
 
 
 def make_header():
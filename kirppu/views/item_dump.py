@@ -1,10 +1,11 @@
 # -*- coding: utf-8 -*-
 import csv
+import operator
 import typing
 
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
-from django.db.models import Max, TextField, F
+from django.db.models import Max, TextField
 from django.db.models.functions import Length, Cast
 from django.shortcuts import get_object_or_404
 from django.utils.translation import gettext_lazy as _, gettext
@@ -17,29 +18,39 @@ __all__ = [
 ]
 
 
-ColFn = typing.Callable[[Item], typing.Any]
+# Fields of the items fetched for the dump, in order of the value rows given to column functions.
+FIELDS = ("vendor_id", "code", "price", "state", "name", "box__description", "box__box_number")
+_CODE, _STATE, _NAME, _BOX_DESCRIPTION, _BOX_NUMBER = (FIELDS.index(f) for f in (
+    "code", "state", "name", "box__description", "box__box_number"))
 
+ColFn = typing.Callable[[tuple], typing.Any]
 
-def _code_or_box_number(i) -> str:
-    if i.code is not None:
-        return i.code
-    if i.box_number is not None:
-        value = str(i.box_number)
+
+def _code_or_box_number(row) -> str:
+    if row[_CODE] is not None:
+        return row[_CODE]
+    if row[_BOX_NUMBER] is not None:
+        value = str(row[_BOX_NUMBER])
     else:
         value = "?"
     return " box {0:<3}".format(value)
 
 
+# Columns are (title, field name), (title, field name for width, function of value row),
+# or (title, frozenset of states for a flag column).
 COLUMNS = (
     (_("Vendor id"), "vendor_id"),
     (_("Barcode"), "code", _code_or_box_number),
     (_("Price"), "price"),
-    (_("Brought"), lambda i: i.state in (Item.BROUGHT, Item.STAGED, Item.SOLD, Item.COMPENSATED, Item.RETURNED)),
-    (_("Sold"), lambda i: i.state in (Item.SOLD, Item.COMPENSATED)),
-    (_("Compensated / Returned"), lambda i: i.state in (Item.COMPENSATED, Item.RETURNED)),
-    (_("Name"), lambda i: i.box_description if i.box_description is not None else i.name),
+    (_("Brought"), frozenset((Item.BROUGHT, Item.STAGED, Item.SOLD, Item.COMPENSATED, Item.RETURNED))),
+    (_("Sold"), frozenset((Item.SOLD, Item.COMPENSATED))),
+    (_("Compensated / Returned"), frozenset((Item.COMPENSATED, Item.RETURNED))),
+    (_("Name"), lambda r: r[_BOX_DESCRIPTION] if r[_BOX_DESCRIPTION] is not None else r[_NAME]),
 )
 
+# Number of items read from the database at once.
+ITEM_CHUNK_SIZE = 2000
+
 
 @login_required
 def dump_items_view(request, event_slug):
@@ -56,23 +67,33 @@ def dump_items_view(request, event_slug):
     )
 
 
-def _process_column(item, column: typing.Tuple[str, typing.Union[str, ColFn]], as_text):
+def _column_formatter(column: typing.Tuple, as_text, typed=False) -> ColFn:
+    """
+    Get function that returns the value of the column from a value row of `FIELDS`.
+
+    :param typed: If True, flag columns are returned as bools instead of marks.
+    """
     ref = column[-1]
     if isinstance(ref, str):
-        value = getattr(item, ref)
+        index = FIELDS.index(ref)
         if as_text:
-            return value if value is not None else ""
-        return value
-    elif callable(ref):
-        value = ref(item)
-        if isinstance(value, bool):
-            if as_text:
-                return "\u2612" if value else "\u2610"  # BALLOT BOX WITH X and BALLOT BOX
-            return "X" if value else None
+            return lambda row: row[index] if row[index] is not None else ""
+        return operator.itemgetter(index)
+    elif isinstance(ref, frozenset):
+        if typed:
+            return lambda row: row[_STATE] in ref
+        if as_text:
+            checked, unchecked = "\u2612", "\u2610"  # BALLOT BOX WITH X and BALLOT BOX
         else:
-            if as_text:
+            checked, unchecked = "X", None
+        return lambda row: checked if row[_STATE] in ref else unchecked
+    elif callable(ref):
+        if as_text:
+            def text_value(row):
+                value = ref(row)
                 return value if value is not None else ""
-            return value
+            return text_value
+        return ref
     else:
         raise NotImplementedError(column[0] + " " + repr(ref))
 
@@ -106,10 +127,6 @@ class TextWriter(object):
 
 def item_dump(output, event: typing.Union[Event, RemoteEvent], as_text):
     items = Item.objects.using(event.get_real_database_alias()).filter(vendor__event=event)
-    items = items.annotate(
-        box_description=F("box__description"),
-        box_number=F("box__box_number"),
-    )
 
     if as_text:
         straight_column_names = [c[1] for c in COLUMNS if isinstance(c[1], str)]
@@ -133,6 +150,21 @@ def item_dump(output, event: typing.Union[Event, RemoteEvent], as_text):
     # Used here and later for buffer streaming and clearing in case of StringIO.
     yield
 
-    for item in items.order_by("vendor__id", "name", "box", "id"):
-        writer.writerow(_process_column(item, c, as_text) for c in COLUMNS)
+    for row in item_rows(event, as_text):
+        writer.writerow(row)
         yield
+
+
+def item_rows(event: typing.Union[Event, RemoteEvent], as_text=False, typed=False) -> typing.Iterator[list]:
+    """
+    Iterate values of `COLUMNS` for items of the event.
+    """
+    formatters = tuple(_column_formatter(c, as_text, typed) for c in COLUMNS)
+    rows = (Item.objects
+            .using(event.get_real_database_alias())
+            .filter(vendor__event=event)
+            .order_by("vendor__id", "name", "box", "id")
+            .values_list(*FIELDS)
+            .iterator(chunk_size=ITEM_CHUNK_SIZE))
+    for row in rows:
+        yield [f(row) for f in formatters]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from asgiref.sync import sync_to_async
+from django.core.exceptions import PermissionDenied
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+
+from .. import ajax_util
+from ..models import Event, EventPermission
+from ..stats_feed import subscribe
+
+__all__ = [
+    "live_stats",
+]
+
+
+@sync_to_async
+def _get_event(request, event_slug):
+    event = get_object_or_404(Event, slug=event_slug)
+    if not EventPermission.get(event, request.user).can_see_statistics:
+        try:
+            ajax_util.require_user_features(counter=True, clerk=True, staff_override=True)(lambda _: None)(request)
+        except ajax_util.AjaxError:
+            raise PermissionDenied()
+    return event.get_real_event()
+
+
+async def live_stats(request, event_slug):
+    """
+    Server-sent events of new statistics graph rows and general counters, see `StatsFeed`.
+    Requires the site to be served through ASGI, as each viewer keeps its connection open.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse("Live statistics require an ASGI server.", status=501, content_type="text/plain")
+    event = await _get_event(request, event_slug)
+
+    response = StreamingHttpResponse(subscribe(event), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Disable buffering in nginx.
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -15,13 +15,15 @@ class MenuItem(typing.NamedTuple):
     url: typing.Optional[str]
     active: typing.Optional[bool]
     sub_items: typing.Optional[typing.List["MenuItem"]]
+    # Form data to POST to url, for items that cause side effects.
+    post: typing.Optional[typing.Dict[str, str]] = None
 
     @staticmethod
     def separator():
         return MenuItem(None, None, None, None)
 
 
-def _fill(event: Event, active: str, name, func, sub=None, query=None, is_global=False):
+def _fill(event: Event, active: str, name, func, sub=None, query=None, is_global=False, post=None):
     if not is_global:
         kwargs = {"event_slug": event.slug}
     else:
@@ -31,7 +33,7 @@ def _fill(event: Event, active: str, name, func, sub=None, query=None, is_global
         link += "?" + "&".join(
             quote(k, safe="") + (("=" + quote(v, safe="")) if v else "")
             for k, v in query.items())
-    return MenuItem(name, link, func == active, sub)
+    return MenuItem(name, link, func == active, sub, post)
 
 
 def management_menu(
@@ -87,9 +89,11 @@ def accounting_menu(
         return [
             fill(_("View"), "kirppu:accounting"),
             fill(_("Download"), "kirppu:accounting", query={"download": ""}),
+            fill(_("Download (XLSX)"), "kirppu:export", post={"table": "accounting", "format": "xlsx"}),
             MenuItem.separator(),
             fill(_("View items"), "kirppu:item_dump", query={"txt": ""}),
             fill(_("View items (CSV)"), "kirppu:item_dump"),
+            fill(_("Download items (XLSX)"), "kirppu:export", post={"table": "items", "format": "xlsx"}),
             MenuItem.separator(),
             fill(_("Accounts"), "kirppu:live_accounts"),
         ]
@@ -45,13 +45,14 @@ from ..models import (
     Event,
     EventPermission,
     Item,
+    ItemStateLogRollup,
     ItemType,
     Vendor,
     UserAdapter,
     UIText,
     Receipt,
 )
-from ..stats import ItemCountData, ItemEurosData
+from ..stats import ItemCountData, ItemCountEurosData, distribution, general_stats
 from ..util import get_form
 from ..utils import (
     barcode_view,
@@ -126,22 +127,24 @@ def item_add(request, event):
     data = form.db_values()
     name = data.pop("name")
 
-    for suffix in form.cleaned_data["suffixes"]:
-        if item_cnt >= max_items:
-            error_msg = _(u"You have %(max_items)s items, which is the maximum. No more items can be registered.")
-            return HttpResponseBadRequest(error_msg % {'max_items': max_items})
-        item_cnt += 1
+    suffixes = form.cleaned_data["suffixes"]
+    allowed_suffixes = suffixes[:max(max_items - item_cnt, 0)]
 
-        suffixed_name = (name + u" " + suffix).strip() if suffix else name
-        try:
-            item = Item.new(
-                name=suffixed_name,
-                vendor=vendor,
-                **data
-            )
-        except ValidationError as e:
-            return HttpResponseBadRequest(" ".join(e.messages))
+    names = [(name + u" " + suffix).strip() if suffix else name for suffix in allowed_suffixes]
+    try:
+        items = Item.new_many(
+            names,
+            vendor=vendor,
+            **data
+        )
+    except ValidationError as e:
+        return HttpResponseBadRequest(" ".join(e.messages))
+
+    if len(allowed_suffixes) < len(suffixes):
+        error_msg = _(u"You have %(max_items)s items, which is the maximum. No more items can be registered.")
+        return HttpResponseBadRequest(error_msg % {'max_items': max_items})
 
+    for item in items:
         item_dict = item.as_public_dict()
         item_dict['barcode_dataurl'] = get_dataurl(item.code, 'png')
         response.append(item_dict)
@@ -236,6 +239,7 @@ def item_update_price(request, event, code):
         if item.is_locked():
             return HttpResponseBadRequest("Item has been brought to event. Price can't be changed.")
 
+        ItemStateLogRollup.objects.add_price_changes([item], price)
         item.price = str(price)
         item.save(update_fields=("price",))
 
@@ -693,14 +697,16 @@ def stats_view(request, event: Event):
     """Stats view."""
     original_event = event
     event = event.get_real_event()
-    ic = ItemCountData(ItemCountData.GROUP_ITEM_TYPE, event=event)
-    ie = ItemEurosData(ItemEurosData.GROUP_ITEM_TYPE, event=event)
     sum_name = _("Sum")
-    item_types = (ItemType.objects
-                  .using(event.get_real_database_alias())
-                  .filter(event=event)
-                  .order_by("order")
-                  .values_list("id", "title"))
+    item_types = list(ItemType.objects
+                      .using(event.get_real_database_alias())
+                      .filter(event=event)
+                      .order_by("order")
+                      .values_list("id", "title"))
+    type_data = ItemCountEurosData(ItemCountEurosData.GROUP_ITEM_TYPE, event=event,
+                                   item_types=[item_type for item_type, _type_name in item_types])
+    ic = type_data.counts
+    ie = type_data.euros
 
     number_of_items = [
         ic.data_set(item_type, type_name)
@@ -716,8 +722,9 @@ def stats_view(request, event: Event):
 
     vendor_item_data_counts = []
     vendor_item_data_euros = []
-    vic = ItemCountData(ItemCountData.GROUP_VENDOR, event=event)
-    vie = ItemEurosData(ItemEurosData.GROUP_VENDOR, event=event)
+    vendor_data = ItemCountEurosData(ItemCountEurosData.GROUP_VENDOR, event=event)
+    vic = vendor_data.counts
+    vie = vendor_data.euros
     vie.use_cents = True
     vendor_item_data_row_size = 0
 
@@ -760,29 +767,6 @@ def type_stats_view(request, event: Event, type_id):
     })
 
 
-def _float_array(array):
-    # noinspection PyPep8Naming
-    INFINITY = float('inf')
-
-    def _float(f):
-        if f != f:
-            return "NaN"
-        elif f == INFINITY:
-            return 'Infinity'
-        elif f == -INFINITY:
-            return '-Infinity'
-        return float.__repr__(f)
-
-    line_length = 20
-
-    o = [
-        ", ".join(_float(e) for e in array[i:i + line_length])
-        for i in range(0, len(array), line_length)
-    ]
-
-    return "[\n" + ",\n".join(o) + "]"
-
-
 @ensure_csrf_cookie
 @_statistics_access
 def statistical_stats_view(request, event: Event):
@@ -791,79 +775,30 @@ def statistical_stats_view(request, event: Event):
     database = event.get_real_database_alias()
     brought_states = (Item.BROUGHT, Item.STAGED, Item.SOLD, Item.COMPENSATED, Item.RETURNED)
 
-    _items = Item.objects.using(database).filter(vendor__event=event)
     _vendors = Vendor.objects.using(database).filter(event=event)
-    _boxes = Box.objects.using(database).filter(representative_item__vendor__event=event)
-
-    registered = _items.count()
-    deleted = _items.filter(hidden=True).count()
-    brought_q = _items.filter(state__in=brought_states)
-    brought = brought_q.count()
-    sold = _items.filter(state__in=(Item.STAGED, Item.SOLD, Item.COMPENSATED)).count()
-    printed_deleted = _items.filter(hidden=True, printed=True).count()
-    printed_not_brought = _items.filter(printed=True, state=Item.ADVERTISED).count()
-
-    items_in_box = _items.filter(box__isnull=False).count()
-    items_not_in_box = _items.filter(box__isnull=True).count()
-    brought_box_items = brought_q.filter(box__isnull=False).count()
-    registered_boxes = _boxes.count()
-    deleted_boxes = _boxes.filter(representative_item__hidden=True).count()
-    brought_boxes = _boxes.filter(representative_item__state__in=brought_states).count()
-    items_in_deleted_boxes = _items.filter(box__representative_item__hidden=True).count()
-
-    general = {
-        "registered": registered,
-        "deleted": deleted,
-        "deletedOfRegistered": (deleted * 100.0 / registered) if registered > 0 else 0,
-        "brought": brought,
-        "broughtOfRegistered": (brought * 100.0 / registered) if registered > 0 else 0,
-        "broughtBoxItems": brought_box_items,
-        "broughtBoxItemsOfRegistered": (brought_box_items * 100.0 / items_in_box) if items_in_box > 0 else 0,
-        "printedDeleted": printed_deleted,
-        "printedNotBrought": printed_not_brought,
-        "sold": sold,
-        "soldOfBrought": (sold * 100.0 / brought) if brought > 0 else 0,
-        "vendors": _vendors.filter(item__state__in=brought_states).distinct().count(),
-        "vendorsTotal": _vendors.annotate(items=models.Count("item__id")).filter(items__gt=0).count(),
-        "vendorsInMobileView": _vendors.filter(mobile_view_visited=True).count(),
-
-        "itemsInBox": items_in_box,
-        "itemsNotInBox": items_not_in_box,
-        "broughtBoxes": brought_boxes,
-        "broughtBoxesOfRegistered": (brought_boxes * 100.0 / registered_boxes) if registered_boxes > 0 else 0,
-        "registeredBoxes": registered_boxes,
-        "deletedBoxes": deleted_boxes,
-        "deletedOfRegisteredBoxes": (deleted_boxes * 100.0 / registered_boxes) if registered_boxes > 0 else 0,
-        "itemsInDeletedBoxes": items_in_deleted_boxes,
-        "itemsInDeletedBoxesOfRegistered": (items_in_deleted_boxes * 100.0 / registered) if registered > 0 else 0,
-    }
 
-    compensations = _vendors.filter(item__state=Item.COMPENSATED) \
-        .annotate(v_sum=models.Sum("item__price")).order_by("v_sum").values_list("v_sum", flat=True)
-    compensations = [float(e) for e in compensations]
+    general = dict(general_stats(event))
 
-    purchases = list(
-        Receipt.objects.using(database).filter(counter__event=event, status=Receipt.FINISHED, type=Receipt.TYPE_PURCHASE)
-        .order_by("total")
-        .values_list("total", flat=True)
-    )
-    purchases = [float(e) for e in purchases]
-    general["purchases"] = len(purchases)
-
-    brought_distribution = (
-        _vendors
-        .filter(item__state__in=brought_states)
-        .annotate(item_count=models.Count("item__id"))
-        .filter(item_count__gt=0)
-        .order_by("item_count")
-        .values_list("item_count", flat=True)
-    )
+    # Per-vendor values are subqueries, so that they can be grouped to histogram buckets in the database.
+    vendor_items = Item.objects.using(database).filter(vendor=models.OuterRef("pk")).order_by().values("vendor")
+    compensations = _vendors.annotate(v_sum=models.Subquery(
+        vendor_items.filter(state=Item.COMPENSATED).annotate(v_sum=models.Sum("price")).values("v_sum")
+    ))
+
+    purchases = Receipt.objects.using(database).filter(
+        counter__event=event, status=Receipt.FINISHED, type=Receipt.TYPE_PURCHASE)
+    purchases = distribution(purchases, "total", 2)
+    general["purchases"] = purchases["count"]
+
+    brought_distribution = _vendors.annotate(item_count=models.Subquery(
+        vendor_items.filter(state__in=brought_states).annotate(item_count=models.Count("id")).values("item_count")
+    ))
 
     return render(request, "kirppu/general_stats.html", {
         "event": original_event,
-        "compensations": _float_array(compensations),
-        "purchases": _float_array(purchases),
-        "brought": "[" + ",".join(str(e) for e in brought_distribution) + "]",
+        "compensations": distribution(compensations, "v_sum", 50),
+        "purchases": purchases,
+        "brought": distribution(brought_distribution, "item_count", 5),
         "general": general,
         "CURRENCY": settings.KIRPPU_CURRENCY["raw"],
     })
@@ -1038,21 +973,20 @@ def adjust_box_size(request, event_slug):
         elif existing_count < item_count:
             to_add = item_count - existing_count
 
-            # Unhide first up to to_add items.
-            hidden_items = Item.objects.filter(box=box, hidden=True).order_by("id")
-            unhide = min(len(hidden_items), to_add)
-            for i in range(unhide):
-                item = hidden_items[i]
-                item.hidden = False
-                item.save(update_fields=["hidden"])
-
-            new_state = Item.ADVERTISED if representative_item.state == Item.ADVERTISED else Item.BROUGHT
-
-            # If we need more items, clone them.
-            add = max(to_add - len(hidden_items), 0)
-            for i in range(add):
-                Item.new(
-                    name=representative_item.name,
+            with transaction.atomic():
+                # Unhide first up to to_add items.
+                hidden_items = list(
+                    Item.objects.filter(box=box, hidden=True).order_by("id").values_list("id", flat=True)
+                )
+                unhide = min(len(hidden_items), to_add)
+                Item.objects.filter(id__in=hidden_items[:unhide]).update(hidden=False)
+
+                new_state = Item.ADVERTISED if representative_item.state == Item.ADVERTISED else Item.BROUGHT
+
+                # If we need more items, clone them.
+                add = max(to_add - len(hidden_items), 0)
+                Item.new_many(
+                    [representative_item.name] * add,
                     box=box,
                     no_code=True,
 
@@ -1071,11 +1005,11 @@ def adjust_box_size(request, event_slug):
         else:
             to_remove = existing_count - item_count
 
-            visible_items = Item.objects.filter(box=box, hidden=False,
-                                                state__in=(Item.ADVERTISED, Item.BROUGHT)).order_by("-id")[:to_remove]
-            for item in visible_items:
-                item.hidden = True
-                item.save(update_fields=["hidden"])
+            visible_items = list(
+                Item.objects.filter(box=box, hidden=False, state__in=(Item.ADVERTISED, Item.BROUGHT))
+                .order_by("-id").values_list("id", flat=True)[:to_remove]
+            )
+            Item.objects.filter(id__in=visible_items).update(hidden=True)
 
             if len(visible_items) != to_remove:
                 to_remove = "(only) {}/{}".format(len(visible_items), to_remove)
@@ -353,6 +353,53 @@ KIRPPU_MOBILE_LOGIN_RATE_LIMIT = "5/m"
 # Show list of unused counters using clerk code without registering the counter?
 KIRPPU_COUNTER_LIST = env.bool("KIRPPU_COUNTER_LIST", default=False)
 
+# Seconds that validated Clerk and Counter login data may be cached per process. Zero disables the cache.
+KIRPPU_AUTH_CACHE_SECONDS = env.int("KIRPPU_AUTH_CACHE_SECONDS", default=5)
+
+# Seconds that Event looked up by checkout API may be cached per process. Zero disables the cache.
+# Local changes are seen immediately, changes done in other processes after this time.
+KIRPPU_EVENT_CACHE_SECONDS = env.int("KIRPPU_EVENT_CACHE_SECONDS", default=10)
+
+# Dotted path to serializer class for checkout API results. If None, orjson is used when installed.
+# See kirppu.ajax_util.JsonSerializer.
+KIRPPU_AJAX_SERIALIZER = None
+
+# List results longer than this are streamed in chunks instead of encoding them at once. None disables.
+KIRPPU_AJAX_STREAM_THRESHOLD = 2000
+
+# Seconds that finished buckets of statistics graphs are kept in Django cache. Zero disables the cache.
+KIRPPU_STATS_CACHE_SECONDS = env.int("KIRPPU_STATS_CACHE_SECONDS", default=3600)
+
+# Target number of points in statistics graphs when their resolution is selected automatically.
+KIRPPU_STATS_GRAPH_POINTS = env.int("KIRPPU_STATS_GRAPH_POINTS", default=1000)
+
+# Seconds between database reads of live statistics feed. The feed needs the site to be served through ASGI.
+KIRPPU_LIVE_STATS_INTERVAL = env.int("KIRPPU_LIVE_STATS_INTERVAL", default=10)
+
+# Seconds that general statistics counters are kept in Django cache. Zero disables the cache.
+KIRPPU_GENERAL_STATS_CACHE_SECONDS = env.int("KIRPPU_GENERAL_STATS_CACHE_SECONDS", default=30)
+
+# Exported CSV and text files are sent in chunks of this many characters or rows, whichever comes first.
+KIRPPU_CSV_FLUSH_BYTES = env.int("KIRPPU_CSV_FLUSH_BYTES", default=64 * 1024)
+KIRPPU_CSV_FLUSH_ROWS = env.int("KIRPPU_CSV_FLUSH_ROWS", default=1000)
+
+# Number of worker processes for exports in each web process. Zero makes exports in the request instead.
+# The workers and the export directory assume a single web host: the export is written on the host that
+# started it, and the download page polled after that must be served by the same host. With several hosts,
+# either use sticky sessions or set this to zero and share KIRPPU_EXPORT_DIR between the hosts.
+KIRPPU_EXPORT_WORKERS = env.int("KIRPPU_EXPORT_WORKERS", default=1)
+
+# Directory for finished exports. If None, a directory private to the server user is created in the system
+# temporary directory.
+KIRPPU_EXPORT_DIR = env.str("KIRPPU_EXPORT_DIR", default=None)
+
+# Seconds that finished exports are kept.
+KIRPPU_EXPORT_MAX_AGE = env.int("KIRPPU_EXPORT_MAX_AGE", default=24 * 3600)
+
+# Seconds that an unfinished export is kept before it is considered abandoned, e.g. by a stopped web process.
+# This must be longer than any export takes, including its time waiting for a free worker.
+KIRPPU_EXPORT_PART_MAX_AGE = env.int("KIRPPU_EXPORT_PART_MAX_AGE", default=7 * 24 * 3600)
+
 CSRF_FAILURE_VIEW = "kirppu.views.kirppu_csrf_failure"
 
 AUTHENTICATION_BACKENDS = [